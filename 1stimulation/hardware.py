@@ -0,0 +1,378 @@
+# hardware.py
+# ハードウェアバックエンドの切り替え (実機 Raspberry Pi / ソフトウェアシミュレーション)
+#
+#   GEL_BACKEND=rpi (既定) : RPi.GPIO / board / busio / adafruit_ina219 をそのまま使用
+#   GEL_BACKEND=sim        : ソフトウェアの INA219・GPIO とゲルの応答モデルを使用
+#   GEL_SIM_SPEED=20       : シミュレーション時の仮想時計の倍速 (実時間の20倍で進む)
+#   GEL_REPLAY を指定した場合 (記録データ再生) は sim が既定になる
+#   GEL_SIM_ORIGIN         : 仮想時計の基準 (runtime.py が子プロセスの時計を親プロセスと揃えるために設定)
+#
+# 各プログラムは time.time()/time.sleep() の代わりに backend.clock を使うことで，
+# シミュレーション時は仮想時計に従って実時間より速く動作する．
+# SteppedClock は呼び出し側が進める時計で，待ち時間なしのヘッドレス実行 (pongsim.py) に使う．
+
+import os
+import math
+import time
+import random
+import threading
+from types import SimpleNamespace
+
+# --- ゲルモデルの既定値 ---
+# INA219 のアドレス → 計測チャンネル (0: Black/上, 1: Brown/中, 2: Red/下)
+SENSOR_CHANNELS = {0x40: 0, 0x41: 1, 0x44: 2}
+
+# 電極ピン → 各センサー電流への寄与 [mA] (tra_plotter.py の配置に準拠)
+#   上段: YELLOW(21), WHITE(20) / 中段: BLUE(8), PURPLE(15) / 下段: GREY(18), GREEN(24)
+# ピン配置・出力レベルの異なるプログラム (1stimulation) は get_backend(gains=..., active_level=...) で指定する
+DEFAULT_GAINS = {
+    21: (6.0, 2.0, 0.5), 20: (6.0, 2.0, 0.5),
+    8:  (2.0, 5.0, 2.0), 15: (2.0, 5.0, 2.0),
+    18: (0.5, 2.0, 7.0), 24: (0.5, 2.0, 7.0),
+}
+DEFAULT_OFFSETS = (-2.0, -2.0, -3.0)   # 無刺激時の電流 [mA]
+DEFAULT_TAUS = (3.0, 3.0, 3.0)         # 1次遅れの時定数 [s]
+
+
+class RealClock:
+    """実時間の時計 (実機用)"""
+
+    speed = 1.0
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, sec):
+        if sec > 0:
+            time.sleep(sec)
+
+
+class VirtualClock:
+    """実時間を speed 倍で進める仮想時計 (全スレッドで共有)
+
+    origin に別プロセスの時計の origin() を渡すと同じ時刻を刻む (time.monotonic はプロセス間で共通)
+    """
+
+    def __init__(self, speed=1.0, start=None, origin=None):
+        self.speed = float(speed)
+        if origin is not None:
+            self._real0, self._wall0 = origin
+        else:
+            self._real0 = time.monotonic()
+            self._wall0 = time.time() if start is None else start
+
+    def origin(self):
+        return self._real0, self._wall0
+
+    def time(self):
+        return self._wall0 + self.monotonic()
+
+    def monotonic(self):
+        return (time.monotonic() - self._real0) * self.speed
+
+    def sleep(self, sec):
+        if sec > 0:
+            time.sleep(sec / self.speed)
+
+
+class SteppedClock:
+    """advance() で進める時計 (ヘッドレスシミュレーション用．sleep() も待たずに時刻を進める)"""
+
+    speed = 1.0
+
+    def __init__(self, start=None):
+        self._t = 0.0
+        self._wall0 = time.time() if start is None else start
+
+    def advance(self, sec):
+        self._t += sec
+
+    def time(self):
+        return self._wall0 + self._t
+
+    def monotonic(self):
+        return self._t
+
+    def sleep(self, sec):
+        if sec > 0:
+            self._t += sec
+
+
+class GelModel:
+    """電極ピンの印加状態に1次遅れで応答する3チャンネル電流モデル"""
+
+    def __init__(self, clock, gains=None, offsets=DEFAULT_OFFSETS, taus=DEFAULT_TAUS,
+                 noise=0.0, active_level=1, seed=None):
+        self.clock = clock
+        self.gains = dict(DEFAULT_GAINS if gains is None else gains)
+        self.offsets = list(offsets)
+        self.taus = list(taus)
+        self.noise = noise
+        self.active_level = active_level
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._levels = {}
+        self._values = list(offsets)
+        self._targets = list(offsets)
+        self._t = clock.monotonic()
+
+    def set_level(self, pin, level):
+        with self._lock:
+            self._advance()
+            self._levels[pin] = level
+            self._targets = self._target()
+
+    def read(self, channel):
+        """チャンネルの現在電流 [mA]"""
+        with self._lock:
+            self._advance()
+            value = self._values[channel]
+        if self.noise:
+            value += self._rng.gauss(0.0, self.noise)
+        return value
+
+    def _target(self):
+        target = list(self.offsets)
+        for pin, level in self._levels.items():
+            if level == self.active_level and pin in self.gains:
+                for k, g in enumerate(self.gains[pin]):
+                    target[k] += g
+        return target
+
+    def _advance(self):
+        # 前回評価時刻からの経過時間分だけ厳密解で状態を進める
+        now = self.clock.monotonic()
+        dt = now - self._t
+        if dt <= 0:
+            return
+        self._t = now
+        for k in range(len(self._values)):
+            tau = self.taus[k]
+            alpha = 1.0 - math.exp(-dt / tau) if tau > 0 else 1.0
+            self._values[k] += (self._targets[k] - self._values[k]) * alpha
+
+
+class SimGPIO:
+    """RPi.GPIO 互換のソフトウェアGPIO (出力レベルをゲルモデルへ反映)"""
+
+    BOARD = 10
+    BCM = 11
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+
+    def __init__(self, model=None):
+        self.model = model
+        self.mode = None
+        self.levels = {}
+        self.writeCount = 0
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, channel, direction, initial=None, pull_up_down=None):
+        for pin in _as_list(channel):
+            self.levels.setdefault(pin, self.LOW)
+            if direction == self.OUT and initial is not None:
+                self._write(pin, initial)
+
+    def output(self, channel, value):
+        pins = _as_list(channel)
+        values = _as_list(value) if isinstance(value, (list, tuple)) else [value] * len(pins)
+        for pin, level in zip(pins, values):
+            self._write(pin, level)
+
+    def input(self, channel):
+        return self.levels.get(channel, self.LOW)
+
+    def cleanup(self, channel=None):
+        pins = list(self.levels) if channel is None else _as_list(channel)
+        for pin in pins:
+            # RPi.GPIO は未設定のピンの cleanup を警告で済ませるので，落とさない
+            if pin in self.levels:
+                self._write(pin, self.LOW)
+            self.levels.pop(pin, None)
+
+    def _write(self, pin, level):
+        level = self.HIGH if level else self.LOW
+        self.levels[pin] = level
+        self.writeCount += 1
+        if self.model is not None:
+            self.model.set_level(pin, level)
+
+
+class SimI2C:
+    """busio.I2C の代わり．SENSOR_CHANNELS の各アドレスに INA219 のレジスタを模擬する
+
+    設定・校正レジスタの書き込みと，レジスタポインタを使った読み出しに対応する．
+    電流レジスタは実機と同じく シャント電圧 × 校正値 / 4096 で計算する (校正値 0 では 0)．
+    """
+
+    RSHUNT = 0.1            # シャント抵抗 [ohm]
+    POWER_ON_CONFIG = 0x399F   # リセット直後の設定レジスタ
+
+    def __init__(self, model):
+        self.model = model
+        self.transactions = 0   # I2C トランザクション数
+        self._lock = threading.Lock()
+        self._regs = {}
+        self._pointer = {}
+        for addr in SENSOR_CHANNELS:
+            self.reset_device(addr)
+
+    def try_lock(self):
+        return self._lock.acquire(False)
+
+    def unlock(self):
+        self._lock.release()
+
+    def scan(self):
+        return sorted(SENSOR_CHANNELS)
+
+    def deinit(self):
+        pass
+
+    def reset_device(self, addr):
+        """電源投入直後の状態に戻す (校正値が消える)"""
+        self._regs[addr] = {0x00: self.POWER_ON_CONFIG, 0x05: 0}
+        self._pointer[addr] = 0x00
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        self.transactions += 1
+        self._write(address, bytes(buffer[start:end]))
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        self.transactions += 1
+        self._read(address, buffer, start, len(buffer) if end is None else end)
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *,
+                              out_start=0, out_end=None, in_start=0, in_end=None):
+        # リピーテッドスタートによる1回のトランザクション
+        self.transactions += 1
+        self._write(address, bytes(buffer_out[out_start:out_end]))
+        self._read(address, buffer_in, in_start, len(buffer_in) if in_end is None else in_end)
+
+    def _device(self, address):
+        if address not in self._regs:
+            raise OSError(121, "Remote I/O error")
+        return self._regs[address]
+
+    def _write(self, address, data):
+        regs = self._device(address)
+        if not data:
+            return
+        self._pointer[address] = data[0]
+        if len(data) >= 3:
+            value = (data[1] << 8) | data[2]
+            if data[0] == 0x00 and value & 0x8000:
+                self.reset_device(address)
+            elif data[0] in (0x00, 0x05):
+                regs[data[0]] = value & (0xFFFE if data[0] == 0x05 else 0xFFFF)
+
+    def _read(self, address, buffer, start, end):
+        value = self._register(address, self._pointer[address]) & 0xFFFF
+        data = value.to_bytes(2, "big")
+        for i in range(start, end):
+            buffer[i] = data[i - start] if i - start < 2 else 0
+
+    def _register(self, address, reg):
+        regs = self._regs[address]
+        if reg in (0x00, 0x05):
+            return regs[reg]
+        shunt = self._shunt(address)
+        if reg == 0x01:
+            return shunt
+        if reg == 0x02:
+            return 0x0002   # バス電圧 0V，変換完了
+        if reg == 0x04:
+            return int(shunt * regs[0x05] / 4096)
+        return 0
+
+    def _shunt(self, address):
+        """シャント電圧レジスタの値 (1LSB = 10uV，PGA の範囲でクリップ)"""
+        current = self.model.read(SENSOR_CHANNELS[address])   # [mA]
+        limit = 4000 << ((self._regs[address][0x00] >> 11) & 0x3)
+        value = round(current / 1000 * self.RSHUNT / 10e-6)
+        return max(-limit, min(limit, value))
+
+
+class SimINA219:
+    """adafruit_ina219.INA219 互換のソフトウェアセンサー"""
+
+    def __init__(self, i2c, addr=0x40):
+        if addr not in SENSOR_CHANNELS:
+            raise ValueError(f"No I2C device at address: {hex(addr)}")
+        self.model = i2c.model
+        self.channel = SENSOR_CHANNELS[addr]
+        self.i2c_device = SimpleNamespace(device_address=addr)
+
+    @property
+    def current(self):
+        return self.model.read(self.channel)
+
+
+class Backend:
+    """GPIO・I2C・INA219・時計をまとめたハードウェアバックエンド"""
+
+    def __init__(self, name, GPIO, board, busio, INA219, clock, model=None):
+        self.name = name
+        self.GPIO = GPIO
+        self.board = board
+        self.busio = busio
+        self.INA219 = INA219
+        self.clock = clock
+        self.model = model
+
+    @property
+    def simulated(self):
+        return self.name != "rpi"
+
+
+def make_rpi_backend():
+    import RPi.GPIO as GPIO
+    import board
+    import busio
+    from adafruit_ina219 import INA219
+    return Backend("rpi", GPIO, board, busio, INA219, RealClock())
+
+
+def make_sim_backend(speed=1.0, origin=None, **model_options):
+    """ソフトウェアのゲルモデルで動作するバックエンドを作る (origin は VirtualClock を参照)"""
+    clock = VirtualClock(speed, origin=origin)
+    model = GelModel(clock, **model_options)
+    board = SimpleNamespace(SCL="SCL", SDA="SDA")
+    busio = SimpleNamespace(I2C=lambda scl, sda: SimI2C(model))
+    return Backend("sim", SimGPIO(model), board, busio, SimINA219, clock, model)
+
+
+_backend = None
+
+
+def get_backend(name=None, **sim_options):
+    """プロセス内で共有するバックエンドを返す (初回呼び出し時に生成)"""
+    global _backend
+    if _backend is None:
+        # 記録データ再生 (GEL_REPLAY) 時は実機がなくても動くよう既定をシミュレーションにする
+        default = "sim" if os.environ.get("GEL_REPLAY") else "rpi"
+        name = name or os.environ.get("GEL_BACKEND", default)
+        if name == "rpi":
+            _backend = make_rpi_backend()
+        elif name == "sim":
+            sim_options.setdefault("speed", float(os.environ.get("GEL_SIM_SPEED", "1")))
+            if os.environ.get("GEL_SIM_ORIGIN"):
+                sim_options.setdefault("origin", tuple(float(v) for v in os.environ["GEL_SIM_ORIGIN"].split(",")))
+            _backend = make_sim_backend(**sim_options)
+        else:
+            raise ValueError(f"Unknown hardware backend: {name}")
+    return _backend
+
+
+def _as_list(x):
+    return list(x) if isinstance(x, (list, tuple)) else [x]
@@ -0,0 +1,233 @@
+# stimprog.py
+# 刺激プログラム (パルス列のスケジュール) を絶対時刻の締め切りで実行するエンジン
+#
+# 各エッジの予定時刻は開始時刻からの整数ミリ秒で計算し，締め切り「開始時刻 + 予定時刻」まで
+# 待ってから出力する．sleep の誤差が次のエッジに積み重ならないため，10時間の実行でもずれない．
+# 実際にエッジを出力した時刻を予定時刻と並べて CSV に記録する．
+#
+# 出力回路は OutputProfile で指定する．
+#   relay_hbridge_profile : リレー H ブリッジ (4ピン, relay_ina_1.py)
+#   transistor_profile    : トランジスタ回路 (2ピン, tra_ina_1.py)
+
+import threading
+from hardware import RealClock
+
+
+class OutputProfile:
+    """極性 (1: 正, -1: 逆, 0: OFF) ごとの各ピンの出力レベル
+
+    deadTime : 極性を反転する前に挟む OFF の時間 [s] (一方のリレーが離れてから他方を動かす)
+    """
+
+    def __init__(self, name, pins, patterns, idle, deadTime=0.0):
+        self.name = name
+        self.pins = list(pins)
+        self.patterns = {k: list(v) for k, v in patterns.items()}
+        self.idle = idle          # 初期化・終了時に全ピンへ出力するレベル
+        self.deadTime = deadTime
+
+    def supports(self, polarity):
+        return polarity in self.patterns
+
+    def setup(self, GPIO):
+        GPIO.setup(self.pins, GPIO.OUT, initial=self.idle)
+
+    def apply(self, GPIO, polarity):
+        if polarity not in self.patterns:
+            raise ValueError(f"{self.name} profile does not support polarity {polarity}")
+        GPIO.output(self.pins, self.patterns[polarity])
+
+    def release(self, GPIO):
+        GPIO.output(self.pins, [self.idle] * len(self.pins))
+
+
+def relay_hbridge_profile(pos1, pos2, neg1, neg2, active, inactive, allowReverse=False, deadTime=0.005):
+    """4ピンのリレー H ブリッジ (ACTIVE=LOW のリレーモジュール)
+
+    逆極性 (-1) は POS 側と NEG 側の IN1 を入れ替えた配線を想定しており，実機の配線が未確認のため
+    allowReverse=True を指定した場合のみ使える．極性の反転時は deadTime [s] だけ OFF を挟む．
+    """
+    patterns = {
+        0: [inactive, active, inactive, active],
+        1: [active, active, inactive, active],
+    }
+    if allowReverse:
+        patterns[-1] = [inactive, active, active, active]
+    return OutputProfile("relay", [pos1, pos2, neg1, neg2], patterns, inactive, deadTime)
+
+
+def transistor_profile(pos, neg, active, inactive):
+    """2ピンのトランジスタ回路 (正極性は POS 側，逆極性は NEG 側を ON)"""
+    return OutputProfile("transistor", [pos, neg], {
+        0: [inactive, inactive],
+        1: [active, inactive],
+        -1: [inactive, active],
+    }, inactive)
+
+
+class Train:
+    """ON/OFF を繰り返すパルス列
+
+    on, off     : ON / OFF の時間 [s] (1ms 単位に丸める)
+    repeat      : 繰り返し回数 (None でプログラムの終了まで繰り返す)
+    polarity    : ON 時の極性 (1 / -1)
+    alternate   : ON のたびに極性を反転する
+    onEnd/offEnd: 指定すると最後の回までに ON / OFF の時間を直線的に変化させる (ランプ)
+    offFirst    : 各回を OFF → ON の順にする (従来の relay_control_task と同じ順序)
+    """
+
+    def __init__(self, on, off=0.0, repeat=1, polarity=1, alternate=False,
+                 onEnd=None, offEnd=None, offFirst=False, label="STIM"):
+        if repeat is None and (onEnd is not None or offEnd is not None):
+            raise ValueError("A ramped train needs a finite repeat count")
+        self.on = on
+        self.off = off
+        self.repeat = repeat
+        self.polarity = polarity
+        self.alternate = alternate
+        self.onEnd = on if onEnd is None else onEnd
+        self.offEnd = off if offEnd is None else offEnd
+        self.offFirst = offFirst
+        self.label = label
+
+    def polarities(self):
+        """ON 時に使う極性"""
+        return {self.polarity, -self.polarity} if self.alternate else {self.polarity}
+
+    def phases(self):
+        """(極性, 時間 [ms], 回数, ラベル) を順に返す"""
+        k = 0
+        while self.repeat is None or k < self.repeat:
+            f = k / (self.repeat - 1) if self.repeat and self.repeat > 1 else 0.0
+            onMs = round((self.on + (self.onEnd - self.on) * f) * 1000)
+            offMs = round((self.off + (self.offEnd - self.off) * f) * 1000)
+            pol = -self.polarity if self.alternate and k % 2 else self.polarity
+            steps = [(pol, onMs, f"{self.label} ON"), (0, offMs, f"{self.label} OFF")]
+            if self.offFirst:
+                steps.reverse()
+            for polarity, ms, label in steps:
+                if ms > 0:
+                    yield polarity, ms, k + 1, label
+            k += 1
+
+
+class Rest(Train):
+    """OFF のみの区間"""
+
+    def __init__(self, duration, label="REST"):
+        super().__init__(0.0, duration, label=label)
+
+
+class StimProgram:
+    """刺激スケジュール (Train のリスト) を絶対時刻の締め切りで実行する
+
+    total   : プログラム全体の時間 [s] (None でスケジュールの終わりまで)
+    logPath : エッジの予定時刻・実際の時刻を記録する CSV (None で記録しない)
+    verbose : エッジごとに内容を表示する
+    """
+
+    def __init__(self, GPIO, profile, schedule, clock=None, total=None, logPath=None, verbose=True):
+        self.GPIO = GPIO
+        self.profile = profile
+        self.schedule = list(schedule)
+        for train in self.schedule:
+            for polarity in train.polarities():
+                if max(train.on, train.onEnd) > 0 and not profile.supports(polarity):
+                    raise ValueError(f"{profile.name} profile does not support polarity {polarity}"
+                                     + (" (pass allowReverse=True once the wiring is confirmed)"
+                                        if profile.name == "relay" else ""))
+        self.clock = clock if clock is not None else RealClock()
+        self.totalMs = None if total is None else round(total * 1000)
+        self.logPath = logPath
+        self.verbose = verbose
+        self.edges = 0
+        self.maxError = 0.0      # 予定時刻からの最大の遅れ [s]
+        self._sumError = 0.0
+        self._thread = None
+
+    def plan(self):
+        """(予定時刻 [ms], 極性, 時間 [ms], 回数, ラベル) を順に返す
+
+        ON のまま極性が反転する箇所では，新しい区間の先頭 profile.deadTime の間を OFF にする．
+        """
+        t = 0
+        last = 0
+        gap = round(self.profile.deadTime * 1000)
+        for train in self.schedule:
+            for polarity, ms, cycle, label in train.phases():
+                if gap and polarity and last and polarity != last:
+                    if self.totalMs is not None and t >= self.totalMs:
+                        return
+                    d = min(gap, ms)
+                    yield t, 0, d, cycle, f"{label} (dead time)"
+                    t += d
+                    ms -= d
+                    last = 0
+                    if ms <= 0:
+                        continue
+                if self.totalMs is not None and t >= self.totalMs:
+                    return
+                yield t, polarity, ms, cycle, label
+                t += ms
+                last = polarity
+
+    def run(self, stop=None):
+        """スケジュールを実行する．最後まで実行したら True，stop() で中断したら False"""
+        log = open(self.logPath, "w") if self.logPath else None
+        if log:
+            log.write("edge,cycle,label,polarity,planned_s,actual_s,error_ms,wall_time\n")
+        clock = self.clock
+        self.profile.setup(self.GPIO)
+        t0 = clock.monotonic()
+        try:
+            end = None
+            for plannedMs, polarity, ms, cycle, label in self.plan():
+                if not self._wait(t0 + plannedMs / 1000, stop):
+                    return False
+                self.profile.apply(self.GPIO, polarity)
+                actual = clock.monotonic() - t0
+                self._record(log, cycle, label, polarity, plannedMs / 1000, actual)
+                if self.verbose:
+                    print(f"[{self.profile.name} {cycle}] {label} ({ms / 1000:g}s)")
+                end = plannedMs + ms
+            # 最後の区間の終わり (または total) まで待つ
+            if self.totalMs is not None:
+                end = self.totalMs if end is None else min(end, self.totalMs)
+            if end is not None and not self._wait(t0 + end / 1000, stop):
+                return False
+            return True
+        finally:
+            if log:
+                log.close()
+
+    def start(self, stop=None):
+        """別スレッドで run() を開始する"""
+        self._thread = threading.Thread(target=self.run, args=(stop,), daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def _wait(self, deadline, stop):
+        # 停止要求に素早く応じるため最大 0.1s ずつ待つ
+        clock = self.clock
+        while True:
+            if stop and stop():
+                return False
+            remaining = deadline - clock.monotonic()
+            if remaining <= 0:
+                return True
+            clock.sleep(min(remaining, 0.1))
+
+    def _record(self, log, cycle, label, polarity, planned, actual):
+        error = actual - planned
+        self.edges += 1
+        self._sumError += error
+        if error > self.maxError:
+            self.maxError = error
+        if log:
+            log.write(f"{self.edges},{cycle},{label},{polarity},{planned:.3f},{actual:.6f},"
+                      f"{error * 1000:.3f},{self.clock.time():.6f}\n")
+            log.flush()
+
+    def summary(self):
+        mean = self._sumError / self.edges if self.edges else 0.0
+        return f"{self.edges} edges, edge error mean {mean * 1000:.3f} ms / max {self.maxError * 1000:.3f} ms"
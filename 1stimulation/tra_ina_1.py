@@ -1,32 +1,46 @@
-import RPi.GPIO as GPIO
-import time
-import board
-import busio
-from adafruit_ina219 import INA219
+import hardware
+from sampler import FixedRateSampler
+import stimprog
 from collections import deque
 import matplotlib
-matplotlib.use('TkAgg')
-import matplotlib.pyplot as plt
 import sys
 import threading  # 並列処理用
 
-# --- 設定項目 ---
 # GPIOピン設定
 BLUE_POS = 18
 BLUE_NEG = 1
 
+# シミュレーション (GEL_BACKEND=sim) のゲルモデル: 電極ピン → 各センサー電流への寄与 [mA]
+# (正極性は POS 側，逆極性は NEG 側を HIGH で ON)
+SIM_GAINS = {BLUE_POS: (5.0, 4.0, 3.0), BLUE_NEG: (-5.0, -4.0, -3.0)}
+
+# 実機 / シミュレーションのバックエンド (GEL_BACKEND 環境変数で切り替え)
+hw = hardware.get_backend(gains=SIM_GAINS, active_level=1)
+GPIO, board, busio, INA219 = hw.GPIO, hw.board, hw.busio, hw.INA219
+# シミュレーション時は画面を開かずにグラフを更新
+matplotlib.use('Agg' if hw.simulated else 'TkAgg')
+import matplotlib.pyplot as plt
 
+# --- 設定項目 ---
 ACTIVE_INTERVAL = 10    # ONの間隔（秒）
 INACTIVE_INTERVAL = 5     # 最初の待機時間（秒）
 TOTAL_DURATION = 36000        # 全体の実行時間（秒）
 
+# 刺激プログラム (stimprog.Train のリスト)．時間は 1ms 単位まで指定可能
+# 例: ランプ Train(on=10, off=5, repeat=100, onEnd=2)，両極性 Train(on=10, off=5, repeat=None, alternate=True)
+STIM_PROGRAM = [
+    stimprog.Train(on=ACTIVE_INTERVAL, off=INACTIVE_INTERVAL, repeat=None, offFirst=True, label="BLUE"),
+]
+EDGE_LOG_FILENAME = 'stim_edges_log.csv'   # エッジの予定時刻と実際の時刻
+
 ACTIVE_STATE  = GPIO.HIGH
 INACTIVE_STATE = GPIO.LOW
 
 # INA219設定
 INA219_ADDRESSES = [0x40, 0x41, 0x44]
 MAX_DATA_POINTS = 200
-SAMPLE_INTERVAL = 0.1
+SAMPLE_INTERVAL = 0.1     # サンプリング周期（秒）．締め切り基準の固定周期で取得
+PLOT_INTERVAL = 0.1       # グラフ更新周期（秒）．サンプリングとは独立
 LOG_FILENAME = 'multi_current_log.csv'
 
 # --- グローバル変数（スレッド停止用） ---
@@ -36,46 +50,20 @@ stop_event = threading.Event()
 def relay_control_task():
     print(">>> リレー制御スレッド開始")
     
-    # GPIO初期化
-    pins = [BLUE_POS, BLUE_NEG]
-    # 重複を除去してセットアップ
-    unique_pins = list(set(pins))
-    
-    GPIO.setup(unique_pins, GPIO.OUT, initial=INACTIVE_STATE)
-
-    
-    
-    start_time = time.time()
-    loop_counter = 0
+    # 2ピンのトランジスタ回路 (GPIO.setmode はプログラム開始時，各ピンの出力設定は StimProgram.run の開始時に profile.setup で行う)
+    profile = stimprog.transistor_profile(BLUE_POS, BLUE_NEG, ACTIVE_STATE, INACTIVE_STATE)
+    program = stimprog.StimProgram(GPIO, profile, STIM_PROGRAM, clock=hw.clock,
+                                   total=TOTAL_DURATION, logPath=EDGE_LOG_FILENAME)
 
     try:
-        while not stop_event.is_set():
-            elapsed = time.time() - start_time
-            if elapsed >= TOTAL_DURATION:
-                print("[Relay] 設定時間が経過しました。制御を終了します。")
-                stop_event.set() # メインスレッドにも終了を通知
-                break
-
-            loop_counter += 1
-            # --- BLUE OFF---
-            print(f"[Relay Loop {loop_counter}] BLUE OFF ({INACTIVE_INTERVAL}s)")
-            GPIO.output(BLUE_POS, INACTIVE_STATE)
-            GPIO.output(BLUE_NEG, INACTIVE_STATE)
-            time.sleep(INACTIVE_INTERVAL)
-
-            # --- BLUE ON ---
-            print(f"[Relay Loop {loop_counter}] BLUE ON ({ACTIVE_INTERVAL}s)")
-            GPIO.output(BLUE_POS, ACTIVE_STATE)
-            GPIO.output(BLUE_NEG, INACTIVE_STATE)
-            
-            # 指定時間待機（1秒ごとに停止フラグをチェックして即時終了できるようにする）
-            for _ in range(ACTIVE_INTERVAL):
-                if stop_event.is_set(): return
-                time.sleep(1)
-            
+        # 各エッジを開始時刻からの絶対時刻で出力 (停止フラグは 0.1s ごとに確認)
+        if program.run(stop=stop_event.is_set):
+            print("[Relay] 設定時間が経過しました。制御を終了します。")
+            stop_event.set() # メインスレッドにも終了を通知
     finally:
         # スレッド終了時に全OFF
-        GPIO.output(unique_pins, INACTIVE_STATE)
+        profile.release(GPIO)
+        print(f"[Relay] {program.summary()}")
         print(">>> リレー制御スレッド終了")
 
 # --- メイン処理 ---
@@ -119,9 +107,10 @@ def main():
     lines = []
     colors = ['blue', 'red', 'green', 'orange']
     
-    # データ保存用
+    # データ保存用 (サンプリングスレッドとグラフ更新で共有)
     all_time_data = [deque(maxlen=MAX_DATA_POINTS) for _ in sensors]
     all_current_data = [deque(maxlen=MAX_DATA_POINTS) for _ in sensors]
+    data_lock = threading.Lock()
 
     for i, sensor in enumerate(sensors):
         addr = hex(sensor.i2c_device.device_address)
@@ -139,37 +128,45 @@ def main():
     relay_thread.start()
 
     print('Measurement started. Press Ctrl+C to stop.')
-    start_time = time.time()
+    start_time = hw.clock.time()
 
-    try:
-        while not stop_event.is_set():
-            now = time.time()
-            elapsed_time = now - start_time
-            
-            current_readings = []
-            print_str = f"T={elapsed_time:.1f}s"
-
-            for i, sensor in enumerate(sensors):
-                try:
-                    mA = sensor.current
-                except:
-                    mA = 0.0 # 読み取りエラー時は0など
-                
-                current_readings.append(mA)
+    # 6. 計測 (サンプリングスレッドで固定周期実行)
+    def sample_once():
+        elapsed_time = hw.clock.time() - start_time
+        current_readings = []
+        for sensor in sensors:
+            try:
+                mA = sensor.current
+            except:
+                mA = 0.0 # 読み取りエラー時は0など
+            current_readings.append(mA)
+
+        with data_lock:
+            for i, mA in enumerate(current_readings):
                 all_time_data[i].append(elapsed_time)
                 all_current_data[i].append(mA)
-                lines[i].set_data(all_time_data[i], all_current_data[i])
-                print_str += f", {hex(sensor.i2c_device.device_address)}: {mA:.1f}mA"
 
-            # ログ書き込み
-            log_line = f"{elapsed_time:.4f}," + ','.join([f"{c:.4f}" for c in current_readings]) + "\n"
-            log_file.write(log_line)
+        # ログ書き込み
+        log_line = f"{elapsed_time:.4f}," + ','.join([f"{c:.4f}" for c in current_readings]) + "\n"
+        log_file.write(log_line)
+
+    sampler = FixedRateSampler(1 / SAMPLE_INTERVAL, sample_once, clock=hw.clock)
+    sampler.start(stop=stop_event.is_set)
+
+    try:
+        while not stop_event.is_set():
+            with data_lock:
+                print_str = f"T={hw.clock.time() - start_time:.1f}s"
+                for i, sensor in enumerate(sensors):
+                    lines[i].set_data(list(all_time_data[i]), list(all_current_data[i]))
+                    if all_current_data[i]:
+                        print_str += f", {hex(sensor.i2c_device.device_address)}: {all_current_data[i][-1]:.1f}mA"
             
             # グラフ更新（軸調整含む）
             ax.relim()
             ax.autoscale_view()
             # plt.pauseは内部でGUIイベントループを回すため必須
-            plt.pause(SAMPLE_INTERVAL) 
+            plt.pause(PLOT_INTERVAL / hw.clock.speed) 
             
             print(print_str)
 
@@ -182,7 +179,9 @@ def main():
         stop_event.set() # スレッドを停止させる
 
     finally:
-        # 終了処理
+        # 終了処理 (サンプリングを止めてからファイルを閉じる)
+        sampler.stop()
+        print(f"Sampler: {sampler.summary()}")
         if not log_file.closed:
             log_file.close()
         
@@ -0,0 +1,127 @@
+# bus.py
+# スレッド間でセンサー値・刺激パターン・ボール位置を受け渡すサンプルバス
+#
+# 各チャンネルは連番付きのレコードを固定長のリングバッファ (array) に保持する．
+# 文字列への変換・分解を行わずに数値のまま受け渡し，購読者は新しいレコードが
+# 届くまで Condition で待機できる．
+
+import threading
+from array import array
+
+
+class Channel:
+    """連番付きの数値レコードを固定長リングバッファに保持するチャンネル
+
+    fields   : レコードの項目名
+    capacity : 保持するレコード数 (これより古いレコードは上書きされる)
+    typecode : array の型 ('d': 実数, 'q': 整数)
+    """
+
+    def __init__(self, name, fields, capacity=1024, typecode='d'):
+        self.name = name
+        self.fields = tuple(fields)
+        self.width = len(self.fields)
+        self.capacity = capacity
+        self.seq = 0          # 最後に書き込んだレコードの連番 (0 は未書き込み)
+        self.blocked = 0      # バックプレッシャーで書き込みを待った回数
+        self._buf = array(typecode, [0]) * (capacity * self.width)
+        self._cond = threading.Condition()
+        self._subs = []
+
+    def publish(self, *values, block=False, timeout=None):
+        """レコードを書き込んで待機中の購読者を起こし，連番を返す
+
+        block=True では最も遅い購読者が追いつくまで待つ (timeout 経過後は上書きする)．
+        """
+        with self._cond:
+            if block and self._subs and self._lag() >= self.capacity:
+                self.blocked += 1
+                self._cond.wait_for(lambda: self._lag() < self.capacity, timeout)
+            seq = self.seq + 1
+            base = (seq % self.capacity) * self.width
+            for i in range(self.width):
+                self._buf[base + i] = values[i]
+            self.seq = seq
+            self._cond.notify_all()
+            return seq
+
+    def latest(self):
+        """最新レコードを (連番, 値のタプル) で返す．未書き込みなら (0, None)"""
+        with self._cond:
+            if self.seq == 0:
+                return 0, None
+            return self.seq, self._read(self.seq)
+
+    def subscribe(self, fromLatest=True):
+        """購読カーソルを作る (fromLatest=False では保持している最古のレコードから読む)"""
+        with self._cond:
+            sub = Subscription(self, self.seq if fromLatest else max(0, self.seq - self.capacity))
+            self._subs.append(sub)
+        return sub
+
+    def _read(self, seq):
+        base = (seq % self.capacity) * self.width
+        return tuple(self._buf[base:base + self.width])
+
+    def _lag(self):
+        return self.seq - min(s.cursor for s in self._subs)
+
+    def _unsubscribe(self, sub):
+        with self._cond:
+            if sub in self._subs:
+                self._subs.remove(sub)
+            self._cond.notify_all()
+
+
+class Subscription:
+    """チャンネルの購読カーソル．上書きで読めなかったレコード数を dropped に数える"""
+
+    def __init__(self, channel, cursor):
+        self.channel = channel
+        self.cursor = cursor
+        self.received = 0
+        self.dropped = 0
+
+    def get(self, timeout=None):
+        """次のレコードを (連番, 値) で返す．届くまで待ち，timeout 経過時は None"""
+        ch = self.channel
+        with ch._cond:
+            if not ch._cond.wait_for(lambda: ch.seq > self.cursor, timeout):
+                return None
+            oldest = ch.seq - ch.capacity + 1
+            if self.cursor + 1 < oldest:
+                self.dropped += oldest - self.cursor - 1
+                self.cursor = oldest - 1
+            self.cursor += 1
+            self.received += 1
+            record = (self.cursor, ch._read(self.cursor))
+            ch._cond.notify_all()
+            return record
+
+    def poll(self):
+        """届いているレコードをすべて (連番, 値) のリストで返す (待たない)"""
+        records = []
+        while True:
+            record = self.get(timeout=0)
+            if record is None:
+                return records
+            records.append(record)
+
+    def latest(self, timeout=0):
+        """前回以降に新しいレコードがあれば最新の1件を返す (途中のレコードは読み飛ばす)"""
+        ch = self.channel
+        with ch._cond:
+            if not ch._cond.wait_for(lambda: ch.seq > self.cursor, timeout):
+                return None
+            self.cursor = ch.seq
+            self.received += 1
+            record = (self.cursor, ch._read(self.cursor))
+            ch._cond.notify_all()
+            return record
+
+    def pending(self):
+        """未読のレコード数"""
+        return self.channel.seq - self.cursor
+
+    def close(self):
+        self.channel._unsubscribe(self)
@@ -0,0 +1,100 @@
+# electrode.py
+# 刺激パターンをビットマスクで保持し，変化したピンだけを出力する電極ドライバ
+#
+# 出力を担当するスレッド (サンプリングスレッド) だけが apply() で GPIO に書き込み，
+# 他のスレッドは request() で次の刺激パターンを依頼する．apply() は現在のパターンとの
+# 差分を取り，変化したピンのみを GPIO.output(ピンのリスト, 値のリスト) の1回で出力する．
+
+import threading
+from collections import deque
+from hardware import RealClock
+
+
+class ElectrodeDriver:
+    """刺激パターン (bit i = pins[i]) を差分出力する電極ドライバ
+
+    activeLevel   : 刺激時のピンの出力レベル (GPIO.HIGH / GPIO.LOW)
+    inactiveLevel : 非刺激時の出力レベル
+    window        : 遅延統計に使う直近の出力回数
+    """
+
+    def __init__(self, GPIO, pins, activeLevel, inactiveLevel, clock=None, window=1000):
+        self.GPIO = GPIO
+        self.pins = list(pins)
+        self.activeLevel = activeLevel
+        self.inactiveLevel = inactiveLevel
+        self.clock = clock if clock is not None else RealClock()
+        self.mask = 0            # 出力中のパターン (ピンは初期化時に非刺激レベルにしておく)
+        self.transitions = 0     # 出力が切り替わったピンの延べ数
+        self.writes = 0          # GPIO.output の呼び出し回数
+        self._full = (1 << len(self.pins)) - 1
+        self._request = None     # (パターン, 依頼時刻 [s])
+        self._lock = threading.Lock()
+        self._owner = None
+        self._latency = deque(maxlen=window)
+        self.maxLatency = 0.0
+
+    def request(self, mask, t=None):
+        """次に出力するパターンを依頼する (どのスレッドからでも可)．t は依頼時刻 (clock.monotonic())"""
+        with self._lock:
+            self._request = (int(mask) & self._full, self.clock.monotonic() if t is None else t)
+
+    def apply(self):
+        """依頼されたパターンのうち変化したピンを出力する (出力担当のスレッドから呼ぶ)．出力したら True"""
+        ident = threading.get_ident()
+        if self._owner is None:
+            self._owner = ident
+        elif self._owner != ident:
+            raise RuntimeError("ElectrodeDriver.apply() must be called from the owner thread")
+        with self._lock:
+            request, self._request = self._request, None
+        if request is None:
+            return False
+        mask, t = request
+        changed = mask ^ self.mask
+        if not changed:
+            return False
+        pins, values = [], []
+        for i, pin in enumerate(self.pins):
+            if (changed >> i) & 1:
+                pins.append(pin)
+                values.append(self.activeLevel if (mask >> i) & 1 else self.inactiveLevel)
+        self.GPIO.output(pins, values)
+        self.mask = mask
+        self.writes += 1
+        self.transitions += len(pins)
+        latency = self.clock.monotonic() - t
+        self._latency.append(latency)
+        if latency > self.maxLatency:
+            self.maxLatency = latency
+        return True
+
+    def set(self, mask):
+        """パターンをすぐに出力する (出力担当のスレッドから呼ぶ)"""
+        self.request(mask)
+        return self.apply()
+
+    def reset(self):
+        """全ピンを非刺激レベルにする (出力担当のスレッドの終了後に呼ぶ)"""
+        with self._lock:
+            self._request = None
+        self.GPIO.output(self.pins, [self.inactiveLevel] * len(self.pins))
+        self.mask = 0
+        self._owner = None
+
+    def stats(self):
+        """切り替え回数と依頼から出力までの遅延 [ms] の分位点"""
+        late = sorted(self._latency)
+
+        def pct(p):
+            if not late:
+                return 0.0
+            return late[min(len(late) - 1, int(p / 100 * len(late)))] * 1000
+
+        return {"writes": self.writes, "transitions": self.transitions,
+                "latencyP50": pct(50), "latencyP95": pct(95), "latencyMax": self.maxLatency * 1000}
+
+    def summary(self):
+        s = self.stats()
+        return (f"{s['writes']} updates, {s['transitions']} pin transitions, "
+                f"latency p50 {s['latencyP50']:.2f} ms / p95 {s['latencyP95']:.2f} ms / max {s['latencyMax']:.2f} ms")
@@ -0,0 +1,28 @@
+# game_random_tra.py
+# random のゲームの設定 (刺激領域の配置・デコーダの校正値・電極ピン)
+#
+# pygame を使わないので，画面のない pongsim.py / pongbatch.py からも読み込める．
+# 画面を持つ pong_random_tra.py と電極を出力する plotter_random_tra.py もここから読む．
+
+from pongsim import PongSim
+from geometry import grid_regions
+from decoder import DECODERS
+
+# 刺激パターンの bit i (Region i+1) に対応する電極ピン
+ELECTRODE_PINS = [21, 15, 18, 20, 8, 24]
+
+def make_regions(size=(1000, 1000)):
+    """刺激領域の配置 (左上から行ごとに並べた 2列 × 3行)"""
+    return grid_regions(size, 2, 3)
+
+def make_sim(size=(1000, 1000), seed=None, physics="frame"):
+    """random の規則の PongSim (ミスしたらすぐにボールを中央に戻す)"""
+    return PongSim(size, make_regions(size), seed=seed, immediateReset=True, physics=physics)
+
+def make_decoder(size=(1000, 1000), decoder="analytic"):
+    """パドル位置のデコーダ．閾値 (maxC, minC) はゲルの状態に合わせて適宜調整
+    decoder="lut" では 0.1mA 単位の全組み合わせを事前計算した表を引く"""
+    return DECODERS[decoder](
+        [(5, -11.7), (2.9, -10.7), (4.0, -11.4)],
+        [size[1]/6, 3*size[1]/6, 5*size[1]/6],
+        size[1], size[1], round(size[1] / 3))
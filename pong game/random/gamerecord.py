@@ -0,0 +1,232 @@
+# gamerecord.py
+# ゲームの記録と決定的な再実行 (record / replay)
+#
+# PongSim は乱数の種とステップごとのパドル位置が同じなら同じ経過をたどる．
+# GameRecorder はゲームの設定 (乱数の種・物理計算・刻み) をヘッダーに，パドル位置と刺激パターンを
+# 変化したステップ番号 (tick) とともに記録し，GameReplay はそれを使ってゲームを再実行する．
+# 再実行中の刺激パターンを記録と照合するので，再現できたかどうかも確認できる．
+#
+# ファイル (リトルエンディアン)
+#   ヘッダー : magic, JSON の長さ (uint32), JSON (game, size, seed, physics, dt, decoder, wall0)
+#              game はゲーム名 (pongsim.GAMES のキー: "tra" / "random")
+#   レコード : tick int64, kind uint8, value int32 (13 byte)
+#     REC_PADDLE : この tick から使うパドル上端の位置
+#     REC_MASK   : この tick の判定後の刺激パターン
+#     REC_END    : 最後の tick (value はその時のスコア)
+#
+#   python gamerecord.py Data/game_<日付>_<番号>.rec              # 画面なしで最大速度で再実行
+#   python gamerecord.py Data/game_<日付>_<番号>.rec --display --speed 2
+
+import os
+import json
+import time
+import struct
+import argparse
+import importlib
+from datetime import date
+import numpy as np
+from pongsim import GAMES, load_game
+
+MAGIC = b"GELGREC1"
+HEADER = struct.Struct("<8sI")
+RECORD = struct.Struct("<qBi")
+DTYPE = np.dtype([("tick", "<i8"), ("kind", "u1"), ("value", "<i4")])
+
+REC_PADDLE = 0
+REC_MASK = 1
+REC_END = 2
+
+# ゲーム名 -> 画面を持つゲームのモジュール (pygame を使う．--display のときのみ読み込む)
+DISPLAYS = {"tra": "pong", "random": "pong_random_tra"}
+
+
+class GameRecorder:
+    """PongSim の入力 (パドル位置) と刺激パターンを tick ごとに記録する
+
+    step() を sim.step() / sim.collide() の後に毎回呼ぶ．変化したときのみ書き込む．
+    meta : ヘッダーに加える情報 (game: ゲーム名 "tra" / "random"，decoder など)
+    """
+
+    def __init__(self, path, sim, dt, chunkRecords=4096, **meta):
+        self.path = path
+        self.sim = sim
+        self.count = 0
+        self._chunk = bytearray(RECORD.size * chunkRecords)
+        self._used = 0
+        self._paddle = None
+        self._mask = None
+        header = dict(meta, size=list(sim.size), seed=sim.seed, physics=sim.physics, dt=dt)
+        text = json.dumps(header).encode("utf-8")
+        self._file = open(path, "wb", buffering=0)
+        self._file.write(HEADER.pack(MAGIC, len(text)) + text)
+
+    @classmethod
+    def create(cls, sim, dt, folder="Data", **meta):
+        """folder/game_<日付>_<番号>.rec を新しく作る"""
+        os.makedirs(folder, exist_ok=True)
+        n = 0
+        while os.path.exists(os.path.join(folder, f"game_{date.today()}_{n}.rec")):
+            n += 1
+        return cls(os.path.join(folder, f"game_{date.today()}_{n}.rec"), sim, dt, **meta)
+
+    def step(self):
+        """直前のステップで使ったパドル位置と判定後の刺激パターンを記録する"""
+        sim = self.sim
+        if sim.paddleY != self._paddle:
+            self._paddle = sim.paddleY
+            self._append(sim.steps, REC_PADDLE, sim.paddleY)
+        if sim.mask != self._mask:
+            self._mask = sim.mask
+            self._append(sim.steps, REC_MASK, sim.mask)
+
+    def _append(self, tick, kind, value):
+        if self._file is None:
+            return
+        RECORD.pack_into(self._chunk, self._used, tick, kind, int(value))
+        self._used += RECORD.size
+        self.count += 1
+        if self._used == len(self._chunk):
+            self._flush()
+
+    def _flush(self):
+        if self._used:
+            self._file.write(memoryview(self._chunk)[:self._used])
+            self._used = 0
+
+    def close(self):
+        if self._file is None:
+            return
+        self._append(self.sim.steps, REC_END, self.sim.score)
+        self._flush()
+        self._file.close()
+        self._file = None
+
+
+def read(path):
+    """ゲームの記録を (ヘッダーの dict, レコードの構造化配列) で読む．末尾の書きかけのレコードは無視"""
+    with open(path, "rb") as f:
+        magic, length = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"Not a game record: {path}")
+        header = json.loads(f.read(length).decode("utf-8"))
+        data = f.read()
+    return header, np.frombuffer(data, dtype=DTYPE, count=len(data) // RECORD.size)
+
+
+class GameReplay:
+    """記録したゲームを同じ乱数の種・パドル位置で再実行する
+
+    game : PongSim を作るゲームの設定のモジュール (make_sim を持つ．省略時はヘッダーの game から
+           pongsim.load_game() で読み込むので pygame は不要)
+    """
+
+    def __init__(self, path, game=None):
+        self.path = path
+        self.header, self.records = read(path)
+        self.gameName = game_name(self.header.get("game", "tra"))
+        self.game = game if game is not None else load_game(self.gameName)
+        self.dt = self.header["dt"]
+        kinds = self.records["kind"]
+        end = self.records["tick"][kinds == REC_END]
+        # 終了レコードがない (中断された) 記録は最後のレコードまで
+        self.ticks = int(end[-1]) if len(end) else int(self.records["tick"][-1]) if len(self.records) else 0
+        self.finalScore = int(self.records["value"][kinds == REC_END][-1]) if len(end) else None
+        self.mismatches = 0
+        self.firstMismatch = None
+        self.wallTime = 0.0
+
+    def display_module(self):
+        """画面を持つゲームのモジュール (描画の色・スコアの位置．pygame を読み込む)"""
+        return importlib.import_module(DISPLAYS[self.gameName])
+
+    def make_sim(self):
+        h = self.header
+        return self.game.make_sim(tuple(h["size"]), seed=h["seed"], physics=h["physics"])
+
+    def run(self, observer=None, speed=None):
+        """最後の tick まで再実行し，PongSim を返す
+
+        observer : 毎ステップ observer(sim, events) を呼ぶ (描画など)
+        speed    : ゲーム内時間の何倍で進めるか (None で待ち時間なし)
+        """
+        sim = self.make_sim()
+        records = self.records
+        tick, kind, value = (records[k].tolist() for k in ("tick", "kind", "value"))
+        i, n = 0, len(tick)
+        paddle = None
+        t0 = time.perf_counter()
+        for step in range(1, self.ticks + 1):
+            # この tick から使うパドル位置
+            while i < n and tick[i] == step and kind[i] == REC_PADDLE:
+                paddle = value[i]
+                i += 1
+            events = sim.step(paddle, self.dt)
+            while i < n and tick[i] == step:
+                if kind[i] == REC_MASK and value[i] != sim.mask:
+                    self.mismatches += 1
+                    if self.firstMismatch is None:
+                        self.firstMismatch = step
+                i += 1
+            if observer is not None:
+                observer(sim, events)
+            if speed:
+                wait = t0 + step * self.dt / speed - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+        self.wallTime = time.perf_counter() - t0
+        return sim
+
+    def summary(self, sim):
+        gameTime = self.ticks * self.dt
+        result = "reproduced" if self.mismatches == 0 else f"{self.mismatches} mask mismatches from tick {self.firstMismatch}"
+        score = "" if self.finalScore is None else f" (recorded {self.finalScore})"
+        return (f"{self.ticks} ticks ({gameTime:.0f} s game time) in {self.wallTime:.2f} s, "
+                f"final score {sim.score}{score}, {result}")
+
+
+def game_name(game):
+    """ヘッダーの game をゲーム名にする (以前の記録はゲームのモジュール名 "pong" / "pong_random_tra")"""
+    for name, module in DISPLAYS.items():
+        if game == module:
+            return name
+    if game not in GAMES:
+        raise ValueError(f"Unknown game in record: {game}")
+    return game
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded Pong game deterministically")
+    parser.add_argument("path")
+    parser.add_argument("--display", action="store_true", help="draw the game while replaying")
+    parser.add_argument("--speed", type=float, default=None, help="replay speed (default: as fast as possible)")
+    args = parser.parse_args()
+
+    replay = GameReplay(args.path)
+    observer = None
+    if args.display:
+        import pygame
+        from render import DirtyRenderer
+        pygame.init()
+        screen = pygame.display.set_mode(tuple(replay.header["size"]))
+        pygame.display.set_caption("Pong (replay)")
+        display = replay.display_module()
+        renderer = None
+
+        def observer(sim, events):
+            nonlocal renderer
+            if renderer is None:
+                renderer = DirtyRenderer(screen, sim, display.BLUE,
+                                         display.score_pos(replay.header["size"]))
+            pygame.event.pump()
+            renderer.draw()
+    try:
+        sim = replay.run(observer, args.speed)
+    finally:
+        if args.display:
+            pygame.quit()
+    print(replay.summary(sim))
+    return 0 if replay.mismatches == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
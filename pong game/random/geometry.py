@@ -0,0 +1,124 @@
+# geometry.py
+# 刺激領域・パドルとボールの当たり判定 (四則演算と表引きのみ．pygame のマスクは使わない)
+#
+# 刺激領域は列 × 行の格子に並んだ長方形なので，ボールが重なる列と行の範囲を
+# 座標ごとの表から求め，その範囲の領域ビットをまとめた表を引いて刺激パターンを得る．
+# 1フレームの判定は領域の数によらず表引き数回で済む．
+# 重なりの判定は pygame.Rect.colliderect と同じく，辺が接するだけの場合は含めない．
+
+import math
+import numpy as np
+
+
+def rect_round(v):
+    """pygame.Rect に小数を代入したときと同じ丸め (0.5 は0から遠い方へ)"""
+    return math.floor(v + 0.5) if v >= 0 else -math.floor(0.5 - v)
+
+
+def rect_overlap(ax, ay, aw, ah, bx, by, bw, bh):
+    """2つの長方形 (x, y, 幅, 高さ) が重なっていれば True"""
+    return ax < bx + bw and bx < ax + aw and ay < by + bh and by < ay + ah
+
+
+def tra_regions(size):
+    """tra の刺激領域の配置 (領域 i を列 i%2，行 i%3 に置く)．(x, y, 幅, 高さ) のリスト"""
+    w, h = int(size[0] / 2), int(size[1] / 3)
+    return [(rect_round(i % 2 * (size[0] / 2)), rect_round(i % 3 * size[1] / 3), w, h) for i in range(6)]
+
+
+def grid_regions(size, cols=2, rows=3):
+    """左上から行ごとに並べた cols × rows の刺激領域 (random の配置)"""
+    w, h = size[0] // cols, size[1] // rows
+    return [((i % cols) * w, (i // cols) * h, w, h) for i in range(cols * rows)]
+
+
+class _Axis:
+    """1軸方向の区間 (start, length) の並びと，座標から重なる区間の範囲を引く表"""
+
+    def __init__(self, spans):
+        self.spans = sorted(spans)
+        self.extent = max(s + n for s, n in self.spans)
+        coords = np.arange(self.extent + 1)
+        starts = np.array([s for s, n in self.spans])
+        ends = np.array([s + n for s, n in self.spans])
+        # first[lo] : 終端が lo 以下の区間の数 (= lo より右にかかる最初の区間)
+        # last[hi]  : 始端が hi 未満の区間の数 - 1 (= hi より左にかかる最後の区間)
+        self.first = np.searchsorted(ends, coords, side='right')
+        self.last = np.searchsorted(starts, coords, side='left') - 1
+        for (s0, n0), (s1, n1) in zip(self.spans, self.spans[1:]):
+            if s0 + n0 > s1:
+                raise ValueError("Grid cells overlap")
+
+    def index(self, start):
+        return [s for s, n in self.spans].index(start)
+
+    def range(self, lo, hi):
+        """区間 [lo, hi) が重なる区間番号の範囲 (first, last)．重ならなければ first > last"""
+        lo = min(max(lo, 0), self.extent)
+        hi = min(max(hi, 0), self.extent)
+        return self.first[lo], self.last[hi]
+
+
+class RegionGrid:
+    """列 × 行の格子に並んだ刺激領域の当たり判定
+
+    regions : 刺激領域 (x, y, 幅, 高さ) のリスト (bit i = regions[i])．
+              x 座標が同じ領域は同じ幅，y 座標が同じ領域は同じ高さで，格子を埋めていること
+    """
+
+    def __init__(self, regions):
+        self.regions = [tuple(int(v) for v in r) for r in regions]
+        self.cols = _Axis({(x, w) for x, y, w, h in self.regions})
+        self.rows = _Axis({(y, h) for x, y, w, h in self.regions})
+        nc, nr = len(self.cols.spans), len(self.rows.spans)
+        if nc * nr != len(self.regions):
+            raise ValueError("Regions do not form a grid")
+        cell = np.zeros((nr, nc), dtype=np.int64)
+        for i, (x, y, w, h) in enumerate(self.regions):
+            cell[self.rows.index(y), self.cols.index(x)] = 1 << i
+        self.cellBits = cell
+        # 行 r0〜r1，列 c0〜c1 の領域ビットの論理和 (範囲外・空の範囲は0)
+        table = np.zeros((nr + 1, nr + 1, nc + 1, nc + 1), dtype=np.int64)
+        for r0 in range(nr):
+            for r1 in range(r0, nr):
+                for c0 in range(nc):
+                    for c1 in range(c0, nc):
+                        table[r0, r1, c0, c1] = np.bitwise_or.reduce(cell[r0:r1 + 1, c0:c1 + 1], axis=None)
+        self.table = table
+        self._rangeBits = table.tolist()
+        self._first = (self.cols.first.tolist(), self.rows.first.tolist())
+        self._last = (self.cols.last.tolist(), self.rows.last.tolist())
+
+    @classmethod
+    def uniform(cls, size, cols, rows):
+        """画面を cols × rows に等分した格子 (grid_regions と同じ配置)"""
+        return cls(grid_regions(size, cols, rows))
+
+    def mask(self, x, y, w, h):
+        """長方形 (x, y, 幅, 高さ) が重なる刺激領域のビットマスク"""
+        ex, ey = self.cols.extent, self.rows.extent
+        x0 = min(max(x, 0), ex)
+        x1 = min(max(x + w, 0), ex)
+        y0 = min(max(y, 0), ey)
+        y1 = min(max(y + h, 0), ey)
+        c0, c1 = self._first[0][x0], self._last[0][x1]
+        r0, r1 = self._first[1][y0], self._last[1][y1]
+        if c0 > c1 or r0 > r1:
+            return 0
+        return self._rangeBits[r0][r1][c0][c1]
+
+    def mask_batch(self, x, y, w, h):
+        """mask() のベクトル版 (x, y は配列，w, h はスカラーまたは配列)"""
+        x = np.asarray(x, dtype=np.int64)
+        y = np.asarray(y, dtype=np.int64)
+        ex, ey = self.cols.extent, self.rows.extent
+        c0 = self.cols.first[np.clip(x, 0, ex)]
+        c1 = self.cols.last[np.clip(x + w, 0, ex)]
+        r0 = self.rows.first[np.clip(y, 0, ey)]
+        r1 = self.rows.last[np.clip(y + h, 0, ey)]
+        empty = (c0 > c1) | (r0 > r1)
+        # 空の範囲は表の範囲外の番号 (値が0の行・列) を引く
+        nr, nc = len(self.rows.spans), len(self.cols.spans)
+        bits = self.table[np.where(empty, nr, r0), np.where(empty, nr, r1),
+                          np.where(empty, nc, c0), np.where(empty, nc, c1)]
+        return bits
@@ -1,44 +1,76 @@
 import threading
-import time
+import os
 import config
-import csv
 import sys
 import random
 from datetime import datetime
 from pong_random_tra import Pong 
-from plotter_random_tra import serialPlot 
+from plotter_random_tra import serialPlot, hw, formatCurrents
+from replay import TraceReplay
+from runtime import AcquisitionProcess
+from fastina import InaSettings
+from csvlog import AsyncCsvWriter
+from journal import EventJournal, MODE_NORMAL, MODE_RANDOM, STIM_RANDOM
 
 def main():
     # --- 実験時間の設定 (秒) ---
     INTERVAL_NORMAL = 1200 
     INTERVAL_RANDOM = 600 
+    SAMPLE_RATE = 100   # センサーのサンプリング周波数 [Hz]
+    # INA219 の ADC 設定 (shuntAdc: "9bit"〜"12bit"，平均化は "12bit_2S"〜"12bit_128S")．None で従来の読み出し
+    INA_SETTINGS = InaSettings(shuntAdc="12bit", gain="320mV", rshunt=0.1, currentLsb=0.1)
+    # センサー取得・電極出力を専用プロセスで実行する (GEL_MULTIPROCESS=1 で有効．既定は従来どおり同じプロセスのスレッド)
+    USE_PROCESS = os.environ.get("GEL_MULTIPROCESS", "0") != "0"
     # --------------------------
 
-    s = serialPlot() 
+    # 記録データの再生 (GEL_REPLAY=combined_data_*.csv，GEL_REPLAY_SPEED=0 で最速)
+    replay = None
+    if os.environ.get("GEL_REPLAY"):
+        replay = (os.environ["GEL_REPLAY"], float(os.environ.get("GEL_REPLAY_SPEED", "1")))
+
+    if USE_PROCESS:
+        s = AcquisitionProcess("plotter_random_tra", replay=replay, rate=SAMPLE_RATE, ina=INA_SETTINGS)
+    else:
+        s = serialPlot(rate=SAMPLE_RATE, ina=INA_SETTINGS,
+                       replay=TraceReplay(*replay, clock=hw.clock) if replay else None)
     s.readSerialStart() 
-    pong = Pong((1000, 1000))
+    # シミュレーション時は画面を開かずに実行
+    if hw.simulated:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    # ゲームのイベントジャーナル (GEL_JOURNAL=0 で記録しない．GEL_BALL_RATE はボール位置の記録回数 [Hz])
+    journal = None
+    if os.environ.get("GEL_JOURNAL", "1") != "0":
+        journal = EventJournal.create(clock=hw.clock, game="random", ballRate=float(os.environ.get("GEL_BALL_RATE", "2")))
+    pong = Pong((1000, 1000), clock=hw.clock, decoder=os.environ.get("GEL_DECODER", "analytic"),
+                renderer=os.environ.get("GEL_RENDER", "dirty"), renderRate=float(os.environ.get("GEL_RENDER_RATE", "0")) or None,
+                physics=os.environ.get("GEL_PHYSICS", "swept"), record=os.environ.get("GEL_RECORD", "1") != "0",
+                journal=journal)
 
     now_str = datetime.now().strftime('%Y%m%d_%H%M%S')
     filename = f"combined_data_hybrid_{now_str}.csv"
 
     try:
-        f = open(filename, mode='w', newline='')
-        writer = csv.writer(f)
-        writer.writerow(["Timestamp", "cBlack", "cBrown", "cRed", "RawTime", "BallX", "BallY", "RallyCount", "Mode"])
+        # 書き込みは専用スレッドで行う (時刻の文字列化・電流値の書式化もそちらで実行)
+        writer = AsyncCsvWriter(filename, ["Timestamp", "cBlack", "cBrown", "cRed", "RawTime", "BallX", "BallY", "RallyCount", "Mode"],
+                                rowFormat=lambda sample, ball, mode: formatCurrents(sample).split(',') + list(ball) + [mode],
+                                clock=hw.clock)
     except IOError as e:
         print(f"File error: {e}"); sys.exit(1)
 
     def sensor_bridge():
         # --- 初期化の徹底 ---
         current_mode = "Normal"
-        start_time = time.time()
+        start_time = hw.clock.time()
         print(f"\n===== 実験開始: 最初は {INTERVAL_NORMAL}秒間 【NORMAL】 モードです =====")
         
         last_random_time = 0
-        random_pattern = "0,0,0,0,0,0"
+        # サンプリングスレッド (plotter_random_tra) が配信する電流値を購読する
+        senseSub = config.SenseQ.subscribe()
 
         while pong.carryOn:
-            now = time.time()
+            # 新しいサンプルが届くまで待つ ((cBlack, cBrown, cRed, RawTime, MonoTime))
+            record = senseSub.get(timeout=0.5)
+            now = hw.clock.time()
             elapsed = now - start_time
             
             # --- モード切り替えロジック ---
@@ -47,43 +79,39 @@ def main():
                     current_mode = "Random"
                     start_time = now # タイマーをリセット
                     print(f">>> {INTERVAL_NORMAL}s 経過: 【RANDOM】 モードに切り替えました")
+                    if journal is not None:
+                        journal.mode(MODE_RANDOM)
             else: # Randomモードの場合
                 if elapsed >= INTERVAL_RANDOM:
                     current_mode = "Normal"
                     start_time = now # タイマーをリセット
                     print(f">>> {INTERVAL_RANDOM}s 経過: 【NORMAL】 モードに切り替えました")
+                    if journal is not None:
+                        journal.mode(MODE_NORMAL)
 
             # 1. データの同期保存
-            current_raw_str = s.getCurrents_RPI() 
-            ball_pos_str = config.BallQ
-            if current_raw_str and ball_pos_str:
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-                try:
-                    writer.writerow([timestamp] + current_raw_str.split(',') + ball_pos_str.split(',') + [current_mode])
-                    f.flush()
-                except: pass
-                config.SenseQ = current_raw_str 
+            ball_data = config.BallQ.latest()[1]
+            if record and ball_data:
+                # 書き込みスレッドへ渡すだけ (キューが満杯なら捨てて数える)
+                writer.write(writer.stamp(), record[1], ball_data, current_mode)
 
-            # 2. 刺激パターンの決定
+            # 2. 刺激パターンの決定 (出力はサンプリングスレッドが行う)
             if current_mode == "Normal":
                 # pong_random_tra.py がセットしたボール連動刺激を使用
-                stim_to_send = config.RelayQ
-            else:
+                s.stimOverride = None
+            elif now - last_random_time > 1.0:
                 # Randomモード: 1秒ごとに更新
-                if now - last_random_time > 1.0:
-                    bits = [0] * 6
-                    bits[random.randint(0, 5)] = 1
-                    random_pattern = ",".join(map(str, bits))
-                    last_random_time = now
-                stim_to_send = random_pattern
-                # 画面(青い四角)もランダムに合わせて点灯させる
-                config.RelayQ = stim_to_send
+                s.stimOverride = 1 << random.randint(0, 5)
+                last_random_time = now
+                if journal is not None:
+                    journal.stim(s.stimOverride, STIM_RANDOM)
 
-            # 3. GPIO出力の実行
-            if stim_to_send:
-                s.DriveElectrod_RPI(stim_to_send)
-                
-            time.sleep(0.01)
+            # 再生データを最後まで流したら終了
+            if s.replayFinished and senseSub.pending() == 0:
+                print("再生データの終端に到達しました。")
+                pong.carryOn = False
+                break
+        senseSub.close()
 
     # センサー制御スレッドの開始
     bridge_thread = threading.Thread(target=sensor_bridge, daemon=True)
@@ -95,9 +123,14 @@ def main():
         pass
     finally:
         pong.carryOn = False
-        f.close()
+        bridge_thread.join(timeout=1.0)
+        writer.close()
+        if journal is not None:
+            journal.close()
+            print(f"Journal: {journal.summary()} ({journal.path})")
         s.close()
-        print(f"実験終了。データ保存先: {filename}")
+        print(f"CSV writer: {writer.summary()}")
+        print(f"実験終了。データ保存先: {filename}, {s.log.path}")
 
 if __name__ == '__main__':
     main()
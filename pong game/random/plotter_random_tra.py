@@ -1,19 +1,56 @@
 from threading import Thread
-import time
+import hardware
 import config 
-from os.path import exists
-from datetime import date
+from sampler import FixedRateSampler
+import fastina
+from electrode import ElectrodeDriver
+from sessionlog import SessionLog
+from game_random_tra import ELECTRODE_PINS
 import os
 
-import board 
-import busio 
-import adafruit_ina219 
-import RPi.GPIO as GPIO 
+# 実機 / シミュレーションのバックエンド (GEL_BACKEND 環境変数で切り替え)
+hw = hardware.get_backend()
+GPIO, board, busio = hw.GPIO, hw.board, hw.busio
+
+def formatCurrents(sample):
+    """(cBlack, cBrown, cRed, RawTime) を従来の "cBlack,cBrown,cRed,RawTime" 形式の文字列にする"""
+    return f"{sample[0]:.1f},{sample[1]:.1f},{sample[2]:.1f},{sample[3]:.0f}"
+
+def request_override(mask, current=None):
+    """ランダム刺激のパターンを config.OverrideQ へ依頼する (None でボール連動に戻す)．
+    current (前回の依頼) と同じなら何もしない．依頼したパターンを返す"""
+    if mask != current:
+        # 遅延の計測用に依頼時刻を付ける
+        config.OverrideQ.publish(-1 if mask is None else mask, int(hw.clock.monotonic() * 1e9))
+    return mask
 
 class serialPlot:
-    def __init__(self, *args):
+    """
+    センサー取得と電極出力を担う唯一のサンプリングスレッド．
+    取得した電流値は config.SenseQ へ配信し，セッションログ・combined_data の保存・
+    パドル位置のデコードはそれぞれこの配信を購読する．
+    """
+    def __init__(self, *args, replay=None, rate=100, policy="skip", log=None, ina=None):
         self.isRun = True
+        # 記録データの再生源 (replay.TraceReplay)．指定時はセンサーの代わりに使用
+        self.replay = replay
+        # 固定周期サンプラー (rate [Hz]，遅れたときの動作は policy = "skip" / "catchup")
+        self.sampler = FixedRateSampler(rate, self.sampleOnce, clock=hw.clock, policy=policy)
+        self.relaySub = config.RelayQ.subscribe()
+        self.overrideSub = config.OverrideQ.subscribe()
+        # INA219 の高速読み出し設定 (fastina.InaSettings)．None では adafruit_ina219 で読む
+        self.ina = ina
+        if ina is not None and ina.conversion_time() > 1.0 / rate:
+            print(f"Warning: INA219 conversion time {ina.conversion_time()*1000:.2f} ms is longer than the sample period {1000.0/rate:.2f} ms.")
         self.thread = None
+        self.logThread = None
+        # 刺激出力: stimOverride (ランダム刺激) が None 以外ならボール連動パターンより優先
+        # (依頼は config.OverrideQ 経由で届くため，別プロセスからも設定できる)
+        self._requestedOverride = None
+        self._stimOverride = None
+        self._overrideTime = 0.0
+        self.relayMask = None
+        self.stimMask = None   # 電極へ出力中のパターン
         
         # 保存用ディレクトリ作成
         if not os.path.exists("Data"): os.makedirs("Data")
@@ -21,10 +58,12 @@ class serialPlot:
         # 1. GPIOの初期化
         GPIO.setmode(GPIO.BCM)
         GPIO.setwarnings(False)
-        # ピン定義
-        self.PINS = [21, 15, 18, 20, 8, 24]
+        # ピン定義 (刺激パターンの bit i に対応する電極ピン．ゲームの設定 game_random_tra.py で定義)
+        self.PINS = list(ELECTRODE_PINS)
         for pin in self.PINS:
             GPIO.setup(pin, GPIO.OUT, initial=GPIO.LOW)
+        # 電極ドライバ (出力はサンプリングスレッドが変化したピンのみまとめて行う)
+        self.driver = ElectrodeDriver(GPIO, self.PINS, GPIO.HIGH, GPIO.LOW, clock=hw.clock)
         
         # 2. I2Cと3つのセンサーを初期化 (ここが重要！)
         try:
@@ -36,67 +75,122 @@ class serialPlot:
         except Exception as e:
             print(f"I2C Init Error: {e}")
 
-        # 保存先ファイル作成
-        filePathCount = 0
-        while (exists(f"Data/senseData_{date.today()}_{filePathCount}.txt")): 
-            filePathCount += 1
-        self.filePath = f"Data/senseData_{date.today()}_{filePathCount}.txt"
+        # 保存先ファイル作成 (全サンプルを記録するバイナリのセッションログ, sessionlog.py)
+        self.log = log if log is not None else SessionLog.create("Data", clock=hw.clock)
+        self.filePath = self.log.path
         
         print("GPIO and 3 Sensors initialized.")
 
     def _init_sensor(self, address, name):
         """センサー初期化用ヘルパー"""
         try:
-            s = adafruit_ina219.INA219(self.i2c, address)
+            if self.ina is not None:
+                s = fastina.FastINA219(self.i2c, address, self.ina)
+            else:
+                s = hw.INA219(self.i2c, address)
             print(f"INA219 {name} connected at {hex(address)}.")
             return s
         except:
             print(f"INA219 {name} not found at {hex(address)}.")
             return None
 
+    @property
+    def stimOverride(self):
+        return self._requestedOverride
+
+    @stimOverride.setter
+    def stimOverride(self, mask):
+        self._requestedOverride = request_override(mask, self._requestedOverride)
+
+    @property
+    def replayFinished(self):
+        """記録データの再生を最後まで終えたら True"""
+        return self.replay is not None and self.replay.finished
+
     def readSerialStart(self):
         self.thread = Thread(target=self.backgroundThread)
+        self.logThread = Thread(target=self.senseLogThread)
         self.thread.start()
+        self.logThread.start()
 
-    def getCurrents_RPI(self):
-        """3つのセンサーから電流を取得して返す"""
+    def readCurrents(self):
+        """3つのセンサーの電流値 [mA] (0.1mA 単位) と取得時刻 (clock.time() [ms], clock.monotonic() [ns]) をタプルで返す．再生終了後は None"""
+        if self.replay is not None:
+            text = self.replay.getCurrents_RPI()
+            if not text:
+                return None
+            return tuple(float(v) for v in text.split(',')) + (round(hw.clock.monotonic()*1e9),)
         cBlack, cBrown, cRed = 0.0, 0.0, 0.0
         try:
-            if self.ina_black: cBlack = self.ina_black.current
-            if self.ina_brown: cBrown = self.ina_brown.current
-            if self.ina_red:   cRed   = self.ina_red.current
-        except: pass
-        # pong_random_tra.py の extractPosition が期待する形式
-        return f"{cBlack:.1f},{cBrown:.1f},{cRed:.1f},{time.time()*1000:.0f}"
-
-    def DriveElectrod_RPI(self, inputs_str):
-        try:
-            if isinstance(inputs_str, str):
-                outputs = [int(x.strip()) for x in inputs_str.split(',')]
+            if self.ina is not None:
+                # 高速読み出し: バスを1回ロックし，各センサー1回の読み出しで取得
+                cBlack, cBrown, cRed = fastina.read_currents(self.i2c, [self.ina_black, self.ina_brown, self.ina_red])
             else:
-                outputs = inputs_str
-
-            for i in range(min(len(outputs), len(self.PINS))):
-                GPIO.output(self.PINS[i], GPIO.HIGH if outputs[i] != 0 else GPIO.LOW)
+                if self.ina_black: cBlack = self.ina_black.current
+                if self.ina_brown: cBrown = self.ina_brown.current
+                if self.ina_red:   cRed   = self.ina_red.current
         except: pass
+        return (round(cBlack, 1), round(cBrown, 1), round(cRed, 1), round(hw.clock.time()*1000), round(hw.clock.monotonic()*1e9))
+
+    def getCurrents_RPI(self):
+        """3つのセンサーから電流を取得して "cBlack,cBrown,cRed,RawTime" 形式で返す"""
+        sample = self.readCurrents()
+        return formatCurrents(sample) if sample else ""
 
     def backgroundThread(self):
+        """サンプリングスレッド: 固定周期で sampleOnce を実行する"""
+        self.sampler.run(lambda: not self.isRun)
+        self.relaySub.close()
+        self.overrideSub.close()
+        print(f"Sampler: {self.sampler.summary()}")
+        print(f"Electrodes: {self.driver.summary()}")
+
+    def sampleOnce(self):
+        """電流値を取得して配信し，新しい刺激パターンが届いたときに出力する"""
+        sample = self.readCurrents()
+        if sample is not None:
+            config.SenseQ.publish(*sample)
+
+        relay = self.relaySub.latest()
+        if relay is not None:
+            self.relayMask = (int(relay[1][0]), relay[1][1] / 1e9)
+        override = self.overrideSub.latest()
+        if override is not None:
+            mask = int(override[1][0])
+            self._stimOverride = None if mask < 0 else mask
+            self._overrideTime = override[1][1] / 1e9
+        if relay is None and override is None:
+            return
+        if self._stimOverride is not None:
+            target = (self._stimOverride, self._overrideTime)
+        else:
+            target = self.relayMask
+        # 新しい刺激パターンが届いたときのみドライバへ依頼し，変化したピンだけを出力
+        if target is not None:
+            self.driver.request(*target)
+            self.driver.apply()
+            self.stimMask = self.driver.mask
+
+    def senseLogThread(self):
+        """セッションログへの保存 (配信を購読し，全サンプルを出力中の刺激パターン・ボール位置とともに記録)"""
+        senseSub = config.SenseQ.subscribe()
         while self.isRun:
-            if config.RelayQ:
-                self.DriveElectrod_RPI(config.RelayQ)
-            
-            # ログ保存
-            current_data = self.getCurrents_RPI()
+            record = senseSub.get(timeout=0.5)
+            if record is None:
+                continue
             try:
-                with open(self.filePath, "a") as f:
-                    f.write(f"{config.RelayQ}:{current_data}\n")
+                self.log.sample(record[1], self.stimMask, config.BallQ.latest()[1],
+                                randomMode=self._stimOverride is not None)
             except: pass
-            
-            time.sleep(0.1)
+        senseSub.close()
 
     def close(self):
         self.isRun = False
         if self.thread: 
             self.thread.join()
+        if self.logThread:
+            self.logThread.join()
+        self.log.close()
+        self.driver.reset()
         GPIO.cleanup()
         print("GPIO Cleaned up.")
@@ -2,43 +2,77 @@ import pygame
 from paddle import Paddle
 from ball import Ball
 from region import Region
+from hardware import RealClock
+from render import DirtyRenderer
+from gamerecord import GameRecorder
+from pongsim import EVENT_MISS, FRAME_RATE, PHYSICS_RATE
+from game_random_tra import make_sim, make_decoder   # ゲームの設定 (刺激領域の配置・デコーダの校正値)
 import config
-import time
-import numpy as np
-import scipy.optimize as opt
 from random import randint
 
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
 BLUE  = (51, 146, 255)
 
+MAX_SUBSTEPS = 8        # 1回のループで進める物理計算の最大回数
+
+def score_pos(size):
+    """スコアの表示位置 (画面の幅の中央，上から 10px)"""
+    return (size[0] // 2, 10)
+
 class Pong():
-    def __init__(self, Size):
-        pygame.init()
+    """
+    ゲームの規則は PongSim (pongsim.py) が計算し，このクラスはセンサー入力・刺激の依頼・描画を行う．
+    display=False では画面を開かずに同じ処理をゲーム内時間 60fps で実行する．
+    renderer="dirty" では変化した部分だけを描き直し (render.py)，"full" では毎フレーム全面を描く．
+    renderRate はゲーム内時間で1秒あたりの描画回数 (None でゲームと同じ 60fps．ゲームの進行には影響しない)．
+    physics="swept" ではボールを PHYSICS_RATE の固定刻みで連続的に判定し，"frame" では従来どおり 60fps で1フレームずつ進める．
+    record=True では乱数の種・パドル位置・刺激パターンを Data/game_*.rec に記録する (gamerecord.py で再実行できる)．
+    seed を省略すると乱数の種を選んで記録する．
+    journal には journal.EventJournal を渡す (ボール位置・打ち返し・ミス・刺激パターンの変化を記録)．
+    """
+    def __init__(self, Size, clock=None, decoder="analytic", display=True, seed=None, renderer="dirty", renderRate=None,
+                 physics="swept", record=False, journal=None):
         self.size = Size 
-        self.screen = pygame.display.set_mode(self.size)
-        pygame.display.set_caption("Pong - Hybrid Mode Control")
+        # 時計 (シミュレーション時は仮想時計を渡す)
+        self.hwClock = clock if clock is not None else RealClock()
+        self.display = display
+        self.journal = journal
+        self.renderRate = renderRate or FRAME_RATE
+        self.renderer = None
+        if seed is None:
+            seed = randint(0, 2**31 - 1)
+        self.sim = make_sim(self.size, seed, physics)
+        self.dt = 1.0 / (PHYSICS_RATE if physics == "swept" else FRAME_RATE)
+        self.recorder = GameRecorder.create(self.sim, self.dt, game="random", decoder=decoder,
+                                            wall0=float(self.hwClock.time())) if record else None
+        if self.journal is not None:
+            self.journal.reset()
 
-        self.lastRawData = ""
         self.carryOn = True 
-        self.score = 0
+        self.paddleHeight = self.sim.paddleHeight
+        if self.display:
+            self._initDisplay()
+            if renderer == "dirty":
+                self.renderer = DirtyRenderer(self.screen, self.sim, BLUE, score_pos(self.size))
+
+        self.decoder = make_decoder(self.size, decoder)
 
-        self.paddleHeight = round(self.size[1] / 3)
-        self.paddle = Paddle(WHITE, round(self.size[0] * 0.015), self.paddleHeight, self.size)
-        self.paddle.rect.x = round(self.size[0] * 0.002)
-        self.paddle.rect.y = round(self.size[1] / 2)
+    def _initDisplay(self):
+        pygame.init()
+        self.screen = pygame.display.set_mode(self.size)
+        pygame.display.set_caption("Pong - Hybrid Mode Control")
 
-        ball_size = round(self.size[1] * 0.03663793103)
-        self.ball = Ball(WHITE, ball_size, ball_size)
-        self.ball.reset(round(self.size[0] / 2), round(self.size[1] / 2))
+        # スプライト (位置は毎フレーム PongSim から反映)
+        self.paddle = Paddle(WHITE, self.sim.paddleWidth, self.paddleHeight, self.size)
+        self.paddle.rect.x = self.sim.paddleX
+        self.ball = Ball(WHITE, self.sim.ballSize, self.sim.ballSize)
 
         self.region_list = []
-        r_width = self.size[0] // 2
-        r_height = self.size[1] // 3
-        for i in range(6):
-            reg = Region(BLUE, r_width, r_height)
-            reg.rect.x = (i % 2) * r_width
-            reg.rect.y = (i // 2) * r_height 
+        for x, y, w, h in self.sim.regions:
+            reg = Region(BLUE, w, h)
+            reg.rect.x = x
+            reg.rect.y = y
             self.region_list.append(reg)
 
         self.all_sprites_list = pygame.sprite.Group()
@@ -47,84 +81,107 @@ class Pong():
         self.all_sprites_list.add(self.paddle)
         self.all_sprites_list.add(self.ball)
 
+    @property
+    def score(self):
+        return self.sim.score
+
     def extractPosition(self, rawData):
         try:
-            temp = rawData.split(',')
-            currents = [float(temp[0]), float(temp[1]), float(temp[2])]
-            def mapCurrent(c, maxC, minC):
-                return max(0.0, min(1.0, (c - minC) / (maxC - minC)))
-            # 閾値はゲルの状態に合わせて適宜 3, -10 を調整
-            curTop = mapCurrent(currents[0], 5, -11.7)
-            curMid = mapCurrent(currents[1], 2.9, -10.7)
-            curBot = mapCurrent(currents[2], 4.0, -11.4)
-
-            def func(x, a, b, c):
-                return a * np.power(x, 2) + b * x + c
-
-            xdata = np.array([self.size[1]/6, 3*self.size[1]/6, 5*self.size[1]/6])
-            ydata = np.array([curTop, curMid, curBot])
-            popt, _ = opt.curve_fit(func, xdata, ydata)
-            dispX = np.linspace(0, self.size[1], self.size[1])
-            dispY = func(dispX, *popt)
-            pos = np.argmax(dispY) - (self.paddleHeight / 2)
-            self.paddle.setPos(int(pos))
+            temp = rawData.split(',') if isinstance(rawData, str) else rawData
+            self.sim.setPaddle(self.decoder.decode(float(temp[0]), float(temp[1]), float(temp[2])))
         except: pass
 
     def gameLoop(self):
-        clock = pygame.time.Clock()
-        hitFlag = False
-
-        while self.carryOn:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.carryOn = False 
-
-            if config.SenseQ != "":
-                if self.lastRawData != config.SenseQ:
-                    self.extractPosition(config.SenseQ)
-                    self.lastRawData = config.SenseQ
-
-            self.all_sprites_list.update()
-            config.BallQ = f"{self.ball.rect.x},{self.ball.rect.y},{self.score}"
-
-            # 壁衝突
-            if self.ball.rect.x >= self.size[0] - 40:
-                self.ball.velocity[0] = -abs(self.ball.velocity[0])
-            if self.ball.rect.x <= 0: 
-                self.score = 0
-                self.ball.reset(round(self.size[0] / 2), round(self.size[1] / 2))
-            if self.ball.rect.y > self.size[1] - 40:
-                self.ball.velocity[1] = -abs(self.ball.velocity[1])
-            if self.ball.rect.y < 0:
-                self.ball.velocity[1] = abs(self.ball.velocity[1])
-
-            # パドル衝突
-            if pygame.sprite.collide_mask(self.ball, self.paddle) and not hitFlag:
-                self.ball.bounce()
-                self.score += 1
-                hitFlag = True
-            elif not pygame.sprite.collide_mask(self.ball, self.paddle):
-                hitFlag = False
-
-            # --- リージョン判定と刺激パターンの共有 ---
-            current_stim = [0] * 6
-            for i, reg in enumerate(self.region_list):
-                if pygame.sprite.collide_rect(self.ball, reg):
-                    reg.activate()
-                    current_stim[i] = 1 
-                else:
-                    reg.deactivate()
-            
-            # メインプログラム(sensor_bridge)が参照する信号を更新
-            config.RelayQ = ",".join(map(str, current_stim))
-
-            self.screen.fill(BLACK)
-            self.all_sprites_list.draw(self.screen) 
-            font = pygame.font.Font(None, 74)
-            text = font.render(str(self.score), 1, WHITE)
-            self.screen.blit(text, (self.size[0] // 2, 10))
-            
-            pygame.display.flip()
-            clock.tick(60)
-
-        pygame.quit()
+        # 物理計算は固定の刻み dt でゲーム内時間に追いつくまで進め (1回の描画あたり最大 MAX_SUBSTEPS)，
+        # 描画は renderRate で前後のステップの間を補間した位置に行う
+        dt = self.dt
+        last = self.hwClock.monotonic()
+        nextRender = last
+        acc = 0.0
+        lastMask = None
+        senseSub = config.SenseQ.subscribe()
+        sim = self.sim
+        journal = self.journal
+
+        try:
+            while self.carryOn:
+                if self.display:
+                    for event in pygame.event.get():
+                        if event.type == pygame.QUIT:
+                            self.carryOn = False 
+
+                # 新しいセンサー値が届いたときのみパドルを移動
+                sample = senseSub.latest()
+                if sample is not None:
+                    self.extractPosition(sample[1])
+
+                now = self.hwClock.monotonic()
+                acc += now - last
+                last = now
+                steps = 0
+                while acc >= dt and steps < MAX_SUBSTEPS:
+                    sim.move(dt=dt)
+                    config.BallQ.publish(sim.ballX, sim.ballY, sim.score)
+
+                    # 壁・パドル・リージョンの判定 (ミスしたらスコアを0にしてボールを中央へ)
+                    events = sim.collide()
+                    if journal is not None:
+                        for kind, mask, x, y, score in events:
+                            (journal.miss if kind == EVENT_MISS else journal.paddle)(mask, x, y, score)
+                        journal.ball(sim.ballX, sim.ballY, sim.score)
+                    if self.recorder is not None:
+                        self.recorder.step()
+
+                    # 刺激パターンが変わったときのみサンプリングスレッドへ依頼
+                    if sim.mask != lastMask:
+                        config.RelayQ.publish(sim.mask, int(self.hwClock.monotonic() * 1e9))
+                        lastMask = sim.mask
+                        if journal is not None:
+                            journal.stim(sim.mask)
+                    acc -= dt
+                    steps += 1
+
+                if steps == MAX_SUBSTEPS and acc >= dt:
+                    # 処理が間に合わない分は捨てる (遅れを取り戻そうとしてさらに遅れるのを防ぐ)
+                    acc = 0.0
+
+                wait = dt - acc
+                if self.display:
+                    # 描画はゲームの進行と独立に renderRate で間引く
+                    if now >= nextRender:
+                        self.draw(acc / dt if sim.physics == "swept" else 1.0)
+                        nextRender = max(nextRender + 1.0 / self.renderRate, now)
+                    wait = min(wait, nextRender - now)
+                # 次のステップか描画の時刻まで待つ (仮想時計では倍速で進む)
+                self.hwClock.sleep(wait)
+        finally:
+            # Ctrl+C で中断された場合も後始末を行う
+            senseSub.close()
+            if self.recorder is not None:
+                self.recorder.close()
+                print(f"Game record saved to {self.recorder.path}")
+            if self.renderer is not None:
+                print(f"Renderer: {self.renderer.summary()}")
+            if self.display:
+                pygame.quit()
+
+    def draw(self, alpha=1.0):
+        """PongSim の状態を画面に描画する (ボールは前のステップから alpha だけ進めた位置)"""
+        if self.renderer is not None:
+            self.renderer.draw(alpha)
+            return
+        sim = self.sim
+        self.paddle.rect.y = sim.paddleY
+        self.ball.rect.x, self.ball.rect.y = sim.interpolate(alpha)
+        for i, reg in enumerate(self.region_list):
+            if sim.mask >> i & 1:
+                reg.activate()
+            else:
+                reg.deactivate()
+        self.screen.fill(BLACK)
+        self.all_sprites_list.draw(self.screen) 
+        font = pygame.font.Font(None, 74)
+        text = font.render(str(sim.score), 1, WHITE)
+        self.screen.blit(text, score_pos(self.size))
+        
+        pygame.display.flip()
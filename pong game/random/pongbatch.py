@@ -0,0 +1,241 @@
+# pongbatch.py
+# 多数の Pong を NumPy の配列でまとめて進めるバッチ環境
+#
+# PongSim (pongsim.py) と同じ規則を N 個のゲームについて1回のベクトル演算で進める．
+# 乱数の種・ボールの速さ・パドルの高さ・デコーダの設定を変えたスイープを，
+# Python のループで N 個の PongSim を回すより桁違いに速く評価できる．
+#
+#   env = BatchPong(1024, ballSpeed=np.linspace(10, 30, 1024), seed=0)
+#   obs = env.reset()
+#   obs, reward, done, info = env.step(paddleY)    # paddleY: (N,) パドル上端の位置
+#
+# 閉ループで動かす場合は BatchGel (ゲルの応答モデルのベクトル版) の電流値を
+# decode_groups() でパドル位置に変換して step() に渡す．
+#
+#   python pongbatch.py --envs 1024 --minutes 10 --speeds 10,15,20,25
+
+import time
+import argparse
+import numpy as np
+from pongsim import FRAME_RATE, GAMES, load_game, local_game
+from geometry import RegionGrid, tra_regions
+from hardware import DEFAULT_GAINS, DEFAULT_OFFSETS, DEFAULT_TAUS
+
+OBS_FIELDS = ("BallX", "BallY", "VelX", "VelY", "PaddleY", "Score")
+
+
+def _round(v):
+    # pygame.Rect と同じ丸め (0.5 は0から遠い方へ．geometry.rect_round のベクトル版)
+    return np.where(v >= 0, np.floor(v + 0.5), -np.floor(0.5 - v)).astype(np.int64)
+
+
+def _param(value, n, dtype):
+    """スカラーまたは長さ n の配列を長さ n の配列にする"""
+    a = np.asarray(value, dtype=dtype)
+    return np.full(n, a, dtype=dtype) if a.ndim == 0 else a.copy()
+
+
+class BatchPong:
+    """N 個の Pong (PongSim と同じ規則) を配列でまとめて進める
+
+    regions        : 刺激領域 (x, y, 幅, 高さ) のリスト (全ゲーム共通)
+    seed           : 発射角度の乱数の種 (全ゲームで1つの乱数列を使う)
+    ballSpeed      : ボールの速さ [px/フレーム] (スカラーまたは (N,))
+    paddleHeight   : パドルの高さ (スカラーまたは (N,)．None で画面の 1/3)
+    immediateReset : ミスしたらその場でボールを中央に戻す (random の規則)
+    """
+
+    def __init__(self, n, size=(1000, 1000), regions=None, seed=None, ballSpeed=20.0,
+                 paddleHeight=None, immediateReset=False):
+        self.n = n
+        self.size = size
+        self.regions = np.asarray(regions if regions is not None else tra_regions(size), dtype=np.int64)
+        self.grid = RegionGrid(self.regions)
+        self.immediateReset = immediateReset
+        self.seed = seed
+        self.ballSpeed = _param(ballSpeed, n, np.float64)
+        self.paddleHeight = _param(round(size[1] / 3) if paddleHeight is None else paddleHeight, n, np.int64)
+        self.paddleLimit = size[1] - self.paddleHeight
+        self.paddleX = round(size[0] * 0.002)
+        self.paddleWidth = round(size[0] * 0.015)
+        self.ballSize = round(size[1] * 0.03663793103)
+        self.bits = (1 << np.arange(len(self.regions))).astype(np.int64)
+        # 状態 (reset() で初期化)
+        self.ball = np.zeros((n, 2), dtype=np.int64)         # ボール左上の位置 (x, y)
+        self.velocity = np.zeros((n, 2), dtype=np.float64)   # 速度 [px/フレーム]
+        self.paddle = np.zeros(n, dtype=np.int64)            # パドル上端の位置
+        self.score = np.zeros(n, dtype=np.int64)
+        self.hitFlag = np.zeros(n, dtype=bool)
+        self.occupancy = np.zeros((n, len(self.regions)), dtype=bool)   # ボールが重なっている刺激領域
+        self.mask = np.zeros(n, dtype=np.int64)              # 刺激パターン (bit i = 領域 i)
+        self.steps = 0
+        self.rng = np.random.default_rng(seed)
+
+    def reset(self, seed=None):
+        """全ゲームを初期状態に戻し，観測 (N, 6) を返す"""
+        if seed is not None:
+            self.seed = seed
+        self.rng = np.random.default_rng(self.seed)
+        self.score[:] = 0
+        self.hitFlag[:] = False
+        self.occupancy[:] = False
+        self.mask[:] = 0
+        self.paddle[:] = round(self.size[1] / 2)
+        self.steps = 0
+        self._launch(np.ones(self.n, dtype=bool), center=True)
+        return self.observe()
+
+    def observe(self):
+        """観測 (N, 6): ボールX, ボールY, 速度X, 速度Y, パドルY, スコア (OBS_FIELDS の順)"""
+        return np.column_stack([self.ball.astype(np.float64), self.velocity,
+                                self.paddle.astype(np.float64), self.score.astype(np.float64)])
+
+    def _launch(self, which, center):
+        """which のゲームのボールを右向き 30〜60度で発射する (center で中央に戻す)"""
+        k = int(np.count_nonzero(which))
+        if k == 0:
+            return
+        angle = self.rng.uniform(np.pi / 6, np.pi / 3, k)
+        direction = self.rng.choice(np.array([-1.0, 1.0]), k)
+        speed = self.ballSpeed[which]
+        self.velocity[which, 0] = speed * np.cos(angle)
+        self.velocity[which, 1] = speed * np.sin(angle) * direction
+        if center:
+            self.ball[which] = (round(self.size[0] / 2), round(self.size[1] / 2))
+
+    def step(self, paddleY=None):
+        """全ゲームを1フレーム進める
+
+        paddleY : (N,) のパドル上端の位置 (None で動かさない)
+        戻り値  : (観測, 報酬 (打ち返し +1 / ミス -1), ミスしたか, info)
+        """
+        W, H = self.size
+        if paddleY is not None:
+            self.paddle = np.minimum(np.maximum(_round(np.asarray(paddleY, dtype=np.float64)), 0), self.paddleLimit)
+        self.ball = _round(self.ball + self.velocity)
+        self.steps += 1
+        x, y = self.ball[:, 0], self.ball[:, 1]
+        vx, vy = self.velocity[:, 0], self.velocity[:, 1]
+
+        # 右壁・下壁・上壁は跳ね返るのみ，左壁はミス
+        vx[x >= W - 40] = -np.abs(vx[x >= W - 40])
+        missed = x <= 0
+        self.score[missed] = 0
+        if self.immediateReset:
+            self._launch(missed, center=True)
+        vy[y > H - 40] = -np.abs(vy[y > H - 40])
+        vy[y < 0] = np.abs(vy[y < 0])
+
+        # パドル: 重なった最初のフレームだけ打ち返す
+        s = self.ballSize
+        overlap = ((x < self.paddleX + self.paddleWidth) & (self.paddleX < x + s) &
+                   (y < self.paddle + self.paddleHeight) & (self.paddle < y + s))
+        hit = overlap & ~self.hitFlag
+        self._launch(hit, center=False)
+        self.score[hit] += 1
+        self.hitFlag = overlap
+
+        # 刺激領域 (格子の表引きで刺激パターンを求め，(N, 領域数) の占有に展開)
+        self.mask = self.grid.mask_batch(x, y, s, s)
+        self.occupancy = (self.mask[:, None] & self.bits) != 0
+
+        info = {"mask": self.mask.copy(), "hit": hit, "missed": missed,
+                "eventMask": np.where(hit | missed, self.mask, -1)}
+        if not self.immediateReset:
+            self._launch(missed, center=True)
+        reward = hit.astype(np.float64) - missed
+        return self.observe(), reward, missed, info
+
+
+class BatchGel:
+    """N 個のゲルの応答モデル (hardware.GelModel のベクトル版)
+
+    pins : 刺激パターンの bit i に対応する電極ピン (gains のキー)
+    gains, offsets, taus は GelModel と同じ (gains はピンごとの各センサー電流への寄与 [mA])
+    """
+
+    def __init__(self, n, pins, gains=None, offsets=DEFAULT_OFFSETS, taus=DEFAULT_TAUS, noise=0.0, seed=None):
+        gains = DEFAULT_GAINS if gains is None else gains
+        self.n = n
+        self.gain = np.array([gains.get(pin, (0.0, 0.0, 0.0)) for pin in pins], dtype=np.float64)  # (ピン, 3)
+        self.offsets = np.asarray(offsets, dtype=np.float64)
+        self.taus = np.asarray(taus, dtype=np.float64)
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.bits = (1 << np.arange(len(pins))).astype(np.int64)
+        self.values = np.tile(self.offsets, (n, 1))
+
+    def step(self, mask, dt):
+        """刺激パターン (N,) を dt [s] 印加した後の電流値 (N, 3) を返す"""
+        active = (np.asarray(mask, dtype=np.int64)[:, None] & self.bits) != 0
+        target = self.offsets + active.astype(np.float64) @ self.gain
+        alpha = np.where(self.taus > 0, 1.0 - np.exp(-dt / np.where(self.taus > 0, self.taus, 1.0)), 1.0)
+        self.values += (target - self.values) * alpha
+        if self.noise:
+            return self.values + self.rng.normal(0.0, self.noise, self.values.shape)
+        return self.values.copy()
+
+
+def decode_groups(decoders, groups, currents):
+    """ゲームごとにデコーダを選んで電流値 (N, 3) からパドル位置 (N,) を求める
+
+    decoders : デコーダのリスト (decoder.DECODERS で作成)
+    groups   : (N,) 各ゲームが使うデコーダの番号
+    """
+    groups = np.asarray(groups)
+    paddle = np.empty(len(currents), dtype=np.int64)
+    for k, decoder in enumerate(decoders):
+        sel = groups == k
+        if np.any(sel):
+            c = currents[sel]
+            paddle[sel] = decoder.decode_batch(c[:, 0], c[:, 1], c[:, 2])
+    return paddle
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep ball speeds over a batch of headless Pong games")
+    parser.add_argument("--game", choices=sorted(GAMES), default=local_game(),
+                        help="game settings to use (default: the game in this folder)")
+    parser.add_argument("--envs", type=int, default=1024, help="number of games")
+    parser.add_argument("--minutes", type=float, default=10.0, help="game time to simulate")
+    parser.add_argument("--speeds", default="10,15,20,25", help="ball speeds [px/frame] to compare")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--noise", type=float, default=0.0, help="sensor noise of the gel model [mA]")
+    args = parser.parse_args()
+
+    # ゲームごとの設定 (刺激領域の配置・デコーダの校正値・電極ピン) はゲームの設定のモジュールから読む (pygame は不要)
+    try:
+        game = load_game(args.game)
+    except ModuleNotFoundError as e:
+        # 設定のモジュール自体がない場合のみ (その中の import の失敗はそのまま伝える)
+        if e.name != GAMES.get(args.game):
+            raise
+        parser.error(f"game '{args.game}' ({e.name}.py) is not in this folder")
+    sim = game.make_sim()
+    speeds = [float(v) for v in args.speeds.split(',')]
+    group = np.arange(args.envs) % len(speeds)
+    env = BatchPong(args.envs, sim.size, sim.regions, seed=args.seed,
+                    ballSpeed=np.asarray(speeds)[group], immediateReset=sim.immediateReset)
+    gel = BatchGel(args.envs, game.ELECTRODE_PINS, noise=args.noise, seed=args.seed)
+    decoders = [game.make_decoder(sim.size)]
+    env.reset()
+
+    hits = np.zeros(args.envs, dtype=np.int64)
+    misses = np.zeros(args.envs, dtype=np.int64)
+    frames = round(args.minutes * 60 * FRAME_RATE)
+    t0 = time.perf_counter()
+    for _ in range(frames):
+        currents = gel.step(env.mask, 1.0 / FRAME_RATE)
+        _, reward, _, _ = env.step(decode_groups(decoders, np.zeros(args.envs), currents))
+        hits += reward > 0
+        misses += reward < 0
+    elapsed = time.perf_counter() - t0
+    print(f"{args.envs} games x {args.minutes * 60:.0f} s game time in {elapsed:.2f} s "
+          f"({args.envs * frames / elapsed:.0f} game frames/s)")
+    for k, speed in enumerate(speeds):
+        sel = group == k
+        print(f"  ball speed {speed:g}: hits {hits[sel].mean():.1f}, misses {misses[sel].mean():.1f} per game")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+# pongsim.py
+# 画面を使わない Pong のシミュレーション本体と，実時間より速く回すヘッドレス実行
+#
+# ボール・パドル・刺激領域の状態，壁・パドル・ミスの規則，スコアと刺激パターンの計算を
+# pygame なしで1フレームずつ進める．pong.py / pong_random_tra.py はこれを1フレームごとに
+# 進めて描画するだけで，描画 (pygame) は省略できる．
+# ゲームごとの設定 (刺激領域の配置・デコーダの校正値・電極ピン) は tra_game.py / game_random_tra.py にあり，
+# pygame なしで読み込める．
+#
+# 物理計算は2種類．
+#   physics="frame" : 従来どおり 1/60秒ごとに速度 [px/フレーム] だけ動かし，動いた後の位置で判定する
+#   physics="swept" : 任意の刻み dt で小数の位置を進め，壁は反射，パドルは通過した面との交点で判定する
+#                     (速いボールが薄いパドルをすり抜けない．速さは frame と同じ px/フレーム で指定)
+#
+# ヘッドレス実行 (HeadlessRunner) はフレームの待ち時間なしで SteppedClock を進め，
+# ゲルモデル (GelSource) または記録データ (TraceSource) をセンサーとして使う．
+#
+#   python pongsim.py --minutes 60 --seed 1               # ゲルモデルで1時間分
+#   python pongsim.py --trace combined_data_xxx.csv       # 記録データの電流値で再生
+#   python pongsim.py --game random                       # ゲームを指定 (省略時は同じフォルダのゲーム)
+
+import os
+import math
+import time
+import random
+import argparse
+import importlib
+from hardware import SteppedClock, GelModel
+from geometry import RegionGrid, rect_overlap, rect_round, tra_regions
+
+FRAME_RATE = 60          # ゲームの1秒あたりのフレーム数 (ゲーム内時間)
+PHYSICS_RATE = 120       # physics="swept" の1秒あたりの物理計算の回数
+EVENT_PADDLE = "paddle"  # パドルで打ち返した
+EVENT_MISS = "miss"      # ミス (スコアリセット)
+GAMES = {"tra": "tra_game", "random": "game_random_tra"}   # ゲーム名 -> ゲームの設定のモジュール (pygame を使わない)
+
+
+class PongSim:
+    """画面なしの Pong (1回の step() で1フレーム進める)
+
+    regions        : 刺激領域 (x, y, 幅, 高さ) のリスト (bit i = regions[i])
+    seed           : ボールの発射角度の乱数の種 (None で random モジュールを共有)
+    immediateReset : ミスしたらその場でボールを中央に戻す (random の規則．False では領域判定の後)
+    physics        : "frame" (従来の1フレーム単位) / "swept" (連続的な衝突判定)
+    """
+
+    def __init__(self, size=(1000, 1000), regions=None, seed=None, immediateReset=False, ballSpeed=20.0,
+                 physics="frame"):
+        if physics not in ("frame", "swept"):
+            raise ValueError(f"Unknown physics: {physics}")
+        self.size = size
+        self.physics = physics
+        self.regions = list(regions if regions is not None else tra_regions(size))
+        self.grid = RegionGrid(self.regions)
+        self.seed = seed
+        self.rng = random.Random(seed) if seed is not None else random
+        self.immediateReset = immediateReset
+        self.ballSpeed = ballSpeed
+        # パドルとボールの大きさ (pong.py の Paddle / Ball と同じ)
+        self.paddleX = round(size[0] * 0.002)
+        self.paddleWidth = round(size[0] * 0.015)
+        self.paddleHeight = round(size[1] / 3)
+        self.paddleLimit = size[1] - self.paddleHeight
+        self.ballSize = round(size[1] * 0.03663793103)
+        self.reset()
+
+    def reset(self):
+        """スコアを0にし，パドルを中央，ボールを中央から発射した状態にする"""
+        self.score = 0
+        self.steps = 0
+        self.hitFlag = False
+        self._hit = False
+        self.mask = 0
+        self.paddleY = round(self.size[1] / 2)
+        self.resetBall()
+
+    def resetBall(self):
+        """ボールを中央に置き，右方向へ 30〜60度の角度で発射する"""
+        angle = self.rng.uniform(math.pi / 6, math.pi / 3)
+        direction = self.rng.choice([-1, 1])
+        self.vx = self.ballSpeed * math.cos(angle)
+        self.vy = self.ballSpeed * math.sin(angle) * direction
+        self.ballX = round(self.size[0] / 2)
+        self.ballY = round(self.size[1] / 2)
+        # 小数の位置 (swept) と描画の補間に使う1ステップ前の位置 (中央へ戻したときは補間しない)
+        self.posX, self.posY = float(self.ballX), float(self.ballY)
+        self.prevX, self.prevY = self.posX, self.posY
+
+    def bounce(self):
+        """パドルで打ち返す (右向きに 30〜60度の角度を選び直す)"""
+        angle = self.rng.uniform(math.pi / 6, math.pi / 3)
+        direction = self.rng.choice([-1, 1])
+        self.vx = self.ballSpeed * math.cos(angle)
+        self.vy = self.ballSpeed * math.sin(angle) * direction
+
+    def setPaddle(self, y):
+        """パドルの上端を y にする (画面内に制限)"""
+        self.paddleY = min(max(rect_round(y), 0), self.paddleLimit)
+
+    def step(self, paddleY=None, dt=None):
+        """1ステップ進める．発生したイベント (種類, 刺激パターン, ボールX, ボールY, スコア) のリストを返す
+
+        dt は physics="swept" の刻み [s] (省略時 1/PHYSICS_RATE)．"frame" では常に1フレーム
+        """
+        self.move(paddleY, dt)
+        return self.collide()
+
+    def move(self, paddleY=None, dt=None):
+        """パドルを paddleY へ動かし，ボールを1ステップ分進める"""
+        if paddleY is not None:
+            self.setPaddle(paddleY)
+        self.steps += 1
+        self.prevX, self.prevY = self.posX, self.posY
+        if self.physics == "swept":
+            self._sweep(1.0 / PHYSICS_RATE if dt is None else dt)
+            return
+        # 位置は整数 (pygame.Rect と同じく毎フレーム丸める)
+        self.ballX = rect_round(self.ballX + self.vx)
+        self.ballY = rect_round(self.ballY + self.vy)
+        self.posX, self.posY = float(self.ballX), float(self.ballY)
+
+    def _sweep(self, dt):
+        # この刻みで進む距離 (速度は px/フレーム)
+        f = dt * FRAME_RATE
+        x0, y0 = self.posX, self.posY
+        x1, y1 = x0 + self.vx * f, y0 + self.vy * f
+        s = self.ballSize
+        self._hit = False
+        # パドルの右面を左向きに通過したら，通過した時刻の位置で上下の重なりを調べる
+        face = self.paddleX + self.paddleWidth
+        if self.vx < 0 and x0 >= face > x1:
+            t = (x0 - face) / (x0 - x1)
+            yc = y0 + (y1 - y0) * t
+            if yc < self.paddleY + self.paddleHeight and self.paddleY < yc + s:
+                # 残りの時間は打ち返した後の速度で進む
+                self.bounce()
+                x1 = face + self.vx * f * (1 - t)
+                y1 = yc + self.vy * f * (1 - t)
+                self._hit = True
+        # パドルがボールに重なるように動いた場合 (従来と同じく重なった最初の1回だけ打ち返す)
+        overlap = rect_overlap(rect_round(x1), rect_round(y1), s, s,
+                               self.paddleX, self.paddleY, self.paddleWidth, self.paddleHeight)
+        if overlap and not self.hitFlag and not self._hit and self.vx < 0:
+            self.bounce()
+            self._hit = True
+        self.hitFlag = overlap or self._hit
+        # 壁は反射 (通過した分を折り返す)
+        W, H = self.size
+        if x1 > W - 40 and self.vx > 0:
+            x1 = 2 * (W - 40) - x1
+            self.vx = -self.vx
+        if y1 < 0 and self.vy < 0:
+            y1 = -y1
+            self.vy = -self.vy
+        if y1 > H - 40 and self.vy > 0:
+            y1 = 2 * (H - 40) - y1
+            self.vy = -self.vy
+        self.posX, self.posY = x1, y1
+        self.ballX, self.ballY = rect_round(x1), rect_round(y1)
+
+    def interpolate(self, alpha):
+        """描画用のボール位置 (前のステップと現在の位置を alpha : 1 - alpha で補間)"""
+        return (rect_round(self.prevX + (self.posX - self.prevX) * alpha),
+                rect_round(self.prevY + (self.posY - self.prevY) * alpha))
+
+    def collide(self):
+        """壁・パドル・刺激領域の判定を行い，イベントのリストを返す (move() の後に呼ぶ)"""
+        if self.physics == "swept":
+            return self._collideSwept()
+        events = []
+        W, H = self.size
+        missed = False
+        # 右壁・下壁・上壁は跳ね返るのみ，左壁はミス
+        if self.ballX >= W - 40:
+            self.vx = -abs(self.vx)
+        if self.ballX <= 0:
+            self.score = 0
+            missed = True
+            if self.immediateReset:
+                self.resetBall()
+        if self.ballY > H - 40:
+            self.vy = -abs(self.vy)
+        if self.ballY < 0:
+            self.vy = abs(self.vy)
+
+        scored = missed
+        s = self.ballSize
+        if rect_overlap(self.ballX, self.ballY, s, s, self.paddleX, self.paddleY, self.paddleWidth, self.paddleHeight):
+            if not self.hitFlag:
+                self.hitFlag = True
+                self.bounce()
+                self.score += 1
+                scored = True
+        else:
+            self.hitFlag = False
+
+        mask = self.grid.mask(self.ballX, self.ballY, s, s)
+        self.mask = mask
+
+        if scored:
+            events.append((EVENT_MISS if missed else EVENT_PADDLE, mask, self.ballX, self.ballY, self.score))
+            if missed and not self.immediateReset:
+                self.resetBall()
+        return events
+
+    def _collideSwept(self):
+        # 壁・パドルは _sweep() で処理済み．ミス・スコア・刺激領域を判定する
+        events = []
+        missed = self.posX <= 0
+        if missed:
+            self.score = 0
+            if self.immediateReset:
+                self.resetBall()
+        if self._hit:
+            self.score += 1
+        s = self.ballSize
+        mask = self.grid.mask(self.ballX, self.ballY, s, s)
+        self.mask = mask
+        if missed or self._hit:
+            events.append((EVENT_MISS if missed else EVENT_PADDLE, mask, self.ballX, self.ballY, self.score))
+            if missed and not self.immediateReset:
+                self.resetBall()
+        self._hit = False
+        return events
+
+
+class GelSource:
+    """ゲルの応答モデル (hardware.GelModel) を刺激パターンで駆動するセンサー入力源
+
+    pins : 刺激パターンの bit i に対応する電極ピン (モデルの gains のキー)
+    """
+
+    def __init__(self, clock, pins, **modelOptions):
+        self.clock = clock
+        self.pins = list(pins)
+        self.model = GelModel(clock, **modelOptions)
+        self.mask = 0
+
+    def read(self, mask):
+        """刺激パターンを反映して現在の電流値 (cBlack, cBrown, cRed) を返す．終了時は None"""
+        if mask != self.mask:
+            for i, pin in enumerate(self.pins):
+                if (mask ^ self.mask) >> i & 1:
+                    self.model.set_level(pin, self.model.active_level if mask >> i & 1 else 1 - self.model.active_level)
+            self.mask = mask
+        return tuple(self.model.read(k) for k in range(3))
+
+
+class TraceSource:
+    """記録データ (combined_data CSV) の電流値を clock の時刻に合わせて返すセンサー入力源"""
+
+    def __init__(self, clock, path):
+        from replay import TraceReplay
+        self.replay = TraceReplay(path, speed=1.0, clock=clock)
+
+    def read(self, mask):
+        text = self.replay.getCurrents_RPI()
+        if not text:
+            return None
+        return tuple(float(v) for v in text.split(',')[:3])
+
+
+class HeadlessRunner:
+    """PongSim をフレームの待ち時間なしで進める (ゲーム内時間は SteppedClock で進む)
+
+    decoder   : 電流値からパドル位置を求めるデコーダ (decoder.DECODERS)
+    source    : センサー入力源 (GelSource / TraceSource)．read(刺激パターン) で電流値を返す
+    observers : 毎フレーム observer(sim, events) を呼ぶ (描画・記録などに使う)
+    frameRate : 1秒あたりのステップ数 (physics="swept" の PongSim では物理計算の刻み 1/frameRate)
+    """
+
+    def __init__(self, sim, decoder, source, clock, frameRate=FRAME_RATE, observers=()):
+        self.sim = sim
+        self.decoder = decoder
+        self.source = source
+        self.clock = clock
+        self.frameRate = frameRate
+        self.observers = list(observers)
+        self.hits = 0
+        self.misses = 0
+        self.maxRally = 0
+        self.maskChanges = 0
+        self.wallTime = 0.0
+
+    def run(self, duration=None, frames=None):
+        """ゲーム内時間 duration [s] (または frames フレーム) だけ進める．センサー入力が尽きたら終了"""
+        if frames is None:
+            frames = None if duration is None else round(duration * self.frameRate)
+        sim, dt = self.sim, 1.0 / self.frameRate
+        lastMask = sim.mask
+        t0 = time.perf_counter()
+        n = 0
+        while frames is None or n < frames:
+            currents = self.source.read(sim.mask)
+            if currents is None:
+                break
+            events = sim.step(self.decoder.decode(*currents), dt)
+            for event in events:
+                if event[0] == EVENT_MISS:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                self.maxRally = max(self.maxRally, event[4])
+            if sim.mask != lastMask:
+                self.maskChanges += 1
+                lastMask = sim.mask
+            for observer in self.observers:
+                observer(sim, events)
+            self.clock.advance(dt)
+            n += 1
+        self.wallTime += time.perf_counter() - t0
+        return n
+
+    def summary(self):
+        gameTime = self.sim.steps / self.frameRate
+        speed = gameTime / self.wallTime if self.wallTime > 0 else 0.0
+        return (f"{gameTime:.0f} s game time in {self.wallTime:.2f} s ({speed:.0f}x), "
+                f"{self.hits} hits, {self.misses} misses, max rally {self.maxRally}, {self.maskChanges} stimulation changes")
+
+
+def local_game():
+    """このファイルと同じフォルダにあるゲームの名前 (なければ None)"""
+    folder = os.path.dirname(os.path.abspath(__file__))
+    for name, module in GAMES.items():
+        if os.path.exists(os.path.join(folder, module + ".py")):
+            return name
+    return None
+
+
+def load_game(name=None):
+    """ゲームの設定のモジュール (make_sim / make_decoder / ELECTRODE_PINS を持つ) を読み込む
+
+    name : "tra" / "random" (None で同じフォルダのゲーム)
+    """
+    name = name or local_game()
+    if name not in GAMES:
+        raise ValueError(f"Unknown game: {name} (choose from {', '.join(GAMES)})")
+    return importlib.import_module(GAMES[name])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Pong game headless, faster than real time")
+    parser.add_argument("--game", choices=sorted(GAMES), default=local_game(),
+                        help="game settings to use (default: the game in this folder)")
+    parser.add_argument("--minutes", type=float, default=30.0, help="game time to simulate")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--decoder", default="analytic", help="analytic / lut")
+    parser.add_argument("--trace", default=None, help="combined_data CSV used as the sensor input")
+    parser.add_argument("--noise", type=float, default=0.0, help="sensor noise of the gel model [mA]")
+    parser.add_argument("--physics", default="frame", help="frame (one step per 1/60 s frame) / swept")
+    args = parser.parse_args()
+
+    # ゲームごとの設定 (刺激領域の配置・デコーダの校正値・電極ピン) はゲームの設定のモジュールから読む (pygame は不要)
+    try:
+        game = load_game(args.game)
+    except ModuleNotFoundError as e:
+        # 設定のモジュール自体がない場合のみ (その中の import の失敗はそのまま伝える)
+        if e.name != GAMES.get(args.game):
+            raise
+        parser.error(f"game '{args.game}' ({e.name}.py) is not in this folder")
+    clock = SteppedClock()
+    sim = game.make_sim(seed=args.seed, physics=args.physics)
+    decoder = game.make_decoder(sim.size, args.decoder)
+    if args.trace:
+        source = TraceSource(clock, args.trace)
+    else:
+        source = GelSource(clock, game.ELECTRODE_PINS, noise=args.noise, seed=args.seed)
+    runner = HeadlessRunner(sim, decoder, source, clock,
+                            frameRate=PHYSICS_RATE if args.physics == "swept" else FRAME_RATE)
+    runner.run(duration=args.minutes * 60)
+    print(runner.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# render.py
+# 変化した部分だけを描き直す Pong の画面描画 (dirty rectangle)
+#
+# 画面全体を毎フレーム塗り直して display.flip() する代わりに，pygame.sprite.LayeredDirty で
+# 動いたスプライト (ボール・パドル・スコア・状態の変わった刺激領域) の範囲だけを描き直し，
+# display.update() にその範囲のみを渡す．
+# 画像は起動時に表示形式へ変換 (convert) して保持し，刺激領域は ON / OFF の2枚を切り替える．
+# スコアの文字は文字列ごとにキャッシュし，フォントは1回だけ作る．
+# 描画結果は従来の全面描画 (Pong.draw) と同じになる．
+
+import pygame
+from ball import Ball
+from paddle import Paddle
+from region import Region
+
+BLACK = (0, 0, 0)
+WHITE = (255, 255, 255)
+
+
+class _Sprite(pygame.sprite.DirtySprite):
+    def __init__(self, image, x=0, y=0):
+        super().__init__()
+        self.image = image
+        self.rect = image.get_rect(topleft=(x, y))
+        self.dirty = 1
+
+    def moveTo(self, x, y):
+        if self.rect.x != x or self.rect.y != y:
+            self.rect.topleft = (x, y)
+            self.dirty = 1
+
+    def setImage(self, image):
+        if self.image is not image:
+            self.image = image
+            self.rect.size = image.get_size()
+            self.dirty = 1
+
+
+class DirtyRenderer:
+    """PongSim の状態を変化した部分だけ描画する
+
+    screen      : pygame.display.set_mode() の画面
+    regionColor : 刺激領域の色 (Region と同じく OFF 時は明るくした色)
+    scorePos    : スコアの表示位置 (左上)
+    """
+
+    def __init__(self, screen, sim, regionColor, scorePos, fontSize=74, maxGlyphs=1000):
+        self.screen = screen
+        self.sim = sim
+        self.scorePos = scorePos
+        self.frames = 0
+        self.updatedPixels = 0
+        self.maxGlyphs = maxGlyphs
+        self._font = pygame.font.Font(None, fontSize)
+        self._glyphs = {}
+
+        self.background = pygame.Surface(screen.get_size()).convert()
+        self.background.fill(BLACK)
+        self.group = pygame.sprite.LayeredDirty()
+        # 描画時間による全面描画への自動切り替えは使わない
+        self.group.set_timing_threshold(float("inf"))
+
+        # 刺激領域: Region で作った OFF / ON の画像を表示形式に変換して保持
+        self.regionImages = []
+        self.regions = []
+        for x, y, w, h in sim.regions:
+            region = Region(regionColor, w, h)
+            passive = region.image.convert()
+            region.activate()
+            active = region.image.convert()
+            self.regionImages.append((passive, active))
+            sprite = _Sprite(passive, x, y)
+            self.regions.append(sprite)
+            self.group.add(sprite, layer=0)
+
+        paddle = Paddle(WHITE, sim.paddleWidth, sim.paddleHeight, sim.size).image.convert()
+        paddle.set_colorkey(BLACK)
+        ball = Ball(WHITE, sim.ballSize, sim.ballSize).image.convert()
+        ball.set_colorkey(BLACK)
+        self.paddle = _Sprite(paddle, sim.paddleX, sim.paddleY)
+        self.ball = _Sprite(ball, sim.ballX, sim.ballY)
+        self.score = _Sprite(self._glyph(str(sim.score)), *scorePos)
+        self.group.add(self.paddle, layer=1)
+        self.group.add(self.ball, layer=2)
+        self.group.add(self.score, layer=3)
+        self.group.clear(screen, self.background)
+
+    def _glyph(self, text):
+        glyph = self._glyphs.get(text)
+        if glyph is None:
+            if len(self._glyphs) >= self.maxGlyphs:
+                self._glyphs.clear()
+            glyph = self._font.render(text, 1, WHITE).convert_alpha()
+            self._glyphs[text] = glyph
+        return glyph
+
+    def draw(self, alpha=1.0):
+        """現在の状態を描画し，画面を更新した範囲のリストを返す (ボールは PongSim.interpolate(alpha) の位置)"""
+        sim = self.sim
+        for i, sprite in enumerate(self.regions):
+            sprite.setImage(self.regionImages[i][sim.mask >> i & 1])
+        self.paddle.moveTo(sim.paddleX, sim.paddleY)
+        self.ball.moveTo(*sim.interpolate(alpha))
+        self.score.setImage(self._glyph(str(sim.score)))
+        rects = self.group.draw(self.screen)
+        pygame.display.update(rects)
+        self.frames += 1
+        self.updatedPixels += sum(r.width * r.height for r in rects)
+        return rects
+
+    def summary(self):
+        w, h = self.screen.get_size()
+        ratio = self.updatedPixels / (self.frames * w * h) if self.frames else 0.0
+        return f"{self.frames} frames drawn, {ratio * 100:.1f}% of the screen updated per frame"
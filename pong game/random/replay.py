@@ -0,0 +1,133 @@
+# replay.py
+# 記録済みの combined_data_*.csv を再生するセンサー入力源
+#
+# serialPlot.getCurrents_RPI() の代わりに記録された cBlack/cBrown/cRed を返すことで，
+# 実験を行わずにゲーム・デコーダ・ログ保存処理を実際のゲルの挙動で検証できる．
+
+import csv
+from hardware import RealClock
+
+SENSE_COLUMNS = ["cBlack", "cBrown", "cRed", "RawTime"]
+
+
+class TraceReplay:
+    """combined_data CSV の電流値を RawTime の間隔どおりに再生する
+
+    speed   : 再生倍速 (1.0 で記録時と同じ間隔)．0 または None で待ち時間なし (最速)
+    loop    : 末尾まで再生したら先頭から繰り返す
+    restamp : RawTime を再生時の時刻に置き換える
+    """
+
+    def __init__(self, path, speed=1.0, loop=False, restamp=False, clock=None):
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.restamp = restamp
+        self.clock = clock if clock is not None else RealClock()
+        self.finished = False
+        self.count = 0
+        self.last = ""   # 最後に返した値 (ログ保存など読み進めずに参照する用)
+
+        self._file = None
+        self._reader = None
+        self._cols = None
+        self._current = None
+        self._pending = None
+        self._t0 = None
+        self._raw0 = None
+        self._rawOffset = 0.0
+        self._lastRaw = 0.0
+        self._open()
+
+    def _open(self):
+        self._file = open(self.path, newline='')
+        self._reader = csv.reader(self._file)
+        header = [h.strip() for h in next(self._reader, [])]
+        if all(c in header for c in SENSE_COLUMNS):
+            self._cols = [header.index(c) for c in SENSE_COLUMNS]
+        else:
+            # ヘッダー名が異なる形式は tra_main.py の列順 (Timestamp, cBlack, cBrown, cRed, RawTime, ...) とみなす
+            self._cols = [1, 2, 3, 4]
+
+    def _nextRow(self):
+        """次の有効な行を (RawTime[ms], 値のリスト) で返す．終端では None"""
+        while True:
+            row = next(self._reader, None)
+            if row is None:
+                if not self.loop:
+                    return None
+                # 繰り返し再生: RawTime が単調増加し続けるようにずらす
+                self._file.close()
+                self._open()
+                self._rawOffset = self._lastRaw + 1.0
+                self._raw0 = None
+                continue
+            try:
+                values = [row[i].strip() for i in self._cols]
+                raw = float(values[3])
+                float(values[0]), float(values[1]), float(values[2])
+            except (IndexError, ValueError):
+                continue
+            if self._raw0 is None:
+                self._raw0 = raw
+            raw = raw - self._raw0 + self._rawOffset
+            self._lastRaw = raw
+            return raw, values
+
+    def _format(self, values):
+        if self.restamp:
+            values = values[:3] + [f"{self.clock.time()*1000:.0f}"]
+        self.last = ",".join(values)
+        return self.last
+
+    def getCurrents_RPI(self):
+        """再生位置の電流値を "cBlack,cBrown,cRed,RawTime" 形式で返す．終了後は空文字"""
+        if self.finished:
+            return ""
+
+        if not self.speed:
+            # 最速モード: 呼び出しごとに次の行を返す
+            item = self._nextRow()
+            if item is None:
+                self.close()
+                return ""
+            self.count += 1
+            return self._format(item[1])
+
+        # 実時間モード: 再生開始からの経過時間までに到達した最新の行を返す
+        if self._t0 is None:
+            self._pending = self._nextRow()
+            if self._pending is None:
+                self.close()
+                return ""
+            self._t0 = self.clock.monotonic()
+        playhead = (self.clock.monotonic() - self._t0) * 1000.0 * self.speed
+        while self._pending is not None and self._pending[0] <= playhead:
+            self._current = self._pending
+            self.count += 1
+            self._pending = self._nextRow()
+        if self._pending is None:
+            # 最後の行まで到達した
+            values = self._current[1]
+            self.close()
+            return self._format(values)
+        return self._format(self._current[1]) if self._current else ""
+
+    def stream(self):
+        """記録時の間隔 (speed 倍) で待ちながら全行を順に返すジェネレータ"""
+        prev = None
+        while not self.finished:
+            item = self._nextRow()
+            if item is None:
+                break
+            if self.speed and prev is not None:
+                self.clock.sleep((item[0] - prev) / 1000.0 / self.speed)
+            prev = item[0]
+            self.count += 1
+            yield self._format(item[1])
+        self.close()
+
+    def close(self):
+        self.finished = True
+        if self._file and not self._file.closed:
+            self._file.close()
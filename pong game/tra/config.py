@@ -1,3 +1,35 @@
-SenseQ = ""
-RelayQ = ""
-BallQ = ""
+import bus
+
+# スレッド間通信チャンネル (連番付きリングバッファ, bus.py)
+SenseQ = bus.Channel("SenseQ", ("cBlack", "cBrown", "cRed", "RawTime", "MonoTime"))   # 電流値 [mA], 取得時刻 [ms] (clock.time()), 取得時刻 [ns] (clock.monotonic())
+RelayQ = bus.Channel("RelayQ", ("mask", "RequestTime"), typecode='q')           # 刺激パターン (bit i = Region i), 依頼時刻 [ns]
+BallQ = bus.Channel("BallQ", ("BallX", "BallY", "RallyCount"), typecode='q')    # ボール位置とラリー回数
+
+CHANNELS = ("SenseQ", "RelayQ", "BallQ")
+
+
+def share():
+    """チャンネルを共有メモリ版 (shmbus.py) に置き換え，子プロセスで attach() に渡す情報を返す"""
+    import shmbus
+    specs = {}
+    for name in CHANNELS:
+        ch = globals()[name]
+        shared = shmbus.ShmChannel(name, ch.fields, ch.capacity, ch._buf.typecode)
+        globals()[name] = shared
+        specs[name] = shared.spec()
+    return specs
+
+
+def attach(specs):
+    """share() で作成した共有メモリのチャンネルに接続する (子プロセス用)"""
+    import shmbus
+    for name, spec in specs.items():
+        globals()[name] = shmbus.ShmChannel.attach(spec)
+
+
+def release():
+    """共有メモリのチャンネルを閉じる"""
+    for name in CHANNELS:
+        ch = globals()[name]
+        if hasattr(ch, "spec"):
+            ch.close()
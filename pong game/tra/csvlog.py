@@ -0,0 +1,124 @@
+# csvlog.py
+# 専用スレッドで combined_data CSV をまとめて書き込む非同期ライター
+#
+# 呼び出し側は整数の monotonic 時刻 [ns] と値をキューに入れるだけで，時刻の文字列化・
+# CSV への変換・書き込み・flush はすべて書き込みスレッドで行う．SDカードの書き込みが
+# 遅れても呼び出し側 (センサー・刺激の処理) は待たされない．キューが満杯のときは
+# レコードを捨てて dropped に数える．
+
+import csv
+import time
+import queue
+import threading
+from datetime import datetime
+from hardware import RealClock
+
+
+class AsyncCsvWriter:
+    """CSV の行を有界キュー経由で書き込みスレッドへ渡すライター
+
+    header        : 先頭行 (None で書かない)
+    rowFormat     : write() に渡した値を CSV の列 (リスト) に変換する関数 (書き込みスレッドで実行)
+    maxQueue      : キューに保持できる行数
+    flushInterval : ファイルを flush する間隔 [s] (実時間)
+    flushSize     : この行数がたまったら間隔を待たずに flush する
+    """
+
+    def __init__(self, path, header=None, rowFormat=None, clock=None,
+                 maxQueue=10000, flushInterval=1.0, flushSize=1000):
+        self.path = path
+        self.rowFormat = rowFormat if rowFormat is not None else list
+        self.clock = clock if clock is not None else RealClock()
+        self.flushInterval = flushInterval
+        self.flushSize = flushSize
+        self.written = 0
+        self.dropped = 0
+        self.maxDepth = 0
+        # 整数の monotonic 時刻から時刻文字列を作るための基準
+        self._mono0 = self.stamp()
+        self._wall0 = self.clock.time()
+        self._secText = (None, "")
+        self._queue = queue.Queue(maxQueue)
+        self._file = open(path, mode='w', newline='')
+        self._writer = csv.writer(self._file)
+        if header is not None:
+            self._writer.writerow(header)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stamp(self):
+        """write() に渡す現在時刻 (整数の monotonic 時刻 [ns])"""
+        return int(self.clock.monotonic() * 1e9)
+
+    def write(self, t, *values):
+        """1行分の値をキューに入れる (待たない)．キューが満杯なら捨てて False"""
+        try:
+            self._queue.put_nowait((t, values))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        depth = self._queue.qsize()
+        if depth > self.maxDepth:
+            self.maxDepth = depth
+        return True
+
+    def depth(self):
+        """キューに残っている行数"""
+        return self._queue.qsize()
+
+    def stats(self):
+        return {"written": self.written, "dropped": self.dropped,
+                "depth": self.depth(), "maxDepth": self.maxDepth}
+
+    def summary(self):
+        s = self.stats()
+        return f"{s['written']} rows written, {s['dropped']} dropped, queue depth {s['depth']} (max {s['maxDepth']})"
+
+    def close(self):
+        """キューに残った行を書き終えてからファイルを閉じる"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._file.close()
+
+    def _timestamp(self, t):
+        # 秒までの部分は1秒に1回だけ文字列化する
+        wall = self._wall0 + (t - self._mono0) / 1e9
+        sec = int(wall // 1)
+        if self._secText[0] != sec:
+            self._secText = (sec, datetime.fromtimestamp(sec).strftime("%Y-%m-%d %H:%M:%S"))
+        return f"{self._secText[1]}.{int((wall - sec) * 1000):03d}"
+
+    def _run(self):
+        lastFlush = time.monotonic()
+        pending = 0
+        closing = False
+        while not closing:
+            try:
+                item = self._queue.get(timeout=self.flushInterval)
+            except queue.Empty:
+                item = ()
+            # 届いている行をまとめて取り出して一括で書き込む
+            batch = []
+            while item is not None:
+                if item:
+                    batch.append(item)
+                if len(batch) >= self.flushSize:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            closing = item is None
+            if batch:
+                try:
+                    self._writer.writerows([self._timestamp(t)] + self.rowFormat(*values) for t, values in batch)
+                except Exception as e:
+                    print(f"CSV write error: {e}")
+                self.written += len(batch)
+                pending += len(batch)
+            if pending and (closing or pending >= self.flushSize or time.monotonic() - lastFlush >= self.flushInterval):
+                self._file.flush()
+                pending = 0
+                lastFlush = time.monotonic()
@@ -0,0 +1,181 @@
+# decoder.py
+# センサー電流からパドル位置を求めるデコーダ
+#
+# 3つのセンサー (上・中・下) の正規化電流を通る2次関数の頂点を解析的に求める．
+# 従来の curve_fit でフィッティングし linspace 上の argmax を取る処理と同じ格子点を返す．
+#   上に凸      : 頂点に最も近い格子点 (等距離なら小さい方)
+#   下に凸・直線: 両端のうち値の大きい方
+#   平坦        : 先頭 (argmax と同じく 0)
+#
+# LutDecoder は 0.1mA 単位に量子化された電流値の全組み合わせについて結果を事前計算し，
+# 1サンプルあたり表の参照1回でデコードする．
+
+import os
+import math
+import hashlib
+import numpy as np
+
+
+def map_current(current, maxC, minC):
+    """電流値を 0〜1 に正規化 (範囲外はクリップ)"""
+    temp = (current - minC) / (maxC - minC)
+    return max(0.0, min(1.0, temp))
+
+
+def map_current_batch(current, maxC, minC):
+    """map_current のベクトル版"""
+    temp = (np.asarray(current, dtype=np.float64) - minC) / (maxC - minC)
+    # スカラー版の max/min と同じく NaN は 1.0 として扱う
+    return np.clip(np.nan_to_num(temp, nan=1.0), 0.0, 1.0)
+
+
+def peak_index(y0, y1, y2, xs, span, n):
+    """3点 (xs, y) を通る2次関数を linspace(0, span, n) 上で評価したときの argmax を返す"""
+    x0, x1, x2 = xs
+    f01 = (y1 - y0) / (x1 - x0)
+    f12 = (y2 - y1) / (x2 - x1)
+    a = (f12 - f01) / (x2 - x0)
+    b = f01 - a * (x0 + x1)
+    if a < 0:
+        u = -b / (2 * a) * (n - 1) / span
+        u = min(n - 1.0, max(0.0, u))
+        return math.ceil(u - 0.5)
+    return n - 1 if a * span * span + b * span > 0 else 0
+
+
+def peak_index_batch(y, xs, span, n):
+    """peak_index のベクトル版．y は (N, 3) 配列"""
+    y = np.asarray(y, dtype=np.float64)
+    x0, x1, x2 = xs
+    f01 = (y[:, 1] - y[:, 0]) / (x1 - x0)
+    f12 = (y[:, 2] - y[:, 1]) / (x2 - x1)
+    a = (f12 - f01) / (x2 - x0)
+    b = f01 - a * (x0 + x1)
+    concave = a < 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        u = -b / (2 * a) * (n - 1) / span
+    u = np.clip(np.nan_to_num(u), 0.0, n - 1.0)
+    edge = np.where(a * span * span + b * span > 0, n - 1, 0)
+    return np.where(concave, np.ceil(u - 0.5), edge).astype(np.int64)
+
+
+class ParabolaDecoder:
+    """キャリブレーション定数を保持し，電流値からパドル上端の位置を返す
+
+    calib        : 上・中・下センサーの (maxC, minC)
+    xs           : 上・中・下センサーの y 座標
+    span, n      : 評価格子 linspace(0, span, n)．格子の添字をそのまま画面座標とする
+    paddleHeight : パドルの高さ (位置はパドル中心が頂点に来るようにずらす)
+    """
+
+    def __init__(self, calib, xs, span, n, paddleHeight):
+        self.calib = [tuple(c) for c in calib]
+        self.xs = tuple(xs)
+        self.span = span
+        self.n = n
+        self.paddleHeight = paddleHeight
+
+    def normalize(self, cTop, cMid, cBot):
+        (maxT, minT), (maxM, minM), (maxB, minB) = self.calib
+        return (map_current(cTop, maxT, minT),
+                map_current(cMid, maxM, minM),
+                map_current(cBot, maxB, minB))
+
+    def decode(self, cTop, cMid, cBot):
+        """1サンプル分のパドル位置 (Paddle.setPos に渡す値)"""
+        y0, y1, y2 = self.normalize(cTop, cMid, cBot)
+        return int(peak_index(y0, y1, y2, self.xs, self.span, self.n) - self.paddleHeight / 2)
+
+    def decode_batch(self, cTop, cMid, cBot):
+        """複数サンプルのパドル位置を一括で計算する (各引数は同じ長さの配列)"""
+        y = np.column_stack([map_current_batch(c, maxC, minC)
+                             for c, (maxC, minC) in zip((cTop, cMid, cBot), self.calib)])
+        idx = peak_index_batch(y, self.xs, self.span, self.n)
+        return (idx - self.paddleHeight / 2).astype(np.int64)
+
+
+class LutDecoder(ParabolaDecoder):
+    """0.1mA 単位の電流値の全組み合わせについて事前計算した表を引くデコーダ
+
+    表はキャリブレーション定数から起動時に一度だけ作成し，cacheDir に定数ごとに保存して再利用する．
+    入力は getCurrents_RPI() と同じく 0.1mA 単位に丸められた値を想定する．
+    """
+
+    STEPS_PER_MA = 10
+    VERSION = 1
+
+    def __init__(self, calib, xs, span, n, paddleHeight, cacheDir="Data"):
+        super().__init__(calib, xs, span, n, paddleHeight)
+        r = self.STEPS_PER_MA
+        # 範囲外の値は正規化で 0/1 にクリップされるため，表の端の値と同じ結果になる
+        self.qLo = [math.floor(round(minC * r, 6)) for maxC, minC in self.calib]
+        self.qHi = [math.ceil(round(maxC * r, 6)) for maxC, minC in self.calib]
+        self.dims = [hi - lo + 1 for lo, hi in zip(self.qLo, self.qHi)]
+        self.cachePath = None
+        if cacheDir is not None:
+            self.cachePath = os.path.join(cacheDir, f"paddle_lut_{self.key()}.npy")
+
+        self.table = self._load()
+        if self.table is None:
+            self.table = self.build()
+            self._save()
+        self._lut = memoryview(self.table.reshape(-1))
+        self._stride0 = self.dims[1] * self.dims[2]
+        self._stride1 = self.dims[2]
+
+    def key(self):
+        """表の内容を決める定数から作るキャッシュキー"""
+        text = repr((self.VERSION, self.STEPS_PER_MA, self.calib, self.xs,
+                     self.span, self.n, self.paddleHeight))
+        return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+    def build(self):
+        """全組み合わせのパドル位置を計算した (上, 中, 下) の3次元表"""
+        grids = [np.arange(lo, hi + 1) / self.STEPS_PER_MA for lo, hi in zip(self.qLo, self.qHi)]
+        mid, bot = np.meshgrid(grids[1], grids[2], indexing='ij')
+        mid, bot = mid.reshape(-1), bot.reshape(-1)
+        table = np.empty(self.dims, dtype=np.int16)
+        # メモリ使用量を抑えるため上センサーの値ごとに計算
+        for i, top in enumerate(grids[0]):
+            table[i] = super().decode_batch(np.full(mid.shape, top), mid, bot).reshape(self.dims[1:])
+        return table
+
+    def _load(self):
+        if self.cachePath is None or not os.path.exists(self.cachePath):
+            return None
+        try:
+            table = np.load(self.cachePath)
+        except Exception:
+            return None
+        return table if list(table.shape) == self.dims else None
+
+    def _save(self):
+        if self.cachePath is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cachePath) or ".", exist_ok=True)
+            tmpPath = self.cachePath + ".tmp"
+            with open(tmpPath, "wb") as f:
+                np.save(f, self.table)
+            os.replace(tmpPath, self.cachePath)
+        except OSError as e:
+            print(f"LUT cache save failed: {e}")
+
+    def decode(self, cTop, cMid, cBot):
+        r = self.STEPS_PER_MA
+        (lo0, lo1, lo2), (hi0, hi1, hi2) = self.qLo, self.qHi
+        q0 = min(hi0, max(lo0, round(cTop * r))) - lo0
+        q1 = min(hi1, max(lo1, round(cMid * r))) - lo1
+        q2 = min(hi2, max(lo2, round(cBot * r))) - lo2
+        return self._lut[q0 * self._stride0 + q1 * self._stride1 + q2]
+
+    def decode_batch(self, cTop, cMid, cBot):
+        idx = []
+        for k, c in enumerate((cTop, cMid, cBot)):
+            q = np.rint(np.asarray(c, dtype=np.float64) * self.STEPS_PER_MA)
+            idx.append(np.clip(q, self.qLo[k], self.qHi[k]).astype(np.int64) - self.qLo[k])
+        return self.table[idx[0], idx[1], idx[2]].astype(np.int64)
+
+
+# Pong(decoder=...) で選択できるデコーダ
+DECODERS = {"analytic": ParabolaDecoder, "lut": LutDecoder}
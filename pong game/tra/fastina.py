@@ -0,0 +1,168 @@
+# fastina.py
+# INA219 のレジスタを直接読み書きする高速読み出し
+#
+# adafruit_ina219 の INA219.current は読み出しのたびに校正レジスタの書き込みと
+# 電流レジスタの読み出しを行う．ここでは起動時に設定・校正レジスタを明示的に書き込み，
+# レジスタポインタを電流レジスタに合わせておくことで，1センサーあたり I2C の読み出し
+# 1回で電流値を取得する．ADC の分解能・平均回数は実験ごとに InaSettings で指定する．
+
+from types import SimpleNamespace
+
+# --- レジスタ ---
+REG_CONFIG = 0x00
+REG_SHUNT_VOLTAGE = 0x01
+REG_BUS_VOLTAGE = 0x02
+REG_POWER = 0x03
+REG_CURRENT = 0x04
+REG_CALIBRATION = 0x05
+
+# ADC の分解能・平均回数 → 設定値 (BADC / SADC)
+ADC_CODES = {
+    "9bit": 0x0, "10bit": 0x1, "11bit": 0x2, "12bit": 0x3,
+    "12bit_2S": 0x9, "12bit_4S": 0xA, "12bit_8S": 0xB, "12bit_16S": 0xC,
+    "12bit_32S": 0xD, "12bit_64S": 0xE, "12bit_128S": 0xF,
+}
+# 1回の変換時間 [us] (データシート記載値)
+ADC_TIMES_US = {
+    "9bit": 84, "10bit": 148, "11bit": 276, "12bit": 532,
+    "12bit_2S": 1060, "12bit_4S": 2130, "12bit_8S": 4260, "12bit_16S": 8510,
+    "12bit_32S": 17020, "12bit_64S": 34050, "12bit_128S": 68100,
+}
+# シャント電圧の測定範囲 → 設定値 (PG)
+GAIN_CODES = {"40mV": 0, "80mV": 1, "160mV": 2, "320mV": 3}
+# バス電圧の測定範囲 → 設定値 (BRNG)
+BUS_RANGE_CODES = {"16V": 0, "32V": 1}
+# 動作モード
+MODE_SHUNT_CONTINUOUS = 0x5
+MODE_SHUNT_BUS_CONTINUOUS = 0x7
+# リセット直後の設定レジスタの値 (レジスタポインタも設定レジスタに戻る)
+POWER_ON_CONFIG = 0x399F
+
+
+class InaSettings:
+    """INA219 の ADC・校正設定 (既定値は adafruit_ina219 の 32V/2A 設定と同じ分解能・範囲)
+
+    shuntAdc, busAdc : ADC の分解能・平均回数 ("12bit", "12bit_8S" など)
+    gain             : シャント電圧の測定範囲 ("40mV" 〜 "320mV")
+    busRange         : バス電圧の測定範囲 ("16V" / "32V")
+    rshunt           : シャント抵抗 [ohm]
+    currentLsb       : 電流レジスタの1LSB [mA] (校正値はここから計算)
+    shuntOnly        : バス電圧を測定せずシャント電圧のみ連続変換する (電流の更新が速くなる)
+    recheckEvery     : 何回の読み出しごとに校正レジスタを確認するか (0 で確認しない)
+    """
+
+    def __init__(self, shuntAdc="12bit", busAdc="12bit", gain="320mV", busRange="32V",
+                 rshunt=0.1, currentLsb=0.1, shuntOnly=True, recheckEvery=100):
+        for name, value, codes in (("shuntAdc", shuntAdc, ADC_CODES), ("busAdc", busAdc, ADC_CODES),
+                                   ("gain", gain, GAIN_CODES), ("busRange", busRange, BUS_RANGE_CODES)):
+            if value not in codes:
+                raise ValueError(f"Unknown INA219 {name}: {value}")
+        self.shuntAdc = shuntAdc
+        self.busAdc = busAdc
+        self.gain = gain
+        self.busRange = busRange
+        self.rshunt = rshunt
+        self.currentLsb = currentLsb
+        self.shuntOnly = shuntOnly
+        self.recheckEvery = recheckEvery
+
+    def config_word(self):
+        """設定レジスタに書き込む値"""
+        mode = MODE_SHUNT_CONTINUOUS if self.shuntOnly else MODE_SHUNT_BUS_CONTINUOUS
+        return (BUS_RANGE_CODES[self.busRange] << 13 | GAIN_CODES[self.gain] << 11 |
+                ADC_CODES[self.busAdc] << 7 | ADC_CODES[self.shuntAdc] << 3 | mode)
+
+    def calibration(self):
+        """校正レジスタに書き込む値 (Cal = 0.04096 / (Current_LSB[A] * Rshunt))"""
+        return int(0.04096 / (self.currentLsb / 1000 * self.rshunt))
+
+    def conversion_time(self):
+        """電流値が更新される周期 [s]"""
+        us = ADC_TIMES_US[self.shuntAdc]
+        if not self.shuntOnly:
+            us += ADC_TIMES_US[self.busAdc]
+        return us / 1e6
+
+
+class FastINA219:
+    """電流レジスタのみを1回の読み出しで取得する INA219
+
+    i2c は busio.I2C (または hardware.SimI2C)．current プロパティは adafruit_ina219 と互換．
+    """
+
+    def __init__(self, i2c, addr=0x40, settings=None):
+        self.i2c = i2c
+        self.addr = addr
+        self.settings = settings if settings is not None else InaSettings()
+        self.i2c_device = SimpleNamespace(device_address=addr)
+        self.resets = 0       # 校正レジスタの消失 (センサーのリセット) を検出した回数
+        self._lsb = self.settings.currentLsb
+        self._cal = self.settings.calibration()
+        self._reads = 0
+        self._buf = bytearray(2)
+        with _Locked(i2c):
+            self.configure()
+
+    def configure(self):
+        """設定・校正レジスタを書き込み，レジスタポインタを電流レジスタに合わせる"""
+        self._write_register(REG_CONFIG, self.settings.config_word())
+        self._write_register(REG_CALIBRATION, self._cal)
+        self.i2c.writeto(self.addr, bytes([REG_CURRENT]))
+
+    @property
+    def current(self):
+        """電流 [mA]"""
+        with _Locked(self.i2c):
+            return self.read_current()
+
+    def read_current(self):
+        """電流 [mA] (バスのロックは呼び出し側で取得しておく)"""
+        self._reads += 1
+        if self.settings.recheckEvery and self._reads % self.settings.recheckEvery == 0:
+            self._check()
+        self.i2c.readfrom_into(self.addr, self._buf)
+        raw = int.from_bytes(self._buf, "big", signed=True)
+        if raw == POWER_ON_CONFIG and self._check():
+            # リセットでポインタが設定レジスタに戻っていた: 再設定後に読み直す
+            self.i2c.readfrom_into(self.addr, self._buf)
+            raw = int.from_bytes(self._buf, "big", signed=True)
+        return raw * self._lsb
+
+    def _check(self):
+        """急な負荷変動で INA219 がリセットされると校正値が 0 になり電流が読めなくなるため再設定する．
+        再設定したら True"""
+        if self._read_register(REG_CALIBRATION) != self._cal:
+            self.resets += 1
+            self.configure()
+            return True
+        self.i2c.writeto(self.addr, bytes([REG_CURRENT]))
+        return False
+
+    def _write_register(self, reg, value):
+        self.i2c.writeto(self.addr, bytes([reg, (value >> 8) & 0xFF, value & 0xFF]))
+
+    def _read_register(self, reg):
+        buf = bytearray(2)
+        self.i2c.writeto_then_readfrom(self.addr, bytes([reg]), buf)
+        return int.from_bytes(buf, "big")
+
+
+def read_currents(i2c, sensors):
+    """バスを1回ロックして各センサーの電流 [mA] を読む (未接続 (None) は 0.0)"""
+    with _Locked(i2c):
+        return [s.read_current() if s else 0.0 for s in sensors]
+
+
+class _Locked:
+    """busio.I2C のロックを取得する with 文用のヘルパー"""
+
+    def __init__(self, i2c):
+        self.i2c = i2c
+
+    def __enter__(self):
+        while not self.i2c.try_lock():
+            pass
+        return self.i2c
+
+    def __exit__(self, *exc):
+        self.i2c.unlock()
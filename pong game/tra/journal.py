@@ -0,0 +1,282 @@
+# journal.py
+# ゲームのイベントを専用スレッドでまとめて書き込むイベントジャーナル
+#
+# ボール位置 (ballRate [Hz] ごと)・パドルで打ち返した (当たった刺激領域)・ミス・リセット・
+# モード切り替え・刺激パターンの変化を，種類つきの固定長レコードとして1つのファイルに記録する．
+# 呼び出し側 (ゲームループ) はレコードをキューに入れるだけで，書き込みスレッドが
+# 一定間隔ごとにまとめて書き込む．ファイルが maxBytes を超えたら次のファイルに切り替える．
+#
+# ファイル: Data/journal_<日付>_<番号>.bin (2つ目以降は journal_<日付>_<番号>.<n>.bin)
+#   ヘッダー : magic, mono0 [ns], wall0 [ns] (mono0 の時点の clock.time()), ファイルの通し番号, レコード長,
+#              ゲーム (GAMES の番号．刺激領域の配置)
+#   レコード (18 byte, リトルエンディアン)
+#     t      int64  : clock.monotonic() [ns]
+#     kind   uint8  : イベントの種類 (EV_*)
+#     mask   uint8  : 刺激パターン (MASK_NONE はなし)
+#     x, y   int16  : ボール位置
+#     value  int32  : スコア (EV_MODE はモード番号，EV_STIM は刺激の出どころ)
+#
+# ゲームのイベントの記録はこのジャーナルのみ (セッションログ sessionlog.py はセンサーのサンプルのみ)．
+#
+# 変換: python journal.py Data/journal_<日付>_<番号>.bin   (ballPos / pongData の従来形式)
+
+import os
+import queue
+import struct
+import argparse
+import threading
+from datetime import date
+import numpy as np
+from hardware import RealClock
+
+MAGIC = b"GELJRNL2"
+HEADER = struct.Struct("<8sqqIIB")
+RECORD = struct.Struct("<qBBhhi")
+DTYPE = np.dtype([("t", "<i8"), ("kind", "u1"), ("mask", "u1"),
+                  ("x", "<i2"), ("y", "<i2"), ("value", "<i4")])
+
+EV_BALL = 0       # ボール位置のサンプル
+EV_PADDLE = 1     # パドルで打ち返した (mask: 当たった位置の刺激領域)
+EV_MISS = 2       # ミス (スコアリセット)
+EV_RESET = 3      # ゲーム開始・スコアのクリア
+EV_MODE = 4       # モード切り替え (value: MODE_*)
+EV_STIM = 5       # 刺激パターンの変化 (value: STIM_*)
+EVENT_NAMES = ("ball", "paddle", "miss", "reset", "mode", "stim")
+
+MODE_NORMAL = 0
+MODE_RANDOM = 1
+STIM_BALL = 0     # ボール連動の刺激
+STIM_RANDOM = 1   # ランダム刺激
+
+MASK_NONE = 0xFF
+GAMES = ("tra", "random")
+
+# pongData の当たった場所 (左の列の刺激領域の上・中・下)
+HIT_SPOTS = {"tra": ((0, "_top"), (4, "_mid"), (2, "_bot")),        # tra_regions: 左の列は領域 0, 4, 2
+             "random": ((0, "_top"), (2, "_mid"), (4, "_bot"))}     # grid_regions: 左の列は領域 0, 2, 4
+
+
+class EventJournal:
+    """ゲームのイベントを有界キュー経由で書き込みスレッドへ渡すジャーナル (複数スレッドから書き込み可)
+
+    game          : "tra" / "random" (刺激領域の配置．pongData に変換するときに使う)
+    ballRate      : ボール位置を記録する回数 [Hz] (ゲーム内時間．0 で記録しない)
+    maxBytes      : 1ファイルの最大サイズ (超えたら次のファイルへ)
+    maxQueue      : キューに保持できるレコード数 (満杯なら捨てて dropped に数える)
+    flushInterval : まとめて書き込む間隔 [s] (実時間)
+    """
+
+    def __init__(self, path, clock=None, game="tra", ballRate=2.0, maxBytes=64 * 1024 * 1024,
+                 maxQueue=100000, flushInterval=1.0):
+        self.path = path
+        self.game = game
+        self.clock = clock if clock is not None else RealClock()
+        self.ballInterval = round(1e9 / ballRate) if ballRate > 0 else None
+        self.maxBytes = maxBytes
+        self.flushInterval = flushInterval
+        self.paths = []
+        self.written = 0
+        self.dropped = 0
+        self._nextBall = 0
+        self._mono0 = self.stamp()
+        self._wall0 = round(self.clock.time() * 1e9)
+        self._file = None
+        self._size = 0
+        self._queue = queue.Queue(maxQueue)
+        self._stop = threading.Event()
+        self._open()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def create(cls, folder="Data", **options):
+        """folder/journal_<日付>_<番号>.bin を新しく作る"""
+        os.makedirs(folder, exist_ok=True)
+        n = 0
+        while os.path.exists(os.path.join(folder, f"journal_{date.today()}_{n}.bin")):
+            n += 1
+        return cls(os.path.join(folder, f"journal_{date.today()}_{n}.bin"), **options)
+
+    def stamp(self):
+        return int(self.clock.monotonic() * 1e9)
+
+    # --- イベント ---
+
+    def ball(self, x, y, score):
+        """ボール位置 (前回の記録から 1/ballRate 秒以上経っていれば記録する)"""
+        if self.ballInterval is None:
+            return
+        t = self.stamp()
+        if t >= self._nextBall:
+            # 遅れた場合は今の時刻から数え直す
+            self._nextBall += self.ballInterval
+            if self._nextBall <= t:
+                self._nextBall = t + self.ballInterval
+            self._put(t, EV_BALL, None, x, y, score)
+
+    def paddle(self, mask, x, y, score):
+        self._put(self.stamp(), EV_PADDLE, mask, x, y, score)
+
+    def miss(self, mask, x, y, score):
+        self._put(self.stamp(), EV_MISS, mask, x, y, score)
+
+    def reset(self, score=0):
+        self._put(self.stamp(), EV_RESET, None, 0, 0, score)
+
+    def mode(self, mode):
+        self._put(self.stamp(), EV_MODE, None, 0, 0, mode)
+
+    def stim(self, mask, source=STIM_BALL):
+        self._put(self.stamp(), EV_STIM, mask, 0, 0, source)
+
+    def _put(self, t, kind, mask, x, y, value):
+        try:
+            self._queue.put_nowait((t, kind, MASK_NONE if mask is None else int(mask) & 0x3F,
+                                    max(-32768, min(32767, int(x))), max(-32768, min(32767, int(y))), int(value)))
+        except queue.Full:
+            self.dropped += 1
+
+    # --- 書き込み ---
+
+    def _open(self):
+        if self._file is not None:
+            self._file.close()
+        n = len(self.paths)
+        stem, ext = os.path.splitext(self.path)
+        path = self.path if n == 0 else f"{stem}.{n}{ext}"
+        self._file = open(path, "wb")
+        self._file.write(HEADER.pack(MAGIC, self._mono0, self._wall0, n, RECORD.size, GAMES.index(self.game)))
+        self._size = HEADER.size
+        self.paths.append(path)
+
+    def _write(self, batch):
+        chunk = bytearray(RECORD.size * len(batch))
+        for i, record in enumerate(batch):
+            RECORD.pack_into(chunk, i * RECORD.size, *record)
+        view = memoryview(chunk)
+        while len(view):
+            # ファイルの残りに入る分だけ書き，あふれた分は次のファイルへ
+            room = max((self.maxBytes - self._size) // RECORD.size, 1) * RECORD.size
+            self._file.write(view[:room])
+            self._size += min(room, len(view))
+            view = view[room:]
+            if self._size + RECORD.size > self.maxBytes:
+                self._open()
+        self._file.flush()
+        self.written += len(batch)
+
+    def _run(self):
+        closing = False
+        while not closing:
+            # flushInterval ごとにたまったレコードをまとめて書き込む
+            closing = self._stop.wait(self.flushInterval)
+            batch = []
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    print(f"Journal write error: {e}")
+
+    def summary(self):
+        return f"{self.written} events written to {len(self.paths)} file(s), {self.dropped} dropped"
+
+    def close(self):
+        """キューに残ったイベントを書き終えてからファイルを閉じる"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self._file.close()
+
+
+def read(path):
+    """ジャーナル (続きのファイルを含む) を (wall0 - mono0 [ns], ゲーム, レコードの構造化配列) で読む"""
+    stem, ext = os.path.splitext(path)
+    parts = [path]
+    while os.path.exists(f"{stem}.{len(parts)}{ext}"):
+        parts.append(f"{stem}.{len(parts)}{ext}")
+    offset = None
+    arrays = []
+    for p in parts:
+        with open(p, "rb") as f:
+            magic, mono0, wall0, n, size, game = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or size != DTYPE.itemsize:
+                raise ValueError(f"Not a journal: {p}")
+            data = f.read()
+        if offset is None:
+            offset = wall0 - mono0
+        arrays.append(np.frombuffer(data, dtype=DTYPE, count=len(data) // size))
+    return offset, GAMES[game], np.concatenate(arrays)
+
+
+# --- 従来形式への変換 ---
+
+def _epoch(records):
+    """ゲーム開始 (最初のリセット) の時刻 [ns]．なければ最初のレコード"""
+    start = records["t"][records["kind"] == EV_RESET]
+    if len(start):
+        return int(start[0])
+    return int(records["t"][0]) if len(records) else None
+
+
+def start_time(path):
+    """ゲーム開始 (最初のリセット) の clock.monotonic() の時刻 [ns]．レコードがなければ None"""
+    offset, game, records = read(path)
+    return _epoch(records)
+
+
+def hit_spot(missed, mask, game="tra"):
+    """pongData の当たった場所 ("paddle_top", "miss_mid_bot" など．game は刺激領域の配置)"""
+    hitSpot = "miss" if missed else "paddle"
+    for bit, name in HIT_SPOTS[game]:
+        if (mask >> bit) & 1:
+            hitSpot += name
+    return hitSpot
+
+
+def ball_lines(records):
+    """ballPos_*.txt の各行 ("経過秒,BallX,BallY")"""
+    epoch = _epoch(records)
+    for t, kind, x, y in zip(*(records[k].tolist() for k in ("t", "kind", "x", "y"))):
+        if kind == EV_BALL and t >= epoch:
+            yield f"{round((t - epoch) / 1e9, 2)},{x},{y}"
+
+
+def pong_lines(records, game="tra"):
+    """pongData_*.txt の各行 ("paddle_top,スコア,経過秒" など)"""
+    epoch = _epoch(records)
+    for t, kind, mask, score in zip(*(records[k].tolist() for k in ("t", "kind", "mask", "value"))):
+        if kind in (EV_PADDLE, EV_MISS):
+            yield f"{hit_spot(kind == EV_MISS, mask, game)},{score},{round((t - epoch) / 1e9, 2)}"
+
+
+def convert(path):
+    """ジャーナルを同じフォルダの ballPos / pongData に変換する"""
+    offset, game, records = read(path)
+    folder, name = os.path.split(path)
+    stem = os.path.splitext(name)[0]
+    suffix = stem[len("journal_"):] if stem.startswith("journal_") else stem
+    written = []
+    for prefix, lines in (("ballPos", ball_lines(records)), ("pongData", pong_lines(records, game))):
+        lines = list(lines)
+        if not lines:
+            continue
+        out = os.path.join(folder, f"{prefix}_{suffix}.txt")
+        with open(out, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        written.append(out)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="イベントジャーナル (.bin) を従来の ballPos / pongData 形式に変換")
+    parser.add_argument("paths", nargs="+")
+    args = parser.parse_args()
+    for p in args.paths:
+        for out in convert(p):
+            print(out)
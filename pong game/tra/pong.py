@@ -4,12 +4,13 @@ import pygame
 from paddle import Paddle
 from ball import Ball
 from region import Region
+from hardware import RealClock
+from render import DirtyRenderer
+from gamerecord import GameRecorder
+from pongsim import EVENT_MISS, FRAME_RATE, PHYSICS_RATE
+from tra_game import make_sim, make_decoder   # ゲームの設定 (刺激領域の配置・デコーダの校正値)
 import config
-from os.path import exists
-from datetime import date
-import time
-import numpy as np
-import scipy.optimize as opt
+from decoder import map_current
 from random import randint
 import os
 
@@ -18,42 +19,70 @@ WHITE  = (255,255,255)
 BLUE   = (51 ,146,255)
 ORANGE = (232,176,7  )
 
-class Pong():
-    def __init__(self, Size):
-        pygame.init()
-        self.lastRawData = ""
-        self.size = Size 
-        self.screen = pygame.display.set_mode(self.size)
-        pygame.display.set_caption("Pong")
-        pygame.display.update()
+MAX_SUBSTEPS = 8        # 1回のループで進める物理計算の最大回数
 
-        # ファイルパスの設定
-        filePathCount = 0
-        while (exists(r"Data/pongData_"+str(date.today())+"_"+str(filePathCount)+".txt")): 
-            filePathCount += 1
-        self.filePath = r"Data/pongData_"+str(date.today())+"_"+str(filePathCount)+".txt"
-        self.epoch_time = float(time.time())
+def score_pos(size):
+    """スコアの表示位置 (画面の幅の中央，上から 10px)"""
+    return (size[0] // 2, 10)
 
-        self.ballFilePath = r"Data/ballPos_"+str(date.today())+"_"+str(filePathCount)+".txt"
-        self.lastBallPosTime = -0.5
+class Pong():
+    """
+    ゲームの規則は PongSim (pongsim.py) が計算し，このクラスはセンサー入力・刺激の依頼・描画を行う．
+    display=False では画面を開かずに同じ処理をゲーム内時間 60fps で実行する．
+    renderer="dirty" では変化した部分だけを描き直し (render.py)，"full" では毎フレーム全面を描く．
+    renderRate はゲーム内時間で1秒あたりの描画回数 (None でゲームと同じ 60fps．ゲームの進行には影響しない)．
+    physics="swept" ではボールを PHYSICS_RATE の固定刻みで連続的に判定し，"frame" では従来どおり 60fps で1フレームずつ進める．
+    record=True では乱数の種・パドル位置・刺激パターンを Data/game_*.rec に記録する (gamerecord.py で再実行できる)．
+    seed を省略すると乱数の種を選んで記録する．
+    journal には journal.EventJournal を渡す (ボール位置・打ち返し・ミス・刺激パターンの変化を記録)．
+    """
+    def __init__(self, Size, clock=None, decoder="analytic", display=True, seed=None, renderer="dirty", renderRate=None,
+                 physics="swept", record=False, journal=None):
+        # 時計 (シミュレーション時は仮想時計を渡す)
+        self.hwClock = clock if clock is not None else RealClock()
+        self.size = Size 
+        self.display = display
+        self.journal = journal
+        self.renderRate = renderRate or FRAME_RATE
+        self.renderer = None
+        if seed is None:
+            seed = randint(0, 2**31 - 1)
+        self.sim = make_sim(self.size, seed, physics)
+        self.dt = 1.0 / (PHYSICS_RATE if physics == "swept" else FRAME_RATE)
+        self.recorder = GameRecorder.create(self.sim, self.dt, game="tra", decoder=decoder,
+                                            wall0=float(self.hwClock.time())) if record else None
+
+        # ゲームの開始・ボール位置・スコア変動はイベントジャーナルに記録する (ballPos / pongData へは journal.py で変換)
+        if self.journal is not None:
+            self.journal.reset()
         
         self.carryOn = True 
+        self.paddleHeight = self.sim.paddleHeight
+        if self.display:
+            self._initDisplay()
+            if renderer == "dirty":
+                self.renderer = DirtyRenderer(self.screen, self.sim, BLUE, score_pos(self.size))
 
-        # パドルとボールのサイズ設定
-        self.paddleHeight = round(self.size[1]/3)
-        self.paddle = Paddle(WHITE, round(self.size[0]*0.015), self.paddleHeight, self.size) 
-        self.paddle.rect.x = round(self.size[0]*0.002) 
-        self.paddle.rect.y = round(self.size[1]/2) 
+        # パドル位置のデコーダ
+        self.decoder = make_decoder(self.size, decoder)
 
-        self.ball = Ball(WHITE,round(self.size[1]*0.03663793103),round(self.size[1]*0.03663793103)) 
-        self.ball.reset(round(self.size[0]/2),round(self.size[1]/2)) 
+    def _initDisplay(self):
+        pygame.init()
+        self.screen = pygame.display.set_mode(self.size)
+        pygame.display.set_caption("Pong")
+        pygame.display.update()
+
+        # パドルとボールのスプライト (位置は毎フレーム PongSim から反映)
+        self.paddle = Paddle(WHITE, self.sim.paddleWidth, self.paddleHeight, self.size) 
+        self.paddle.rect.x = self.sim.paddleX
+        self.ball = Ball(WHITE, self.sim.ballSize, self.sim.ballSize) 
 
         # 領域（Region）の設定
         self.ballRegions = [Region] * 6
-        for i in range(6):
-            self.ballRegions[i] = Region(BLUE,(self.size[0])/2,self.size[1]/3)
-            self.ballRegions[i].rect.x = i%2*((self.size[0])/2)
-            self.ballRegions[i].rect.y = i%3*self.size[1]/3
+        for i, (x, y, w, h) in enumerate(self.sim.regions):
+            self.ballRegions[i] = Region(BLUE, w, h)
+            self.ballRegions[i].rect.x = x
+            self.ballRegions[i].rect.y = y
 
         self.all_sprites_list = pygame.sprite.Group()
         for i in range(6):
@@ -61,161 +90,131 @@ class Pong():
         self.all_sprites_list.add(self.paddle)
         self.all_sprites_list.add(self.ball)
 
-        self.score = 0
+    @property
+    def score(self):
+        return self.sim.score
 
     def getScore(self):
-        return self.score
+        return self.sim.score
 
     def clearScore(self):
-        self.score = 0
+        self.sim.score = 0
+        if self.journal is not None:
+            self.journal.reset()
 
     def close(self):
         self.carryOn = False 
 
     def extractPosition(self, rawData):
-        """正規化ロジック (scipy.optimizeを使用)"""
+        """正規化ロジック (2次関数の頂点 = パドル位置を解析的に計算)
+        rawData は (cBlack, cBrown, cRed, ...) または "cBlack,cBrown,cRed,..." 形式"""
         try:
-            temp = rawData.split(',')
-            currents = [float(temp[0]), float(temp[1]), float(temp[2])]
-            
-            # 正規化用パラメータ (環境に合わせて調整)
-            origTop, origMid, origBot = 0, 0, 0 
-            topupRangeC = 6.7
-            midupRangeC = 4.9
-            botupRangeC = 7.6
-            toplowRangeC = 3.7#マイナスの値は正の値で入力
-            midlowRangeC = 3.1
-            botlowRangeC = 4.4 
-    
-            curTop = self.mapCurrent(currents[0], origTop + topupRangeC, origTop - toplowRangeC)
-            curMid = self.mapCurrent(currents[1], origMid + midupRangeC, origMid - midlowRangeC)
-            curBot = self.mapCurrent(currents[2], origBot + botupRangeC, origBot - botlowRangeC)
-
-            # 二次関数フィッティング
-            def func(x, a, b, c):
-                return a * np.power(x, 2) + b * x + c
-
-            xdata = np.array([int(self.size[1]/6), int((3*self.size[1])/6), int((5*self.size[1])/6)])
-            ydata = np.array([curTop, curMid, curBot])
-
-            optimizedParameters, pcov = opt.curve_fit(func, xdata, ydata)
-            dispX = np.linspace(0, self.size[1], self.size[1])
-            dispY = func(dispX, *optimizedParameters)
-            
-            # 最大値の場所をパドル位置にする
-            pos = np.argmax(dispY) - (self.paddleHeight / 2)
-            self.paddle.setPos(int(pos))
-            
+            temp = rawData.split(',') if isinstance(rawData, str) else rawData
+            self.sim.setPaddle(self.decoder.decode(float(temp[0]), float(temp[1]), float(temp[2])))
         except:
             pass
 
     def mapCurrent(self, current, maxC, minC):
-        temp = ((current - minC) / (maxC - minC))
-        return max(0.0, min(1.0, temp))
+        return map_current(current, maxC, minC)
 
     def directCovert(self, stim):
         return -1 if stim != 0 else 0
 
     def gameLoop(self):
-        clock = pygame.time.Clock()
-        tempRegion = [False] * 6
-        hitFlag = False
-        scoreFlag = False # スコアが増えた/リセットされた時のログ用フラグ
-        resetFlag = False # ボールを中央に戻す用フラグ
-
-        while self.carryOn:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.carryOn = False 
-                elif event.type==pygame.KEYDOWN:
-                    if event.key==pygame.K_x: 
-                        self.carryOn=False
-
-            # センサー入力によるパドル移動
-            if not config.SenseQ == "":
-                rawData = config.SenseQ
-                if not self.lastRawData == rawData:
-                    self.extractPosition(rawData)
-                    self.lastRawData = rawData
-
-            self.all_sprites_list.update()
-            config.BallQ = f"{self.ball.rect.x},{self.ball.rect.y},{self.score}"
-
-            # ボール位置の記録
-            if ((float(time.time())-self.epoch_time)-self.lastBallPosTime) >= 0.5 :
-                with open(self.ballFilePath, "a") as file:
-                    file.write(str(round(float(time.time())-self.epoch_time,2))+','+self.ball.getPos()+"\n")
-                self.lastBallPosTime = float(time.time())-self.epoch_time
-
-            # --- 壁およびパドルの衝突判定ロジック ---
-            
-            # 1. 右壁: 跳ね返るのみ
-            if self.ball.rect.x >= self.size[0] - 40:
-                self.ball.velocity[0] = -abs(self.ball.velocity[0])
-            
-            # 2. 左壁 (ミス): スコアを0にし、ボールをリセットする
-            if self.ball.rect.x <= 0: 
-                self.clearScore()  # スコアリセット
-                scoreFlag = True
-                resetFlag = True   # ボールを中央へ
-            
-            # 3. 下壁: 跳ね返るのみ
-            if self.ball.rect.y > self.size[1] - 40:
-                self.ball.velocity[1] = -abs(self.ball.velocity[1])
-            
-            # 4. 上壁: 跳ね返るのみ
-            if self.ball.rect.y < 0:
-                self.ball.velocity[1] = abs(self.ball.velocity[1])
-
-            # 5. パドル衝突: カウントアップ (+1)
-            if pygame.sprite.collide_mask(self.ball, self.paddle) and not hitFlag:
-                hitFlag = True
-                self.ball.bounce() # 跳ね返り処理
-                self.score += 1    # 加点
-                scoreFlag = True
-            elif not pygame.sprite.collide_mask(self.ball, self.paddle) and hitFlag:
-                hitFlag = False
-
-            # リージョン（刺激領域）の衝突判定
-            RegionStim = [False] * 6
-            for i in range(6):
-                if pygame.sprite.collide_mask(self.ball, self.ballRegions[i]):
-                    self.ballRegions[i].activate()
-                    RegionStim[i] = True
-                else :
-                    self.ballRegions[i].deactivate()
-                    RegionStim[i] = False
-
-            # スコア変動やミスが発生した時のファイル保存処理
-            if scoreFlag:
-                hitSpot = "miss" if resetFlag else "paddle"
-                # 当たった場所の特定
-                if RegionStim[0]: hitSpot += "_top"
-                if RegionStim[4]: hitSpot += "_mid"
-                if RegionStim[2]: hitSpot += "_bot"
-
-                with open(self.filePath, "a") as file:
-                    file.write(f"{hitSpot},{self.score},{round(float(time.time())-self.epoch_time,2)}\n")
-
-                if resetFlag:
-                    self.ball.reset(round(self.size[0]/2),round(self.size[1]/2))
-                    resetFlag = False
-                scoreFlag = False
-
-            # 刺激信号の更新
-            if not RegionStim == tempRegion:
-                RegionStimString = ",".join([str(self.directCovert(int(s))) for s in RegionStim])
-                config.RelayQ = RegionStimString
-                tempRegion = RegionStim[:]
-
-            # 画面描画
-            self.screen.fill(BLACK)
-            self.all_sprites_list.draw(self.screen) 
-            font = pygame.font.Font(None, 74)
-            text = font.render(str(self.score), 1, WHITE)
-            self.screen.blit(text, (self.size[0]*0.5, 10))
-            pygame.display.flip()
-            clock.tick(60)
-
-        pygame.display.quit()
-        pygame.quit()
+        # 物理計算は固定の刻み dt でゲーム内時間に追いつくまで進め (1回の描画あたり最大 MAX_SUBSTEPS)，
+        # 描画は renderRate で前後のステップの間を補間した位置に行う
+        dt = self.dt
+        last = self.hwClock.monotonic()
+        nextRender = last
+        acc = 0.0
+        tempMask = 0
+        senseSub = config.SenseQ.subscribe()
+        sim = self.sim
+        journal = self.journal
+
+        try:
+            while self.carryOn:
+                if self.display:
+                    for event in pygame.event.get():
+                        if event.type == pygame.QUIT:
+                            self.carryOn = False 
+                        elif event.type==pygame.KEYDOWN:
+                            if event.key==pygame.K_x: 
+                                self.carryOn=False
+
+                # センサー入力によるパドル移動 (新しいサンプルが届いたときのみ)
+                sample = senseSub.latest()
+                if sample is not None:
+                    self.extractPosition(sample[1])
+
+                now = self.hwClock.monotonic()
+                acc += now - last
+                last = now
+                steps = 0
+                while acc >= dt and steps < MAX_SUBSTEPS:
+                    sim.move(dt=dt)
+                    config.BallQ.publish(sim.ballX, sim.ballY, sim.score)
+
+                    # 壁・パドル・刺激領域の判定 (右・上・下壁は跳ね返り，左壁はミスでスコアを0に，パドルで +1)
+                    # スコア変動やミスが発生した時のログ保存処理 (当たった場所は刺激領域のパターンから求める)
+                    for kind, mask, x, y, score in sim.collide():
+                        if journal is not None:
+                            (journal.miss if kind == EVENT_MISS else journal.paddle)(mask, x, y, score)
+                    if journal is not None:
+                        journal.ball(sim.ballX, sim.ballY, sim.score)
+                    if self.recorder is not None:
+                        self.recorder.step()
+
+                    # 刺激信号の更新
+                    if sim.mask != tempMask:
+                        config.RelayQ.publish(sim.mask, int(self.hwClock.monotonic() * 1e9))
+                        tempMask = sim.mask
+                        if journal is not None:
+                            journal.stim(sim.mask)
+                    acc -= dt
+                    steps += 1
+
+                if steps == MAX_SUBSTEPS and acc >= dt:
+                    # 処理が間に合わない分は捨てる (遅れを取り戻そうとしてさらに遅れるのを防ぐ)
+                    acc = 0.0
+
+                wait = dt - acc
+                if self.display:
+                    # 描画はゲームの進行と独立に renderRate で間引く
+                    if now >= nextRender:
+                        self.draw(acc / dt if sim.physics == "swept" else 1.0)
+                        nextRender = max(nextRender + 1.0 / self.renderRate, now)
+                    wait = min(wait, nextRender - now)
+                # 次のステップか描画の時刻まで待つ (仮想時計では倍速で進む)
+                self.hwClock.sleep(wait)
+        finally:
+            # Ctrl+C で中断された場合も後始末を行う
+            senseSub.close()
+            if self.recorder is not None:
+                self.recorder.close()
+                print(f"Game record saved to {self.recorder.path}")
+            if self.renderer is not None:
+                print(f"Renderer: {self.renderer.summary()}")
+            if self.display:
+                pygame.display.quit()
+                pygame.quit()
+
+    def draw(self, alpha=1.0):
+        """PongSim の状態を画面に描画する (ボールは前のステップから alpha だけ進めた位置)"""
+        if self.renderer is not None:
+            self.renderer.draw(alpha)
+            return
+        sim = self.sim
+        self.paddle.rect.y = sim.paddleY
+        self.ball.rect.x, self.ball.rect.y = sim.interpolate(alpha)
+        for i in range(6):
+            if sim.mask >> i & 1:
+                self.ballRegions[i].activate()
+            else:
+                self.ballRegions[i].deactivate()
+        self.screen.fill(BLACK)
+        self.all_sprites_list.draw(self.screen) 
+        font = pygame.font.Font(None, 74)
+        text = font.render(str(sim.score), 1, WHITE)
+        self.screen.blit(text, score_pos(self.size))
+        pygame.display.flip()
@@ -0,0 +1,124 @@
+# runtime.py
+# センサー取得・電極出力を専用のプロセスで実行するランタイム
+#
+# Pygame の描画やガベージコレクションで GIL が占有されても，サンプリングの周期が乱れないよう
+# serialPlot (サンプリングスレッド・セッションログ) を子プロセスで動かす．
+# ゲームとの受け渡しは config.share() で共有メモリ (shmbus.py) に置き換えたチャンネルで行い，
+# サンプル・刺激パターン・イベントは pickle せずに共有メモリへ直接書き込む．
+#
+#   メインプロセス : Pong, combined_data の保存 (SenseQ を購読, RelayQ / BallQ へ配信)
+#   取得プロセス   : serialPlot (SenseQ へ配信, RelayQ を購読して電極を出力)
+#
+# 終了時は取得プロセスが serialPlot.close() で全電極ピンを非刺激レベルに戻してから GPIO を解放する．
+# メインプロセスが異常終了した場合や SIGTERM で止められた場合も同じく電極ピンを戻してから終わる．
+
+import os
+import signal
+import importlib
+import multiprocessing as mp
+import config
+import hardware
+
+
+class AcquisitionProcess:
+    """serialPlot を子プロセスで実行する (serialPlot と同じく readSerialStart() / close() で使う)
+
+    plotter : serialPlot を定義したモジュール名 ("tra_plotter" / "plotter_random_tra")
+    replay  : 記録データの再生 ((ファイル名, 速度)．None でセンサーから取得)
+    options : serialPlot に渡す引数 (rate, ina, policy)
+    """
+
+    def __init__(self, plotter, replay=None, startTimeout=30.0, **options):
+        self.plotter = plotter
+        self.replay = replay
+        self.options = options
+        self.startTimeout = startTimeout
+        self.process = None
+        self.log = None
+        self._ctx = mp.get_context("spawn")
+        self._stop = self._ctx.Event()
+        self._finished = self._ctx.Event()
+
+    def readSerialStart(self):
+        """共有メモリを作成して取得プロセスを開始し，センサーの初期化が終わるまで待つ"""
+        if self.process is not None:
+            return
+        hw = hardware.get_backend()
+        if hw.simulated:
+            # 子プロセスの仮想時計 (と模擬ゲル) を同じ基準で動かす
+            os.environ["GEL_SIM_ORIGIN"] = ",".join(repr(v) for v in hw.clock.origin())
+        specs = config.share()
+        receiver, sender = self._ctx.Pipe(duplex=False)
+        self.process = self._ctx.Process(target=_acquisition_main, name="acquisition",
+                                         args=(self.plotter, specs, self.replay, self.options,
+                                               self._stop, self._finished, sender))
+        self.process.start()
+        sender.close()
+        try:
+            if not receiver.poll(self.startTimeout):
+                raise RuntimeError("Acquisition process did not start")
+            self.log = _LogInfo(receiver.recv())
+        except (EOFError, RuntimeError):
+            self.close()
+            raise RuntimeError("Acquisition process failed to start")
+        finally:
+            receiver.close()
+        print(f"Acquisition process started (pid {self.process.pid}).")
+
+    @property
+    def replayFinished(self):
+        """記録データの再生を最後まで終えたら True"""
+        return self._finished.is_set()
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def close(self, timeout=10.0):
+        """取得プロセスを終了させ (電極ピンのリセット・GPIO の解放を含む)，共有メモリを解放する"""
+        if self.process is not None:
+            self._stop.set()
+            self.process.join(timeout)
+            if self.process.is_alive():
+                print("Acquisition process did not stop; terminating.")
+                self.process.terminate()
+                self.process.join()
+        config.release()
+
+
+class _LogInfo:
+    """取得プロセスが書いているセッションログ (path のみ)"""
+
+    def __init__(self, path):
+        self.path = path
+
+
+def _terminate(signum, frame):
+    # SIGTERM (close() のタイムアウト時の terminate()) でも finally で電極ピンを戻す
+    raise SystemExit(128 + signum)
+
+
+def _acquisition_main(plotter, specs, replay, options, stop, finished, conn):
+    # Ctrl+C はメインプロセスで受け，終了は stop で伝える
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _terminate)
+    parent = mp.parent_process()
+    config.attach(specs)
+    module = importlib.import_module(plotter)
+    s = None
+    try:
+        source = None
+        if replay is not None:
+            from replay import TraceReplay
+            source = TraceReplay(replay[0], speed=replay[1], clock=module.hw.clock)
+        s = module.serialPlot(replay=source, **options)
+        s.readSerialStart()
+        conn.send(s.log.path)
+        conn.close()
+        # メインプロセスが (SIGKILL などで) いなくなったら刺激を続けずに終わる
+        while not stop.wait(0.1) and parent.is_alive():
+            if s.replayFinished:
+                finished.set()
+    finally:
+        if s is not None:
+            s.close()
+        config.release()
@@ -0,0 +1,121 @@
+# sampler.py
+# 絶対時刻の締め切りに基づく固定周期サンプラー
+#
+# 各周期の締め切りを「開始時刻 + k × 周期」の絶対時刻で管理するため，
+# 処理時間 (I2C読み出し・ファイル書き込み・描画) の影響で周期がずれていかない．
+# 実際の周期・ジッタ (締め切りからの遅れ) の分布・締め切りの取りこぼし数を記録する．
+
+import threading
+from collections import deque
+from hardware import RealClock
+
+
+class FixedRateSampler:
+    """rate [Hz] の周期で callback を呼び出すサンプラー
+
+    policy : 1周期以上遅れたときの動作
+        "skip"    : 過ぎた締め切りは飛ばして次の周期に合わせる (飛ばした数を missed に数える)
+        "catchup" : 過ぎた締め切りの分も続けて実行する (maxCatchup 周期を超える遅れは飛ばす)
+    window : ジッタ統計に使う直近のサンプル数
+    """
+
+    def __init__(self, rate, callback, clock=None, policy="skip", maxCatchup=10, window=1000):
+        if policy not in ("skip", "catchup"):
+            raise ValueError(f"Unknown sampler policy: {policy}")
+        self.rate = float(rate)
+        self.period = 1.0 / self.rate
+        self.callback = callback
+        self.clock = clock if clock is not None else RealClock()
+        self.policy = policy
+        self.maxCatchup = maxCatchup
+
+        self.count = 0        # 実行した回数
+        self.missed = 0       # 飛ばした締め切りの数
+        self.maxLate = 0.0    # 締め切りからの最大の遅れ [s]
+        self._late = deque(maxlen=window)
+        self._starts = deque(maxlen=window)
+        self._firstStart = None
+        self._lastStart = None
+        self._running = False
+        self._thread = None
+
+    def run(self, stop=None):
+        """stop() が True を返すか self.stop() が呼ばれるまで周期実行する (呼び出したスレッドで実行)"""
+        self._running = True
+        clock, period = self.clock, self.period
+        t0 = clock.monotonic()
+        k = 0
+        while self._running and not (stop and stop()):
+            deadline = t0 + k * period
+            now = clock.monotonic()
+            if now < deadline:
+                clock.sleep(deadline - now)
+                now = clock.monotonic()
+
+            behind = int((now - deadline) // period)
+            if behind > 0:
+                # 1周期以上の遅れ: 方針に従って締め切りを飛ばす
+                skip = behind if self.policy == "skip" else max(0, behind - self.maxCatchup)
+                self.missed += skip
+                k += skip
+                deadline = t0 + k * period
+
+            self._record(now, now - deadline)
+            self.callback()
+            k += 1
+        self._running = False
+
+    def start(self, stop=None):
+        """別スレッドで run() を開始する"""
+        self._thread = threading.Thread(target=self.run, args=(stop,), daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _record(self, now, late):
+        self.count += 1
+        self._late.append(late)
+        self._starts.append(now)
+        if self._firstStart is None:
+            self._firstStart = now
+        self._lastStart = now
+        if late > self.maxLate:
+            self.maxLate = late
+
+    def stats(self):
+        """達成周波数・ジッタの分位点 [ms]・取りこぼし数を辞書で返す"""
+        late = sorted(self._late)
+        starts = list(self._starts)
+
+        def pct(p):
+            if not late:
+                return 0.0
+            return late[min(len(late) - 1, int(p / 100 * len(late)))] * 1000
+
+        achieved = 0.0
+        if self.count > 1 and self._lastStart > self._firstStart:
+            achieved = (self.count - 1) / (self._lastStart - self._firstStart)
+        recent = 0.0
+        if len(starts) > 1 and starts[-1] > starts[0]:
+            recent = (len(starts) - 1) / (starts[-1] - starts[0])
+        return {
+            "rate": self.rate,
+            "achievedRate": achieved,
+            "recentRate": recent,
+            "count": self.count,
+            "missed": self.missed,
+            "jitterP50": pct(50),
+            "jitterP95": pct(95),
+            "jitterP99": pct(99),
+            "jitterMax": self.maxLate * 1000,
+        }
+
+    def summary(self):
+        s = self.stats()
+        return (f"rate {s['achievedRate']:.1f}/{s['rate']:.0f} Hz, missed {s['missed']}, "
+                f"jitter p50 {s['jitterP50']:.2f} ms / p95 {s['jitterP95']:.2f} ms / "
+                f"p99 {s['jitterP99']:.2f} ms / max {s['jitterMax']:.2f} ms")
@@ -0,0 +1,233 @@
+# sessionlog.py
+# 固定長レコードのバイナリセッションログと，従来のテキスト / CSV 形式への変換
+#
+# センサー値を1サンプルごとに open → 追記 → close する代わりに，1つのファイルを開いたまま
+# 固定長レコードをメモリ上のチャンクに詰め，一定間隔 (既定 1秒) ごとにまとめて書き込む．
+# ゲームのイベント (開始・打ち返し・ミス) はイベントジャーナル (journal.py) にのみ記録する．
+#
+# レコード (24 byte, リトルエンディアン)
+#   t      int64  : サンプル取得時の clock.monotonic() のセッション開始 (ヘッダーの mono0) からの経過時間 [ns]
+#   (ヘッダーの wall0 は mono0 と同時に読んだ clock.time() で，RawTime / Timestamp は wall0 + t で復元する)
+#   cBlack, cBrown, cRed int16 : 電流値 [0.1mA]
+#   mask   uint8  : 刺激パターン (bit i = Region i)．MASK_NONE は刺激の送信前
+#   kind   uint8  : レコードの種類 (KIND_SENSE)．FLAG_RANDOM はランダム刺激モード中，FLAG_NO_BALL はボール位置なし
+#   ballX, ballY int16, score int32 : ボール位置とラリー回数
+#
+# 変換: python sessionlog.py Data/session_<日付>_<番号>.bin [--game tra|random] [--csv [--journal Data/journal_*.bin]]
+#   (ballPos / pongData はイベントジャーナルから journal.py で変換する)
+
+import os
+import time
+import struct
+import argparse
+import threading
+from datetime import date, datetime
+import numpy as np
+from hardware import RealClock
+
+MAGIC = b"GELSLOG2"
+HEADER = struct.Struct("<8sqqI")         # magic, wall0 [ns], mono0 [ns], レコード長
+RECORD = struct.Struct("<qhhhBBhhi")
+DTYPE = np.dtype([("t", "<i8"), ("cBlack", "<i2"), ("cBrown", "<i2"), ("cRed", "<i2"),
+                  ("mask", "u1"), ("kind", "u1"), ("ballX", "<i2"), ("ballY", "<i2"), ("score", "<i4")])
+
+KIND_SENSE = 0     # センサーのサンプル
+FLAG_RANDOM = 0x10
+FLAG_NO_BALL = 0x20
+KIND_MASK = 0x0F
+
+MASK_NONE = 0x80
+CURRENT_NAN = -32768
+
+
+class SessionLog:
+    """固定長レコードを1つのファイルへまとめて書き込むセッションログ (複数スレッドから書き込み可)
+
+    chunkRecords  : メモリ上にためるレコード数 (満杯になったら書き込む)
+    flushInterval : この秒数 (実時間) ごとにためたレコードを書き込む
+    """
+
+    def __init__(self, path, clock=None, chunkRecords=4096, flushInterval=1.0):
+        self.path = path
+        self.clock = clock if clock is not None else RealClock()
+        self.flushInterval = flushInterval
+        self.mono0 = round(self.clock.monotonic() * 1e9)
+        self.wall0 = round(self.clock.time() * 1e9)
+        self.count = 0
+        self._chunk = bytearray(RECORD.size * chunkRecords)
+        self._used = 0
+        self._lock = threading.Lock()
+        self._lastFlush = time.monotonic()
+        self._file = open(path, "wb", buffering=0)
+        self._file.write(HEADER.pack(MAGIC, self.wall0, self.mono0, RECORD.size))
+
+    @classmethod
+    def create(cls, folder="Data", **options):
+        """folder/session_<日付>_<番号>.bin を新しく作る"""
+        os.makedirs(folder, exist_ok=True)
+        n = 0
+        while os.path.exists(os.path.join(folder, f"session_{date.today()}_{n}.bin")):
+            n += 1
+        return cls(os.path.join(folder, f"session_{date.today()}_{n}.bin"), **options)
+
+    def sample(self, sample, mask=None, ball=None, randomMode=False):
+        """SenseQ のレコード (cBlack, cBrown, cRed, RawTime[ms], MonoTime[ns]) を書き込む"""
+        t = int(sample[4]) - self.mono0
+        kind = KIND_SENSE | (FLAG_RANDOM if randomMode else 0)
+        self._append(t, sample[0], sample[1], sample[2], mask, ball, kind)
+
+    def _append(self, t, c0, c1, c2, mask, ball, kind):
+        if ball:
+            x, y, score = ball
+        else:
+            x, y, score = 0, 0, 0
+            kind |= FLAG_NO_BALL
+        with self._lock:
+            if self._file is None:
+                return
+            RECORD.pack_into(self._chunk, self._used, t, _q(c0), _q(c1), _q(c2),
+                             MASK_NONE if mask is None else int(mask) & 0x3F, kind,
+                             _i16(x), _i16(y), int(score))
+            self._used += RECORD.size
+            self.count += 1
+            if self._used == len(self._chunk) or time.monotonic() - self._lastFlush >= self.flushInterval:
+                self._flush()
+
+    def _flush(self):
+        if self._used:
+            self._file.write(memoryview(self._chunk)[:self._used])
+            self._used = 0
+        self._lastFlush = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._flush()
+            self._file.close()
+            self._file = None
+
+
+def _q(current):
+    """電流値 [mA] を 0.1mA 単位の int16 に変換 (NaN は CURRENT_NAN)"""
+    if current != current:
+        return CURRENT_NAN
+    return max(-32767, min(32767, round(current * 10)))
+
+
+def _i16(v):
+    return max(-32768, min(32767, int(v)))
+
+
+def read(path):
+    """セッションログを (wall0 [ns], mono0 [ns], レコードの構造化配列) で読む．末尾の書きかけのレコードは無視"""
+    with open(path, "rb") as f:
+        magic, wall0, mono0, size = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or size != DTYPE.itemsize:
+            raise ValueError(f"Not a session log: {path}")
+        data = f.read()
+    return wall0, mono0, np.frombuffer(data, dtype=DTYPE, count=len(data) // size)
+
+
+# --- 従来形式への変換 ---
+
+def _current_text(q):
+    return "nan" if q == CURRENT_NAN else f"{q / 10:.1f}"
+
+
+def _relay_text(mask, game):
+    if mask & MASK_NONE:
+        return ""
+    on = "-1" if game == "tra" else "1"
+    return ",".join(on if (mask >> i) & 1 else "0" for i in range(6))
+
+
+def _raw_ms(wall0, t):
+    """t (mono0 からの経過時間) を clock.time() の時刻 [ms] に戻す"""
+    return (int(t) + wall0) // 1000000
+
+
+def sense_lines(wall0, records, game="tra", interval=0.1):
+    """senseData_*.txt の各行 ("RelayQ:cBlack,cBrown,cRed,RawTime") を interval [s] ごとに返す"""
+    lastTime = None
+    for t, c0, c1, c2, mask, kind in zip(*(records[k].tolist() for k in ("t", "cBlack", "cBrown", "cRed", "mask", "kind"))):
+        if kind & KIND_MASK != KIND_SENSE:
+            continue
+        raw = _raw_ms(wall0, t)
+        if lastTime is not None and raw - lastTime < interval * 1000:
+            continue
+        lastTime = raw
+        yield f"{_relay_text(mask, game)}:{_current_text(c0)},{_current_text(c1)},{_current_text(c2)},{raw}"
+
+
+def combined_rows(wall0, mono0, records, game="tra", start=None):
+    """combined_data CSV の各行を返す (start [ns] はゲーム開始の clock.monotonic() の時刻．それより前のサンプルは除く)"""
+    epoch = None if start is None else start - mono0
+    for t, c0, c1, c2, kind, x, y, score in zip(*(records[k].tolist() for k in ("t", "cBlack", "cBrown", "cRed", "kind", "ballX", "ballY", "score"))):
+        if kind & (KIND_MASK | FLAG_NO_BALL) != KIND_SENSE or (epoch is not None and t < epoch):
+            continue
+        raw = _raw_ms(wall0, t)
+        timestamp = datetime.fromtimestamp(raw / 1000).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+        row = [timestamp, _current_text(c0), _current_text(c1), _current_text(c2), raw, x, y, score]
+        if game == "random":
+            row.append("Random" if kind & FLAG_RANDOM else "Normal")
+        yield row
+
+
+COMBINED_HEADERS = {
+    "tra": ["Timestamp", "cBlack", "cBrown", "cRed", "RawTime", "BallX", "BallY", "RallyCount", "PaddleY"],
+    "random": ["Timestamp", "cBlack", "cBrown", "cRed", "RawTime", "BallX", "BallY", "RallyCount", "Mode"],
+}
+
+
+def convert(path, game="tra", combined=False, senseInterval=0.1, journalPath=None):
+    """セッションログを同じフォルダの senseData (と combined_data CSV) に変換する
+
+    journalPath : 同じ実行のイベントジャーナル．指定すると combined_data CSV からゲーム開始前のサンプルを除く
+    """
+    import csv
+    wall0, mono0, records = read(path)
+    start = None
+    if journalPath is not None:
+        import journal
+        start = journal.start_time(journalPath)
+    folder, name = os.path.split(path)
+    stem = os.path.splitext(name)[0]
+    suffix = stem[len("session_"):] if stem.startswith("session_") else stem
+    written = []
+
+    def save(prefix, lines):
+        lines = list(lines)
+        if not lines:
+            return
+        out = os.path.join(folder, f"{prefix}_{suffix}.txt")
+        with open(out, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        written.append(out)
+
+    save("senseData", sense_lines(wall0, records, game, senseInterval))
+    if combined:
+        out = os.path.join(folder, f"combined_data_{suffix}.csv")
+        with open(out, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(COMBINED_HEADERS[game])
+            writer.writerows(combined_rows(wall0, mono0, records, game, start))
+        written.append(out)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="セッションログ (.bin) を従来のテキスト / CSV 形式に変換")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--game", choices=("tra", "random"), default="tra", help="RelayQ の書式と CSV の列")
+    parser.add_argument("--csv", action="store_true", help="combined_data CSV も出力する")
+    parser.add_argument("--journal", default=None, help="同じ実行のイベントジャーナル (CSV のゲーム開始前の行を除く)")
+    args = parser.parse_args()
+    for p in args.paths:
+        for out in convert(p, args.game, args.csv, journalPath=args.journal):
+            print(out)
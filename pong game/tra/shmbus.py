@@ -0,0 +1,237 @@
+# shmbus.py
+# プロセス間でサンプル・刺激パターンを受け渡す共有メモリのリングバッファ
+#
+# bus.Channel と同じ使い方 (publish / latest / subscribe) で，異なるプロセスから読み書きできる．
+# 共有メモリの先頭に連番，購読者のカーソル表，スロットごとの書き込み連番，続いて固定長のレコードを置き，
+# 数値は共有メモリへ直接書き込む (pickle は使わない)．書き込みは1チャンネルにつき1プロセスのみとする．
+#
+# 連番・カーソルはすべて 32bit (armv7 でも1回のストアで書かれる) で，2^32 レコードで一周する
+# (1kHz でも約50日．1回の実験ではそこまで進まない)．
+# レコードはスロットごとに seqlock で受け渡す: 書き込み側は「開始連番 → 値 → 終了連番 → チャンネルの連番」の
+# 順に書き，読み出し側は「終了連番 → 値 → 開始連番」の順に読んで，両方が読みたい連番と一致した場合のみ採用する．
+# 読んでいる間に上書きが始まったレコード (書きかけ・混在) はこれで検出し，読み直す．
+
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+_MASK = 0xFFFFFFFF
+MAX_SUBSCRIBERS = 16   # 1チャンネルあたりの購読者数の上限 (block=True のバックプレッシャー用)
+
+# 共有メモリ上の配置 (uint32 単位): [連番, 予備 x3] [カーソル x MAX] [使用中 x MAX] [開始, 終了] x capacity
+_HEADER = 4
+_CURSORS = _HEADER
+_ACTIVE = _CURSORS + MAX_SUBSCRIBERS
+_STAMPS = _ACTIVE + MAX_SUBSCRIBERS
+
+
+class ShmChannel:
+    """共有メモリ上の連番付きリングバッファ (bus.Channel と互換)
+
+    create=True で共有メモリを作成し，他のプロセスでは spec() を attach() に渡して接続する．
+    """
+
+    POLL_INTERVAL = 0.0005
+
+    def __init__(self, name, fields, capacity=1024, typecode='d', shmName=None, create=True, lock=None):
+        self.name = name
+        self.fields = tuple(fields)
+        self.width = len(self.fields)
+        self.capacity = capacity
+        self.typecode = typecode
+        self.blocked = 0
+        words = _STAMPS + 2 * capacity
+        offset = (words * 4 + 7) // 8 * 8
+        size = offset + capacity * self.width * 8
+        self._shm = shared_memory.SharedMemory(name=shmName, create=create, size=size)
+        self._owner = create
+        self._words = self._shm.buf[:words * 4].cast('I')
+        self._buf = self._shm.buf[offset:size].cast(typecode)
+        # 購読者のカーソル表の割り当て用 (レコードの受け渡しには使わない)
+        self._lock = lock if lock is not None else mp.get_context("spawn").Lock()
+        if create:
+            for i in range(words):
+                self._words[i] = 0
+
+    def spec(self):
+        """他のプロセスで attach() するための情報 (プロセスの起動時に引数として渡す)"""
+        return {"name": self.name, "fields": self.fields, "capacity": self.capacity,
+                "typecode": self.typecode, "shmName": self._shm.name, "lock": self._lock}
+
+    @classmethod
+    def attach(cls, spec):
+        return cls(spec["name"], spec["fields"], spec["capacity"], spec["typecode"],
+                   shmName=spec["shmName"], create=False, lock=spec["lock"])
+
+    @property
+    def seq(self):
+        return self._words[0]
+
+    def publish(self, *values, block=False, timeout=None):
+        """レコードを書き込んで連番を返す (書き込みプロセスのみ)
+
+        block=True では最も遅い購読者が追いつくまで待つ (timeout 経過後は上書きする)．
+        """
+        seq = (self._words[0] + 1) & _MASK
+        if block and self._lag(seq - 1) >= self.capacity:
+            self.blocked += 1
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while self._lag(seq - 1) >= self.capacity:
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                time.sleep(self.POLL_INTERVAL)
+        slot = seq % self.capacity
+        base = slot * self.width
+        stamp = _STAMPS + 2 * slot
+        self._words[stamp] = seq
+        for i in range(self.width):
+            self._buf[base + i] = values[i]
+        self._words[stamp + 1] = seq
+        self._words[0] = seq
+        return seq
+
+    def latest(self):
+        """最新レコードを (連番, 値のタプル) で返す．未書き込みなら (0, None)"""
+        while True:
+            seq = self._words[0]
+            if seq == 0:
+                return 0, None
+            record = self._read(seq)
+            if record is not None:
+                return seq, record
+            time.sleep(self.POLL_INTERVAL)
+
+    def subscribe(self, fromLatest=True):
+        """購読カーソルを作る (fromLatest=False では保持している最古のレコードから読む)"""
+        with self._lock:
+            for index in range(MAX_SUBSCRIBERS):
+                if not self._words[_ACTIVE + index]:
+                    break
+            else:
+                raise RuntimeError(f"{self.name}: too many subscribers (max {MAX_SUBSCRIBERS})")
+            seq = self._words[0]
+            cursor = seq if fromLatest else max(0, seq - self.capacity)
+            self._words[_CURSORS + index] = cursor
+            self._words[_ACTIVE + index] = 1
+        return ShmSubscription(self, cursor, index)
+
+    def _lag(self, seq):
+        """最も遅い購読者が読み終えていないレコード数 (購読者がいなければ 0)"""
+        lag = 0
+        for index in range(MAX_SUBSCRIBERS):
+            if self._words[_ACTIVE + index]:
+                lag = max(lag, (seq - self._words[_CURSORS + index]) & _MASK)
+        return lag
+
+    def _read(self, seq):
+        """seq のレコードを読む．書き込み中・上書き済みなら None"""
+        slot = seq % self.capacity
+        base = slot * self.width
+        stamp = _STAMPS + 2 * slot
+        if self._words[stamp + 1] != seq:
+            return None
+        record = tuple(self._buf[base:base + self.width])
+        if self._words[stamp] != seq:
+            return None
+        return record
+
+    def _unsubscribe(self, index):
+        if self._shm is None:
+            return
+        with self._lock:
+            self._words[_ACTIVE + index] = 0
+
+    def close(self):
+        """共有メモリの参照を解放する (作成したプロセスでは共有メモリも削除する)"""
+        if self._shm is None:
+            return
+        self._words.release()
+        self._buf.release()
+        self._shm.close()
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+        self._shm = None
+
+
+class ShmSubscription:
+    """共有メモリチャンネルの購読カーソル (bus.Subscription と互換．新着はポーリングで待つ)
+
+    カーソルは共有メモリのカーソル表にも書き，書き込み側の block=True はこれを見て待つ．
+    """
+
+    POLL_INTERVAL = 0.0005
+
+    def __init__(self, channel, cursor, index):
+        self.channel = channel
+        self.cursor = cursor
+        self.index = index
+        self.received = 0
+        self.dropped = 0
+
+    def _deadline(self, timeout):
+        return None if timeout is None else time.monotonic() + timeout
+
+    def _wait(self, deadline):
+        ch = self.channel
+        while ch.seq <= self.cursor:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(self.POLL_INTERVAL)
+        return True
+
+    def _advance(self, cursor):
+        self.cursor = cursor
+        self.received += 1
+        if self.index is not None:
+            self.channel._words[_CURSORS + self.index] = cursor & _MASK
+
+    def get(self, timeout=None):
+        """次のレコードを (連番, 値) で返す．届くまで待ち，timeout 経過時は None"""
+        deadline = self._deadline(timeout)
+        if not self._wait(deadline):
+            return None
+        ch = self.channel
+        while True:
+            oldest = ch.seq - ch.capacity + 1
+            if self.cursor + 1 < oldest:
+                self.dropped += oldest - self.cursor - 1
+                self.cursor = oldest - 1
+            record = ch._read(self.cursor + 1)
+            if record is not None:
+                break
+            # 書き込み中のスロット: 書き終わるまで待って読み直す
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(self.POLL_INTERVAL)
+        self._advance(self.cursor + 1)
+        return self.cursor, record
+
+    def poll(self):
+        """届いているレコードをすべて (連番, 値) のリストで返す (待たない)"""
+        records = []
+        while True:
+            record = self.get(timeout=0)
+            if record is None:
+                return records
+            records.append(record)
+
+    def latest(self, timeout=0):
+        """前回以降に新しいレコードがあれば最新の1件を返す (途中のレコードは読み飛ばす)"""
+        if not self._wait(self._deadline(timeout)):
+            return None
+        seq, record = self.channel.latest()
+        self._advance(seq)
+        return seq, record
+
+    def pending(self):
+        """未読のレコード数"""
+        return self.channel.seq - self.cursor
+
+    def close(self):
+        """カーソル表から外す (以降，書き込み側の block=True はこの購読者を待たない)"""
+        if self.index is not None:
+            self.channel._unsubscribe(self.index)
+            self.index = None
@@ -0,0 +1,53 @@
+# tra_game.py
+# tra のゲームの設定 (刺激領域の配置・デコーダの校正値・電極ピン)
+#
+# pygame を使わないので，画面のない pongsim.py / pongbatch.py からも読み込める．
+# 画面を持つ pong.py と電極を出力する tra_plotter.py もここから読む．
+
+from pongsim import PongSim
+from geometry import tra_regions
+from decoder import DECODERS
+
+# --- ピン定義 (1電極1ピンのシンプル構成) ---
+BLUE_PIN   = 8
+PURPLE_PIN = 15
+YELLOW_PIN = 21
+GREEN_PIN  = 24
+GREY_PIN   = 18
+WHITE_PIN  = 20
+
+# 刺激パターンの bit i (ボールの位置 Region i+1) に対応する電極ピン
+ELECTRODE_PINS = [
+    YELLOW_PIN,  # Region 1
+    PURPLE_PIN,  # Region 2
+    GREY_PIN,    # Region 3
+    WHITE_PIN,   # Region 4
+    BLUE_PIN,    # Region 5
+    GREEN_PIN,   # Region 6
+]
+
+def make_regions(size=(1000, 1000)):
+    """刺激領域の配置 (領域 i を列 i%2，行 i%3 に置く 2列 × 3行)"""
+    return tra_regions(size)
+
+def make_sim(size=(1000, 1000), seed=None, physics="frame"):
+    """tra の規則の PongSim (ミスしたら領域判定の後にボールを中央に戻す)"""
+    return PongSim(size, make_regions(size), seed=seed, physics=physics)
+
+def make_decoder(size=(1000, 1000), decoder="analytic"):
+    """パドル位置のデコーダ (3点を通る2次関数の頂点を解析的に計算)
+    decoder="lut" では 0.1mA 単位の全組み合わせを事前計算した表を引く"""
+    # 正規化用パラメータ (環境に合わせて調整)
+    origTop, origMid, origBot = 0, 0, 0 
+    topupRangeC = 6.7
+    midupRangeC = 4.9
+    botupRangeC = 7.6
+    toplowRangeC = 3.7#マイナスの値は正の値で入力
+    midlowRangeC = 3.1
+    botlowRangeC = 4.4 
+    return DECODERS[decoder](
+        [(origTop + topupRangeC, origTop - toplowRangeC),
+         (origMid + midupRangeC, origMid - midlowRangeC),
+         (origBot + botupRangeC, origBot - botlowRangeC)],
+        [int(size[1]/6), int((3*size[1])/6), int((5*size[1])/6)],
+        size[1], size[1], round(size[1]/3))
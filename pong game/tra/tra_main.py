@@ -1,69 +1,89 @@
 import sys
 import threading
 from pong import Pong 
-from tra_plotter import serialPlot 
-import time
+from tra_plotter import serialPlot, hw, formatCurrents
+from replay import TraceReplay
+from runtime import AcquisitionProcess
+from fastina import InaSettings
+from csvlog import AsyncCsvWriter
+from journal import EventJournal
 import config
-import csv  
 import os
 from datetime import datetime  
 
+SAMPLE_RATE = 100   # センサーのサンプリング周波数 [Hz]
+# INA219 の ADC 設定 (shuntAdc: "9bit"〜"12bit"，平均化は "12bit_2S"〜"12bit_128S")．None で従来の読み出し
+INA_SETTINGS = InaSettings(shuntAdc="12bit", gain="320mV", rshunt=0.1, currentLsb=0.1)
+# センサー取得・電極出力を専用プロセスで実行する (GEL_MULTIPROCESS=1 で有効．既定は従来どおり同じプロセスのスレッド)
+USE_PROCESS = os.environ.get("GEL_MULTIPROCESS", "0") != "0"
+
 def main():
     # フォルダの安全確保
     os.makedirs("Data", exist_ok=True)
 
+    # 記録データの再生 (GEL_REPLAY=combined_data_*.csv，GEL_REPLAY_SPEED=0 で最速)
+    replay = None
+    if os.environ.get("GEL_REPLAY"):
+        replay = (os.environ["GEL_REPLAY"], float(os.environ.get("GEL_REPLAY_SPEED", "1")))
+
     # 接続設定
-    s = serialPlot('NOT_USED', 115200, 1000, 4)
+    if USE_PROCESS:
+        s = AcquisitionProcess("tra_plotter", replay=replay, rate=SAMPLE_RATE, ina=INA_SETTINGS)
+    else:
+        s = serialPlot('NOT_USED', 115200, 1000, 4, rate=SAMPLE_RATE, ina=INA_SETTINGS,
+                       replay=TraceReplay(*replay, clock=hw.clock) if replay else None)
     s.readSerialStart()
     
+    # シミュレーション時は画面を開かずに実行
+    if hw.simulated:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+    # ゲームのイベントジャーナル (GEL_JOURNAL=0 で記録しない．GEL_BALL_RATE はボール位置の記録回数 [Hz])
+    journal = None
+    if os.environ.get("GEL_JOURNAL", "1") != "0":
+        journal = EventJournal.create(clock=hw.clock, game="tra", ballRate=float(os.environ.get("GEL_BALL_RATE", "2")))
+
     # ゲームの初期化 (1000, 1000)
-    pong = Pong((1000, 1000))
+    pong = Pong((1000, 1000), clock=hw.clock, decoder=os.environ.get("GEL_DECODER", "analytic"),
+                renderer=os.environ.get("GEL_RENDER", "dirty"), renderRate=float(os.environ.get("GEL_RENDER_RATE", "0")) or None,
+                physics=os.environ.get("GEL_PHYSICS", "swept"), record=os.environ.get("GEL_RECORD", "1") != "0",
+                journal=journal)
     
     # ログファイル名生成
     now_str = datetime.now().strftime('%Y%m%d_%H%M%S')
     filename = f"combined_data_{now_str}.csv"
 
     try:
-        f = open(filename, mode='w', newline='')
-        writer = csv.writer(f)
+        # 書き込みは専用スレッドで行う (時刻の文字列化・電流値の書式化もそちらで実行)
         # ★修正：ヘッダーに RallyCount を追加
-        writer.writerow(["Timestamp", "cBlack", "cBrown", "cRed", "RawTime", "BallX", "BallY", "RallyCount","PaddleY"])
+        writer = AsyncCsvWriter(filename, ["Timestamp", "cBlack", "cBrown", "cRed", "RawTime", "BallX", "BallY", "RallyCount","PaddleY"],
+                                rowFormat=lambda sample, ball: formatCurrents(sample).split(',') + list(ball),
+                                clock=hw.clock)
     except IOError as e:
         print(f"File error: {e}"); sys.exit(1)
 
     def sensor_bridge():
         print("センサー・ボール位置・ラリー同期保存開始...")
+        # サンプリングスレッド (tra_plotter) が配信する電流値を購読する
+        senseSub = config.SenseQ.subscribe()
 
         while pong.carryOn:
-            # 電流値を取得 (tra_plotterからは "cBlack,cBrown,cRed,RawTime" が返る)
-            current_raw_str = s.getCurrents_RPI() 
+            # 新しいサンプルが届くまで待つ ((cBlack, cBrown, cRed, RawTime, MonoTime))
+            record = senseSub.get(timeout=0.5)
             
-            # ボール位置とスコアを取得 (pong.pyから "BallX,BallY,RallyCount" が届く)
-            ball_pos_str = config.BallQ
+            # ボール位置とスコアを取得 (pong.pyから (BallX, BallY, RallyCount) が届く)
+            ball_data = config.BallQ.latest()[1]
             
-            if current_raw_str and ball_pos_str:
-                current_list = current_raw_str.split(',')
-                ball_data = ball_pos_str.split(',')
-                
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-                
-                try:
-                    # current_list は [cBlack, cBrown, cRed, RawTime]
-                    # ball_data は [BallX, BallY, RallyCount]
-                    # これらを結合して一行にする
-                    writer.writerow([timestamp] + current_list + ball_data)
-                    f.flush() 
-                except:
-                    pass
-                
-                # パドル移動のためにconfigへ共有
-                config.SenseQ = current_raw_str 
-            
-            # 刺激命令があれば実行
-            if config.RelayQ != "":
-                s.setRelays_RPI(config.RelayQ)
-            
-            time.sleep(0.01)
+            if record and ball_data:
+                # 書き込みスレッドへ渡すだけ (キューが満杯なら捨てて数える)
+                writer.write(writer.stamp(), record[1], ball_data)
+
+            # 再生データを最後まで流したら終了
+            if s.replayFinished and senseSub.pending() == 0:
+                print("再生データの終端に到達しました。")
+                pong.close()
+                break
+        senseSub.close()
 
     # センサー監視スレッド
     bridge_thread = threading.Thread(target=sensor_bridge, daemon=True)
@@ -75,8 +95,15 @@ def main():
     except KeyboardInterrupt:
         pass
     finally:
-        f.close()
-        print(f"Data saved to {filename}")
+        pong.close()
+        bridge_thread.join(timeout=1.0)
+        writer.close()
+        if journal is not None:
+            journal.close()
+            print(f"Journal: {journal.summary()} ({journal.path})")
+        s.close()
+        print(f"CSV writer: {writer.summary()}")
+        print(f"Data saved to {filename}, {s.log.path}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,42 +1,43 @@
-import time
-import board 
-import busio 
-import adafruit_ina219 
-import RPi.GPIO as GPIO 
+import hardware
 import config 
+from sampler import FixedRateSampler
+import fastina
+from electrode import ElectrodeDriver
+from sessionlog import SessionLog
 from threading import Thread
-from datetime import date
-from os.path import exists
-
-# --- ピン定義 (1電極1ピンのシンプル構成) ---
-BLUE_PIN   = 8 
-PURPLE_PIN = 15
-YELLOW_PIN = 21
-GREEN_PIN  = 24
-GREY_PIN   = 18
-WHITE_PIN  = 20
-
-ALL_ELECTRODE_PINS = [
-    BLUE_PIN, PURPLE_PIN, YELLOW_PIN, 
-    GREEN_PIN, GREY_PIN, WHITE_PIN
-]
-
-# ボールの位置（Region 0〜5）に対応するピンマップ
-PONG_MAP_RPI = [
- 
-    YELLOW_PIN,  # Region 1
-    PURPLE_PIN,  # Region 2
-    GREY_PIN,    # Region 3
-    WHITE_PIN,   # Region 4
-    BLUE_PIN,    # Region 5
-    GREEN_PIN,   # Region 6
-]
+from tra_game import ELECTRODE_PINS
+
+# 実機 / シミュレーションのバックエンド (GEL_BACKEND 環境変数で切り替え)
+hw = hardware.get_backend()
+GPIO, board, busio = hw.GPIO, hw.board, hw.busio
+
+# ボールの位置（Region 1〜6）に対応するピンマップ (ゲームの設定 tra_game.py で定義)
+PONG_MAP_RPI = ELECTRODE_PINS
+
+def formatCurrents(sample):
+    """(cBlack, cBrown, cRed, RawTime) を従来の "cBlack,cBrown,cRed,RawTime" 形式の文字列にする"""
+    return f"{sample[0]:.1f},{sample[1]:.1f},{sample[2]:.1f},{sample[3]:.0f}"
 
 class serialPlot:
-    def __init__(self, *args):
+    """
+    センサー取得と電極出力を担う唯一のサンプリングスレッド．
+    取得した電流値は config.SenseQ へ配信し，セッションログ・combined_data の保存・
+    パドル位置のデコードはそれぞれこの配信を購読する．
+    """
+    def __init__(self, *args, replay=None, rate=100, policy="skip", log=None, ina=None):
         self.isRun = True
+        # 記録データの再生源 (replay.TraceReplay)．指定時はセンサーの代わりに使用
+        self.replay = replay
+        # 固定周期サンプラー (rate [Hz]，遅れたときの動作は policy = "skip" / "catchup")
+        self.sampler = FixedRateSampler(rate, self.sampleOnce, clock=hw.clock, policy=policy)
+        self.relaySub = config.RelayQ.subscribe()
+        # INA219 の高速読み出し設定 (fastina.InaSettings)．None では adafruit_ina219 で読む
+        self.ina = ina
+        if ina is not None and ina.conversion_time() > 1.0 / rate:
+            print(f"Warning: INA219 conversion time {ina.conversion_time()*1000:.2f} ms is longer than the sample period {1000.0/rate:.2f} ms.")
         self.isReceiving = False
         self.thread = None
+        self.logThread = None
         self.rawData = ""
         
         # 1. GPIOの初期化
@@ -45,9 +46,11 @@ class serialPlot:
         self.ACTIVE_STATE   = GPIO.HIGH
         self.INACTIVE_STATE = GPIO.LOW
 
-        for pin in ALL_ELECTRODE_PINS:
+        for pin in ELECTRODE_PINS:
             GPIO.setup(pin, GPIO.OUT)
             GPIO.output(pin, self.INACTIVE_STATE)
+        # 電極ドライバ (出力はサンプリングスレッドが変化したピンのみまとめて行う)
+        self.driver = ElectrodeDriver(GPIO, PONG_MAP_RPI, self.ACTIVE_STATE, self.INACTIVE_STATE, clock=hw.clock)
 
         # 2. I2C/センサーの初期化
         try:
@@ -58,18 +61,19 @@ class serialPlot:
         except Exception as e:
             print(f"I2C Init Error: {e}")
 
-        # 3. 保存先ファイル作成
-        filePathCount = 0
-        while (exists(f"Data/senseData_{date.today()}_{filePathCount}.txt")): 
-            filePathCount += 1
-        self.filePath = f"Data/senseData_{date.today()}_{filePathCount}.txt"
+        # 3. 保存先ファイル作成 (全サンプルを記録するバイナリのセッションログ, sessionlog.py)
+        self.log = log if log is not None else SessionLog.create("Data", clock=hw.clock)
+        self.filePath = self.log.path
 
         print("GPIO and Sensors initialized (1-pin per electrode mode).")
         self.isReceiving = True
 
     def _init_sensor(self, address, name):
         try:
-            s = adafruit_ina219.INA219(self.i2c, address)
+            if self.ina is not None:
+                s = fastina.FastINA219(self.i2c, address, self.ina)
+            else:
+                s = hw.INA219(self.i2c, address)
             print(f"INA219 {name} connected at {hex(address)}.")
             return s
         except:
@@ -80,62 +84,84 @@ class serialPlot:
         if self.thread is None:
             self.isRun = True
             self.thread = Thread(target=self.backgroundThread)
+            self.logThread = Thread(target=self.senseLogThread)
             self.thread.start()
+            self.logThread.start()
             print("Background thread started.")
 
-    def DriveElectrod_RPI(self, inputs):
-        """
-        1電極1ピン制御: 値が 0 以外ならピンを HIGH にする
-        """
+    @property
+    def replayFinished(self):
+        """記録データの再生を最後まで終えたら True"""
+        return self.replay is not None and self.replay.finished
+
+    def readCurrents(self):
+        """電流値 [mA] (0.1mA 単位) と取得時刻 (clock.time() [ms], clock.monotonic() [ns]) を
+        (cBlack, cBrown, cRed, RawTime, MonoTime) で返す．再生終了後は None"""
+        if self.replay is not None:
+            text = self.replay.getCurrents_RPI()
+            if not text:
+                return None
+            return tuple(float(v) for v in text.split(',')) + (round(hw.clock.monotonic()*1e9),)
+        cBlack, cBrown, cRed = 0.0, 0.0, 0.0
         try:
-            if isinstance(inputs, str):
-                outputs = [int(x.strip()) for x in inputs.split(',')]
+            if self.ina is not None:
+                # 高速読み出し: バスを1回ロックし，各センサー1回の読み出しで取得
+                cBlack, cBrown, cRed = fastina.read_currents(self.i2c, [self.ina_black, self.ina_brown, self.ina_red])
             else:
-                outputs = inputs
-
-            for i in range(min(len(outputs), len(PONG_MAP_RPI))):
-                val = outputs[i]
-                target_pin = PONG_MAP_RPI[i]
-                
-                if val != 0:
-                    GPIO.output(target_pin, self.ACTIVE_STATE)
-                else:
-                    GPIO.output(target_pin, self.INACTIVE_STATE)
-        except Exception:
-            pass
-
-    def setRelays_RPI(self, relay_str):
-        self.DriveElectrod_RPI(relay_str)
+                if self.ina_black: cBlack = self.ina_black.current
+                if self.ina_brown: cBrown = self.ina_brown.current
+                if self.ina_red:   cRed   = self.ina_red.current
+        except: pass
+        return (round(cBlack, 1), round(cBrown, 1), round(cRed, 1), round(hw.clock.time()*1000), round(hw.clock.monotonic()*1e9))
 
     def getCurrents_RPI(self):
-        cBlack, cBrown, cRed = 0.0, 0.0, 0.0
-        try:
-            if self.ina_black: cBlack = self.ina_black.current
-            if self.ina_brown: cBrown = self.ina_brown.current
-            if self.ina_red:   cRed   = self.ina_red.current
-        except: pass
-        return f"{cBlack:.1f},{cBrown:.1f},{cRed:.1f},{time.time()*1000:.0f}"
+        sample = self.readCurrents()
+        return formatCurrents(sample) if sample else ""
 
     def backgroundThread(self):
+        """サンプリングスレッド: 固定周期で sampleOnce を実行する"""
+        self.sampler.run(lambda: not self.isRun)
+        self.relaySub.close()
+        print(f"Sampler: {self.sampler.summary()}")
+        print(f"Electrodes: {self.driver.summary()}")
+
+    def sampleOnce(self):
+        """電流値を取得して配信し，新しい刺激パターンが届いたときに出力する"""
+        sample = self.readCurrents()
+        if sample is not None:
+            config.SenseQ.publish(*sample)
+            self.rawData = formatCurrents(sample)
+
+        # 新しい刺激パターンが届いたときのみドライバへ依頼し，変化したピンだけを出力
+        relay = self.relaySub.latest()
+        if relay is not None:
+            self.driver.request(int(relay[1][0]), relay[1][1] / 1e9)
+            self.driver.apply()
+
+    def senseLogThread(self):
+        """セッションログへの保存 (配信を購読し，全サンプルを刺激パターン・ボール位置とともに記録)"""
+        senseSub = config.SenseQ.subscribe()
         while self.isRun:
-            self.rawData = self.getCurrents_RPI()
-            if config.RelayQ:
-                self.DriveElectrod_RPI(config.RelayQ)
+            record = senseSub.get(timeout=0.5)
+            if record is None:
+                continue
+            mask = config.RelayQ.latest()[1]
             try:
-                with open(self.filePath, "a") as f:
-                    f.write(f"{config.RelayQ}:{self.rawData}\n")
+                self.log.sample(record[1], mask[0] if mask else None, config.BallQ.latest()[1])
             except: pass
-            time.sleep(0.1)
+        senseSub.close()
 
     def RestStim_RPI(self):
-        for pin in ALL_ELECTRODE_PINS:
-            GPIO.output(pin, self.INACTIVE_STATE)
+        self.driver.reset()
         print("All electrode pins set to LOW.")
 
     def close(self):
         self.isRun = False
         if self.thread: 
             self.thread.join()
+        if self.logThread:
+            self.logThread.join()
+        self.log.close()
         self.RestStim_RPI()
         GPIO.cleanup()
         print("GPIO Cleaned up.")
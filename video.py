@@ -4,148 +4,815 @@ import numpy as np
 import os
 import glob
 import time
-from scipy import optimize as opt
+import queue
+import shutil
+import argparse
+import tempfile
+import subprocess
+import threading
+import multiprocessing as mp
+from collections import deque
+from decoder import map_current_batch, peak_index_batch
 
-def create_replay_video(combine_trial2):
+# 動画の設定
+FPS = 30
+DRAW_SIZE = 600
+GRAPH_SIZE = 600
+Y_MIN, Y_MAX = -15, 10
+DISPLAY_SEC = 60
+
+# パドル再現設定 (PaddleYがない場合用)
+ORIG_H, P_HEIGHT = 1000, 333
+X_SENSORS = np.array([166, 500, 833])
+DISP_X = np.linspace(0, ORIG_H, 50)
+
+# 区間ごとの並列エンコード (segments=True): 1区間の長さ [s] (各ワーカーが1区間ずつ動画ファイルに書き出す)
+SEGMENT_SEC = 300
+
+# エンコード: 描画済みフレームを待たせておけるキューの長さ (これを超えると描画側が待つ)
+ENCODE_QUEUE = 64
+# 並列描画 (workers >= 2): ワーカー1つあたりに先行して依頼しておく描画のまとまり (FPS フレーム) の数．
+# 書き出しが描画より遅いときに描き終えたフレームがメインプロセスに溜まり続けないよう，依頼中の数をこれで抑える
+RENDER_AHEAD = 2
+ENCODERS = ("thread", "ffmpeg", "cv2")
+
+
+# CSV の読み込み: 使う列 (列名 -> trace のキー) と型．RallyCount は大文字・小文字や綴り (Relly) の違いも許す
+TRACE_COLUMNS = {"Timestamp": "timestamp", "cBlack": "c_blk", "cBrown": "c_brn", "cRed": "c_red",
+                 "BallX": "b_x", "BallY": "b_y", "PaddleY": "p_y"}
+RALLY_COLUMNS = ("rellycount", "rallycount")
+TRACE_DTYPES = {"timestamp": str, "c_blk": np.float64, "c_brn": np.float64, "c_red": np.float64,
+                "b_x": np.float32, "b_y": np.float32, "p_y": np.float32, "r_counts": np.float32}
+# 10列ある CSV (ヘッダーの列名は使わず位置で読む)
+COLUMNS_10 = ['Timestamp', 'cBlack', 'cBrown', 'cRed', 'Raw1', 'Raw2', 'BallX', 'BallY', 'RallyCount', 'PaddleY']
+CHUNK_ROWS = 100000
+
+
+def _trace_columns(path):
+    """ヘッダー行から (read_csv に渡す引数, 使う列名 -> trace のキー) を決める"""
+    header = pd.read_csv(path, nrows=0).columns
+    if len(header) >= 10:
+        names, options = COLUMNS_10, dict(names=COLUMNS_10, header=None, skiprows=1)
+    else:
+        names, options = list(header), dict(header=0)
+    mapping = {}
+    for name in names:
+        key = name.strip()
+        if key in TRACE_COLUMNS:
+            mapping[name] = TRACE_COLUMNS[key]
+        elif key.lower().replace(' ', '') in RALLY_COLUMNS:
+            mapping[name] = "r_counts"
+    missing = {"timestamp", "c_blk", "c_brn", "c_red", "b_x", "b_y"} - set(mapping.values())
+    if missing:
+        raise ValueError(f"必要な列がありません: {sorted(missing)}")
+    return options, mapping
+
+
+def paddle_from_currents(c_blk, c_brn, c_red):
+    """電流値からパドル上端の位置を一括計算する (3点を通る2次関数の頂点を解析的に求める)"""
+    ydata = np.column_stack([map_current_batch(c, 0, -10) for c in (c_blk, c_brn, c_red)])
+    peak = DISP_X[peak_index_batch(ydata, X_SENSORS, ORIG_H, len(DISP_X))]
+    return np.clip(peak - (P_HEIGHT / 2), 0, ORIG_H - P_HEIGHT).astype(int)
+
+
+def iter_trace(combine_trial2, chunksize=CHUNK_ROWS, keys=None):
+    """CSV を chunksize 行ずつ読み，使う列だけを配列の dict にして順に返すジェネレーター
+
+    dict のキーは c_blk, c_brn, c_red, b_x, b_y, p_y (PaddleY がなければ電流値から計算),
+    r_counts (なければ 0), timestamp (datetime64．読めない行は NaT)．
+    keys を指定するとその列だけを読む (例: ("timestamp",))．
+    列の型を指定して読むので型の推定はせず，メモリ使用量は chunksize 行分に収まる．
+    """
+    options, mapping = _trace_columns(combine_trial2)
+    if keys is not None:
+        mapping = {name: key for name, key in mapping.items() if key in keys}
+    dtype = {name: TRACE_DTYPES[key] for name, key in mapping.items()}
+    with pd.read_csv(combine_trial2, usecols=list(mapping), dtype=dtype, chunksize=chunksize, **options) as reader:
+        for df in reader:
+            chunk = {}
+            for name, key in mapping.items():
+                values = df[name]
+                if key == "timestamp":
+                    values = pd.to_datetime(values, errors='coerce')
+                chunk[key] = values.to_numpy()
+            if keys is None:
+                if "p_y" not in chunk:
+                    chunk["p_y"] = paddle_from_currents(chunk["c_blk"], chunk["c_brn"], chunk["c_red"])
+                if "r_counts" not in chunk:
+                    chunk["r_counts"] = np.zeros(len(df), dtype=np.float32)
+            yield chunk
+
+
+class _RateCounter:
+    """行数とタイムスタンプの最小・最大から記録の周波数を推定する"""
+
+    def __init__(self):
+        self.rows = 0
+        self.valid = 0
+        self.t_min = None
+        self.t_max = None
+
+    def add(self, timestamps):
+        self.rows += len(timestamps)
+        valid = timestamps[~np.isnat(timestamps)]
+        if len(valid):
+            self.valid += len(valid)
+            lo, hi = valid.min(), valid.max()
+            self.t_min = lo if self.t_min is None else min(self.t_min, lo)
+            self.t_max = hi if self.t_max is None else max(self.t_max, hi)
+
+    @property
+    def data_freq(self):
+        if self.valid < 2:
+            return 100.0  # デフォルト
+        duration_sec = (self.t_max - self.t_min) / np.timedelta64(1, 's')
+        return self.rows / duration_sec if duration_sec > 0 else 100.0
+
+
+def scan_trace(combine_trial2, chunksize=CHUNK_ROWS):
+    """タイムスタンプの列だけを読み (total_rows, data_freq) を返す (失敗したら None)"""
     if not os.path.exists(combine_trial2):
         print(f"【エラー】ファイルが見つかりません: {combine_trial2}")
-        return
+        return None
+
+    print(f"【1/4】ファイルを確認中: {combine_trial2} ...")
+    try:
+        rate = _RateCounter()
+        for chunk in iter_trace(combine_trial2, chunksize, keys=("timestamp",)):
+            rate.add(chunk["timestamp"])
+        print(f" -> 確認完了: {rate.rows} 行 / 推定周波数: {rate.data_freq:.2f}Hz")
+    except Exception as e:
+        print(f"【エラー】CSV読み込みに失敗しました: {e}")
+        return None
+    return rate.rows, rate.data_freq
+
+
+def load_trace(combine_trial2, chunksize=CHUNK_ROWS):
+    """CSV を読み込み，描画に使う配列をまとめた dict を返す (失敗したら None)
+
+    全行を配列で持つ (並列描画など任意の行を描く場合)．使う列だけを型を指定して読むので
+    DataFrame 全体を持つよりずっと小さい．先頭から順に描くだけなら stream_frames を使う．
+    """
+    if not os.path.exists(combine_trial2):
+        print(f"【エラー】ファイルが見つかりません: {combine_trial2}")
+        return None
 
     print(f"【1/4】ファイルを読み込み中: {combine_trial2} ...")
     try:
-        # 10列あるCSVにも対応できるよう列名を指定
-        column_names = ['Timestamp', 'cBlack', 'cBrown', 'cRed', 'Raw1', 'Raw2', 'BallX', 'BallY', 'RallyCount', 'PaddleY']
-        # ヘッダーを確認して読み込み
-        temp_df = pd.read_csv(combine_trial2, nrows=1)
-        if len(temp_df.columns) >= 10:
-            df = pd.read_csv(combine_trial2, names=column_names, skiprows=1)
-        else:
-            df = pd.read_csv(combine_trial2)
-            df.columns = df.columns.str.strip()
-            
-        total_rows = len(df)
-        
-        # --- 設定: 再生速度をタイムスタンプから自動計算 ---
-        df['Timestamp'] = pd.to_datetime(df['Timestamp'], errors='coerce')
-        valid_df = df.dropna(subset=['Timestamp'])
-        
-        if len(valid_df) < 2:
-            data_freq = 100.0  # デフォルト
-        else:
-            duration_sec = (valid_df['Timestamp'].max() - valid_df['Timestamp'].min()).total_seconds()
-            data_freq = total_rows / duration_sec if duration_sec > 0 else 100.0
-            
-        print(f" -> 読み込み完了: {total_rows} 行 / 推定周波数: {data_freq:.2f}Hz")
+        rate = _RateCounter()
+        parts = []
+        for chunk in iter_trace(combine_trial2, chunksize):
+            # --- 設定: 再生速度をタイムスタンプから自動計算 ---
+            rate.add(chunk.pop("timestamp"))
+            parts.append(chunk)
+        print(f" -> 読み込み完了: {rate.rows} 行 / 推定周波数: {rate.data_freq:.2f}Hz")
     except Exception as e:
         print(f"【エラー】CSV読み込みに失敗しました: {e}")
-        return
-
-    fps = 30
-    draw_size = 600
-    graph_size = 600
-    y_min, y_max = -15, 10
-    display_sec = 60
-    history_rows = int(data_freq * display_sec)
-
-    # データ抽出
-    c_blk, c_brn, c_red = df['cBlack'].values, df['cBrown'].values, df['cRed'].values
-    b_x, b_y = df['BallX'].values, df['BallY'].values
-    
-    # PaddleYがある場合はそれを使用、ない場合は計算用フラグを立てる
-    p_y_saved = df['PaddleY'].values if 'PaddleY' in df.columns else None
-    
-    relly_col = next((c for c in df.columns if c.lower().replace(' ', '') in ['rellycount', 'rallycount']), None)
-    r_counts = df[relly_col].values if relly_col else np.zeros(total_rows)
-
-    # パドル再現設定 (PaddleYがない場合用)
-    ORIG_H, P_HEIGHT = 1000, 333
-    X_SENSORS = np.array([166, 500, 833])
-    DISP_X = np.linspace(0, ORIG_H, 50)
-
-    def map_current_fixed(val):
-        temp = (val - (-10)) / (0 - (-10))
-        return max(0.0, min(1.0, temp))
-
-    def fit_func(x, a, b, c):
-        return a * np.power(x, 2) + b * x + c
+        return None
 
-    # 動画出力設定
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    output_name = f"{os.path.splitext(combine_trial2)[0]}_realtime_sync.mp4"
-    out = cv2.VideoWriter(output_name, fourcc, fps, (draw_size + graph_size, draw_size))
-    
-    print(f"【2/4】動画作成を開始します (出力先: {output_name})")
-
-    # グラフ背景
-    bg_base = np.full((draw_size, graph_size, 3), (255, 255, 255), dtype=np.uint8)
-    m_l, m_r, m_t, m_b = 65, 30, 70, 65
-    g_w, g_h = graph_size - m_l - m_r, draw_size - m_t - m_b
-    for v in range(int(y_min), int(y_max) + 1):
-        py = draw_size - m_b - int((v - y_min) / (y_max - y_min) * g_h)
-        cv2.line(bg_base, (m_l, py), (graph_size - m_r, py), (240, 240, 240), 1)
-        cv2.putText(bg_base, str(v), (m_l - 35, py + 5), 1, 0.8, (0,0,0), 1)
-
-    start_t = time.time()
-    current_idx_float = 0.0
+    trace = {key: np.concatenate([p[key] for p in parts]) if parts else np.zeros(0)
+             for key in ("c_blk", "c_brn", "c_red", "b_x", "b_y", "p_y", "r_counts")}
+    trace.update(offset=0, total_rows=rate.rows, data_freq=rate.data_freq)
+    return trace
 
-    # --- 3/4 メインループ ---
+
+def iter_frame_indices(total_rows, data_freq, fps=FPS):
+    """各フレームで表示する行番号を順に返す (インデックスを正確なHzに基づいて進める)"""
+    current_idx_float = 0.0
     while int(current_idx_float) < total_rows:
-        idx = int(current_idx_float)
-        
-        # パドル位置計算（保存データがあればそれを優先）
-        if p_y_saved is not None:
-            paddle_y = int(p_y_saved[idx])
+        yield int(current_idx_float)
+        current_idx_float += (data_freq / fps)
+
+
+def frame_indices(total_rows, data_freq, fps=FPS):
+    """各フレームで表示する行番号のリスト"""
+    return list(iter_frame_indices(total_rows, data_freq, fps))
+
+
+def stream_frames(combine_trial2, total_rows, data_freq, renderer="composite", waveform="scroll",
+                  chunksize=CHUNK_ROWS):
+    """CSV を chunksize 行ずつ読みながら先頭から順にフレームを描いて返すジェネレーター
+
+    保持するのは直近の DISPLAY_SEC 秒 (+1秒) 分の行と読み込み中の chunksize 行だけなので，
+    記録の長さによらずメモリ使用量は一定．描くフレームは load_trace + make_renderer と同じ．
+    返すフレームは renderer の内部バッファのことがあるので，次のフレームまでに書き出すかコピーすること．
+    """
+    keep = int(data_freq * (DISPLAY_SEC + 1)) + 1
+    trace = {"offset": 0, "total_rows": total_rows, "data_freq": data_freq}
+    frames = None
+    indices = iter_frame_indices(total_rows, data_freq)
+    idx = next(indices, None)
+    for chunk in iter_trace(combine_trial2, chunksize):
+        del chunk["timestamp"]
+        # 窓 = 前の窓の末尾 keep 行 + 新しい chunk
+        if frames is None:
+            trace.update(chunk)
         else:
-            try:
-                ydata = np.array([map_current_fixed(c_blk[idx]), map_current_fixed(c_brn[idx]), map_current_fixed(c_red[idx])])
-                popt, _ = opt.curve_fit(fit_func, X_SENSORS, ydata, maxfev=500)
-                raw_pos = DISP_X[np.argmax(fit_func(DISP_X, *popt))] - (P_HEIGHT / 2)
-                paddle_y = int(max(0, min(ORIG_H - P_HEIGHT, raw_pos)))
-            except:
-                paddle_y = 333
+            n = len(trace["c_blk"])
+            drop = max(0, n - keep)
+            trace["offset"] += drop
+            for key, values in chunk.items():
+                trace[key] = np.concatenate([trace[key][drop:], values])
+        end = trace["offset"] + len(trace["c_blk"])
+        if frames is None:
+            frames = make_renderer(trace, renderer, waveform)
+        else:
+            frames.rebase()
+        while idx is not None and idx < end:
+            yield frames.render(idx)
+            idx = next(indices, None)
+
+
+class FrameRenderer:
+    """行番号から1フレーム (ゲーム画面 + 電流波形) を描く．同じ行番号からは常に同じ画像を返す
+
+    trace の配列は行 offset から始まる (stream_frames では直近の行だけを持つ窓)．
+    """
+
+    def __init__(self, trace):
+        self.trace = trace
+        self.history_rows = int(trace["data_freq"] * DISPLAY_SEC)
+
+        # グラフ背景
+        self.bg_base = np.full((DRAW_SIZE, GRAPH_SIZE, 3), (255, 255, 255), dtype=np.uint8)
+        self.m_l, self.m_r, self.m_t, self.m_b = 65, 30, 70, 65
+        self.g_w, self.g_h = GRAPH_SIZE - self.m_l - self.m_r, DRAW_SIZE - self.m_t - self.m_b
+        for v in range(int(Y_MIN), int(Y_MAX) + 1):
+            py = DRAW_SIZE - self.m_b - int((v - Y_MIN) / (Y_MAX - Y_MIN) * self.g_h)
+            cv2.line(self.bg_base, (self.m_l, py), (GRAPH_SIZE - self.m_r, py), (240, 240, 240), 1)
+            cv2.putText(self.bg_base, str(v), (self.m_l - 35, py + 5), 1, 0.8, (0,0,0), 1)
+
+    def rebase(self):
+        """trace の窓が進んだときに呼ぶ"""
+
+    def render(self, idx):
+        t = self.trace
+        m_l, m_r, m_t, m_b, g_w, g_h = self.m_l, self.m_r, self.m_t, self.m_b, self.g_w, self.g_h
+        data_freq = t["data_freq"]
+        b_x, b_y = t["b_x"], t["b_y"]
+        i = idx - t["offset"]
+
+        # パドル位置（保存データがない場合は事前に一括計算した値）
+        paddle_y = int(t["p_y"][i])
 
         # ゲーム画面
         game_f = np.full((ORIG_H, ORIG_H, 3), (255, 186, 111), dtype=np.uint8)
         cv2.line(game_f, (500, 0), (500, 1000), (0, 0, 0), 3)
         for h in [333, 666]: cv2.line(game_f, (0, h), (1000, h), (0, 0, 0), 3)
         cv2.rectangle(game_f, (10, paddle_y), (35, paddle_y + P_HEIGHT), (255, 255, 255), -1)
-        cv2.rectangle(game_f, (int(b_x[idx]), int(b_y[idx])), (int(b_x[idx])+35, int(b_y[idx])+35), (255, 255, 255), -1)
-        cv2.putText(game_f, str(int(r_counts[idx])), (470, 90), cv2.FONT_HERSHEY_SIMPLEX, 3, (255, 255, 255), 5)
-        game_f = cv2.resize(game_f, (draw_size, draw_size))
+        cv2.rectangle(game_f, (int(b_x[i]), int(b_y[i])), (int(b_x[i])+35, int(b_y[i])+35), (255, 255, 255), -1)
+        cv2.putText(game_f, str(int(t["r_counts"][i])), (470, 90), cv2.FONT_HERSHEY_SIMPLEX, 3, (255, 255, 255), 5)
+        game_f = cv2.resize(game_f, (DRAW_SIZE, DRAW_SIZE))
 
         # グラフ画面
-        graph_f = bg_base.copy()
+        graph_f = self.bg_base.copy()
         ts = idx / data_freq
-        d_start = max(0, ts - display_sec)
-        
+        d_start = max(0, ts - DISPLAY_SEC)
+
         # 波形プロット
-        p_idx = np.arange(max(0, idx - history_rows), idx + 1, 5) 
+        p_idx = np.arange(max(0, idx - self.history_rows), idx + 1, 5)
         if len(p_idx) > 1:
-            x_pts = (m_l + (p_idx / data_freq - d_start) / display_sec * g_w).astype(np.int32)
-            for d, col in [(c_blk, (0,0,0)), (c_brn, (42,42,165)), (c_red, (0,0,255))]:
-                y_pts = (draw_size - m_b - ((d[p_idx] - y_min) / (y_max - y_min) * g_h)).astype(np.int32)
+            x_pts = (m_l + (p_idx / data_freq - d_start) / DISPLAY_SEC * g_w).astype(np.int32)
+            for d, col in [(t["c_blk"], (0,0,0)), (t["c_brn"], (42,42,165)), (t["c_red"], (0,0,255))]:
+                y_pts = (DRAW_SIZE - m_b - ((d[p_idx - t["offset"]] - Y_MIN) / (Y_MAX - Y_MIN) * g_h)).astype(np.int32)
                 cv2.polylines(graph_f, [np.column_stack([x_pts, y_pts])], False, col, 1, cv2.LINE_AA)
 
         # 最後に枠線を描画
-        cv2.rectangle(graph_f, (m_l, m_t), (draw_size - m_r, draw_size - m_b), (0, 0, 0), 2)
+        cv2.rectangle(graph_f, (m_l, m_t), (DRAW_SIZE - m_r, DRAW_SIZE - m_b), (0, 0, 0), 2)
         cv2.putText(graph_f, f"Time: {ts:.1f}s", (m_l, m_t - 15), 1, 1.2, (0,0,0), 1)
 
-        out.write(np.hstack((game_f, graph_f)))
-        
-        # インデックスを正確なHzに基づいて進める
-        current_idx_float += (data_freq / fps)
+        return np.hstack((game_f, graph_f))
+
+
+WAVE_COLORS = ((0,0,0), (42,42,165), (0,0,255))   # cBlack, cBrown, cRed
+
+
+class ScrollingWaveform:
+    """電流波形のグラフを1画素列ずつ左へ送りながら描く
+
+    波形は1画素列 (DISPLAY_SEC / 列数 秒) ごとの最小値〜最大値の縦線で表す．全行の y 座標と
+    列ごとの最小・最大は最初に一括で求め，毎フレームはキャンバスを経過した列数だけ左へずらして
+    新しく届いた列 (と描きかけだった最後の列) だけを描く．表示する秒数によらず1フレームの処理は同じ．
+    フレームを飛ばした・戻した場合は全体を描き直す (描き直しても同じ画像になる)．
+    trace が直近の行だけを持つ窓の場合は，窓が進むたびに rebase() で列ごとの値を求め直す．
+    """
+
+    def __init__(self, trace, background, left, top, width, height):
+        self.left, self.top = left, top
+        self.width = width                    # 表示する列数 - 1 (DISPLAY_SEC 秒分)
+        self.bottom = top + height
+        self.background = background[top:top + height + 1, left:left + width + 1].copy()
+        self.canvas = self.background.copy()
+        self._state = None
+        self.rebase(trace)
+
+    def rebase(self, trace):
+        """trace の行 (offset から) の y 座標と列ごとの縦線の範囲を求める
+
+        窓の最初の列は前の行が欠けているので正しくないが，窓は表示する秒数より長いので描かれない．
+        """
+        height = self.bottom - self.top
+        # 各行が入る画素列
+        self.row0 = row0 = trace["offset"]
+        n = len(trace["c_blk"])
+        self.sample_col = (np.arange(row0, row0 + n) * (self.width / (trace["data_freq"] * DISPLAY_SEC))).astype(np.int64)
+        # 列の最初の行 (行がなければ列もない)
+        starts = np.flatnonzero(np.r_[True, self.sample_col[1:] != self.sample_col[:-1]]) if n else np.zeros(0, dtype=np.int64)
+        ends = np.r_[starts[1:], n]
+        self.col0 = int(self.sample_col[0]) if n else 0
+        cols = self.sample_col[starts] - self.col0
+        ncol = int(self.sample_col[-1]) + 1 - self.col0 if n else 0
+        # 列の最初の行 (描きかけの列の最小・最大を求めるのに使う)
+        self.col_start = np.zeros(ncol, dtype=np.int64)
+        self.col_start[cols] = starts + row0
+
+        # 列ごとの縦線の範囲 (画素．値のない列は lo > hi)
+        self.y = []
+        self.lo = []
+        self.hi = []
+        for key in ("c_blk", "c_brn", "c_red"):
+            y = (self.bottom - ((np.asarray(trace[key], dtype=np.float64) - Y_MIN) / (Y_MAX - Y_MIN) * height)).astype(np.float32)
+            self.y.append(y)
+            lo = np.full(ncol, np.nan, dtype=np.float32)
+            hi = np.full(ncol, np.nan, dtype=np.float32)
+            if n:
+                lo[cols] = np.fmin.reduceat(y, starts)
+                hi[cols] = np.fmax.reduceat(y, starts)
+                # 前の列の最後の値まで伸ばして列どうしをつなげる
+                prev = np.r_[np.nan, y[ends - 1][:-1]]
+                lo[cols] = np.fmin(lo[cols], prev)
+                hi[cols] = np.fmax(hi[cols], prev)
+            self.lo.append(self._pixel(lo, self.bottom + 1))
+            self.hi.append(self._pixel(hi, self.top - 1))
+
+    def _pixel(self, v, missing):
+        """y 座標をグラフ内の画素に丸める (NaN は missing)"""
+        v = np.asarray(v, dtype=np.float64)
+        p = np.clip(np.round(np.nan_to_num(v, nan=0.0)), self.top, self.bottom).astype(np.int64)
+        return np.where(np.isnan(v), missing, p)
+
+    def _draw(self, c0, c1, first, idx):
+        """列 c0〜c1 を背景に戻してから描く (first はキャンバス左端の列．最後の列 c1 は行 idx まで)"""
+        x0, x1 = c0 - first, c1 - first + 1
+        view = self.canvas[:, x0:x1]
+        np.copyto(view, self.background[:, x0:x1])
+        start = self.col_start[c1 - self.col0] - self.row0
+        k0, k1 = c0 - self.col0, c1 - self.col0 + 1
+        top = self.top
+        for ch, color in enumerate(WAVE_COLORS):
+            lo = self.lo[ch][k0:k1].tolist()
+            hi = self.hi[ch][k0:k1].tolist()
+            # 描きかけの列は前の列の最後の値から行 idx までで求める
+            part = self.y[ch][max(start - 1, 0):idx - self.row0 + 1]
+            low, high = float(np.fmin.reduce(part)), float(np.fmax.reduce(part))
+            if low == low:
+                lo[-1] = min(max(round(low), top), self.bottom)
+                hi[-1] = min(max(round(high), top), self.bottom)
+            else:
+                lo[-1], hi[-1] = self.bottom + 1, top - 1
+            for x, (y0, y1) in enumerate(zip(lo, hi)):
+                if y0 <= y1:
+                    view[y0 - top:y1 - top + 1, x] = color
+
+    def render(self, graph_f, idx):
+        """行 idx までの波形を graph_f (グラフ画面) に写す"""
+        col = int(self.sample_col[idx - self.row0])
+        first = max(0, col - self.width)
+        state = self._state
+        if state is None or idx < state[0] or first - state[2] > self.width:
+            np.copyto(self.canvas, self.background)
+            self._draw(first, col, first, idx)
+        else:
+            shift = first - state[2]
+            if shift:
+                self.canvas[:, :-shift] = self.canvas[:, shift:]
+            self._draw(max(state[1], first), col, first, idx)
+        self._state = (idx, col, first)
+        h, w = self.canvas.shape[:2]
+        np.copyto(graph_f[self.top:self.top + h, self.left:self.left + w], self.canvas)
+
+
+class FrameCompositor(FrameRenderer):
+    """FrameRenderer と同じフレームを出力解像度で直接描く
 
-        if idx % 5000 == 0:
-            prog = (idx / total_rows) * 100
-            elapsed = time.time() - start_t
-            eta = (elapsed / (idx + 1)) * (total_rows - idx) if idx > 0 else 0
-            print(f"\r進捗: {prog:5.1f}% | 残り: {int(eta)}秒 ", end="")
+    背景・格子線・グラフの目盛りは最初に1回だけ出力解像度で描いておき，毎フレームは
+    それを使い回すバッファに写してからパドル・ボール・スコア・波形・時刻だけを描く．
+    1000×1000 の画面の確保と縮小 (cv2.resize) を行わないので数倍速い
+    (縮小による輪郭のぼかしがない分だけ FrameRenderer の画像とはわずかに異なる)．
+    render() は内部のバッファを返すので，次の render() までに書き出すかコピーすること．
+    waveform="scroll" では波形を ScrollingWaveform で描き，"polyline" では毎フレーム折れ線で描き直す．
+    """
 
+    def __init__(self, trace, waveform="scroll"):
+        super().__init__(trace)
+        self.waveform = None
+        self._graphReady = False
+        if waveform == "scroll":
+            self.waveform = ScrollingWaveform(trace, self.bg_base, self.m_l, self.m_t, self.g_w, self.g_h)
+        self.scale = DRAW_SIZE / ORIG_H
+        # ゲーム画面の背景と格子線 (FrameRenderer で縮小した画像と同じ)
+        game_f = np.full((ORIG_H, ORIG_H, 3), (255, 186, 111), dtype=np.uint8)
+        cv2.line(game_f, (500, 0), (500, 1000), (0, 0, 0), 3)
+        for h in [333, 666]: cv2.line(game_f, (0, h), (1000, h), (0, 0, 0), 3)
+        self.game_bg = cv2.resize(game_f, (DRAW_SIZE, DRAW_SIZE))
+        self.frame = np.empty((DRAW_SIZE, DRAW_SIZE + GRAPH_SIZE, 3), dtype=np.uint8)
+        self.game_view = self.frame[:, :DRAW_SIZE]
+        self.graph_view = self.frame[:, DRAW_SIZE:]
+        # パドル・ボール・スコアの出力解像度での位置と大きさ
+        self.paddle_x = (round(10 * self.scale), round(35 * self.scale))
+        self.paddle_h = round(P_HEIGHT * self.scale)
+        self.ball_size = round(35 * self.scale)
+        self.score_pos = (round(470 * self.scale), round(90 * self.scale))
+        self.score_style = (cv2.FONT_HERSHEY_SIMPLEX, 3 * self.scale, (255, 255, 255), max(1, round(5 * self.scale)))
+
+    def rebase(self):
+        if self.waveform is not None:
+            self.waveform.rebase(self.trace)
+
+    def render(self, idx):
+        t = self.trace
+        s = self.scale
+        m_l, m_r, m_t, m_b, g_w, g_h = self.m_l, self.m_r, self.m_t, self.m_b, self.g_w, self.g_h
+        data_freq = t["data_freq"]
+
+        # ゲーム画面 (背景を写してから動く部分だけ描く)
+        game_f = self.game_view
+        np.copyto(game_f, self.game_bg)
+        i = idx - t["offset"]
+        paddle_y = round(int(t["p_y"][i]) * s)
+        cv2.rectangle(game_f, (self.paddle_x[0], paddle_y), (self.paddle_x[1], paddle_y + self.paddle_h), (255, 255, 255), -1)
+        bx, by = round(int(t["b_x"][i]) * s), round(int(t["b_y"][i]) * s)
+        cv2.rectangle(game_f, (bx, by), (bx + self.ball_size, by + self.ball_size), (255, 255, 255), -1)
+        font, scale, color, thickness = self.score_style
+        cv2.putText(game_f, str(int(t["r_counts"][i])), self.score_pos, font, scale, color, thickness)
+
+        # グラフ画面
+        graph_f = self.graph_view
+        if self.waveform is None or not self._graphReady:
+            np.copyto(graph_f, self.bg_base)
+            self._graphReady = True
+        else:
+            # 波形のキャンバス・枠線以外で毎フレーム変わるのは時刻の表示のみ
+            np.copyto(graph_f[:m_t - 2], self.bg_base[:m_t - 2])
+        ts = idx / data_freq
+        d_start = max(0, ts - DISPLAY_SEC)
+
+        # 波形プロット
+        if self.waveform is not None:
+            self.waveform.render(graph_f, idx)
+        else:
+            p_idx = np.arange(max(0, idx - self.history_rows), idx + 1, 5)
+            if len(p_idx) > 1:
+                x_pts = (m_l + (p_idx / data_freq - d_start) / DISPLAY_SEC * g_w).astype(np.int32)
+                for d, col in zip((t["c_blk"], t["c_brn"], t["c_red"]), WAVE_COLORS):
+                    y_pts = (DRAW_SIZE - m_b - ((d[p_idx - t["offset"]] - Y_MIN) / (Y_MAX - Y_MIN) * g_h)).astype(np.int32)
+                    cv2.polylines(graph_f, [np.column_stack([x_pts, y_pts])], False, col, 1, cv2.LINE_AA)
+
+        # 最後に枠線を描画
+        cv2.rectangle(graph_f, (m_l, m_t), (DRAW_SIZE - m_r, DRAW_SIZE - m_b), (0, 0, 0), 2)
+        cv2.putText(graph_f, f"Time: {ts:.1f}s", (m_l, m_t - 15), 1, 1.2, (0,0,0), 1)
+
+        return self.frame
+
+
+RENDERERS = {"composite": FrameCompositor, "legacy": FrameRenderer}
+
+
+def make_renderer(trace, renderer="composite", waveform="scroll"):
+    if renderer == "composite":
+        return FrameCompositor(trace, waveform)
+    return RENDERERS[renderer](trace)
+
+
+class FfmpegWriter:
+    """生の BGR フレームをパイプで ffmpeg に渡してエンコードする (cv2.VideoWriter と同じく write() / release())"""
+
+    def __init__(self, ffmpeg, path, size, codec="libx264", crf=23, preset="veryfast"):
+        cmd = [ffmpeg, "-v", "error", "-y", "-f", "rawvideo", "-pix_fmt", "bgr24",
+               "-s", f"{size[0]}x{size[1]}", "-r", str(FPS), "-i", "-", "-an", "-c:v", codec]
+        if crf is not None:
+            cmd += ["-crf", str(crf)]
+        if preset:
+            cmd += ["-preset", preset]
+        cmd += ["-pix_fmt", "yuv420p", path]
+        self.path = path
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        self.proc.stdin.write(np.ascontiguousarray(frame).data)
+
+    def release(self):
+        if self.proc.stdin.closed:
+            return
+        self.proc.stdin.close()
+        if self.proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg がエラーで終了しました (終了コード {self.proc.returncode}): {self.path}")
+
+
+class ThreadedEncoder:
+    """有界キューでフレームを受け取り，専用スレッドでエンコードする
+
+    描画とエンコードを並行に進める．キューが満杯のときは write() が空くまで待つ．
+    フレームはコピーしてから渡すので，描画側は同じバッファを使い回してよい．
+    """
+
+    def __init__(self, writer, maxQueue=ENCODE_QUEUE):
+        self.writer = writer
+        self.frames = 0
+        self.encodeTime = 0.0   # エンコードにかかった時間 [s]
+        self.waitTime = 0.0     # 描画側がキューの空きを待った時間 [s]
+        self.idleTime = 0.0     # エンコード側がフレームを待った時間 [s]
+        self._error = None
+        self._queue = queue.Queue(maxQueue)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, frame):
+        if self._error is not None:
+            raise self._error
+        frame = frame.copy()
+        t = time.perf_counter()
+        self._queue.put(frame)
+        self.waitTime += time.perf_counter() - t
+
+    def _run(self):
+        while True:
+            t = time.perf_counter()
+            frame = self._queue.get()
+            t1 = time.perf_counter()
+            self.idleTime += t1 - t
+            if frame is None:
+                break
+            if self._error is not None:
+                continue  # エラー後は release() まで読み捨てる
+            try:
+                self.writer.write(frame)
+            except Exception as e:
+                self._error = e
+            self.encodeTime += time.perf_counter() - t1
+            self.frames += 1
+
+    def release(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self.writer.release()
+        if self._error is not None:
+            raise self._error
+
+
+class _SyncEncoder:
+    """描画と同じスレッドでエンコードする (従来どおり．ThreadedEncoder と同じ統計を取る)"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.frames = 0
+        self.encodeTime = 0.0
+        self.waitTime = 0.0
+        self.idleTime = 0.0
+
+    def write(self, frame):
+        t = time.perf_counter()
+        self.writer.write(frame)
+        self.encodeTime += time.perf_counter() - t
+        self.frames += 1
+
+    def release(self):
+        self.writer.release()
+
+
+def open_encoder(path, encoder="thread", codec="libx264", crf=23, preset="veryfast", maxQueue=ENCODE_QUEUE):
+    """動画の書き出し先を開く
+
+    encoder : "thread" (cv2.VideoWriter を専用スレッドで) / "ffmpeg" (ffmpeg へ生フレームをパイプで渡す．
+              エンコードは ffmpeg のプロセスで行い，パイプへの書き込みを専用スレッドで行う) /
+              "cv2" (cv2.VideoWriter を描画と同じスレッドで)
+    codec, crf, preset : ffmpeg のエンコード設定 (crf / preset は None で指定しない)
+    """
+    size = (DRAW_SIZE + GRAPH_SIZE, DRAW_SIZE)
+    if encoder == "ffmpeg":
+        ffmpeg = shutil.which("ffmpeg")
+        if ffmpeg is None:
+            raise RuntimeError("ffmpeg が見つかりません (--encoder thread を使ってください)")
+        return ThreadedEncoder(FfmpegWriter(ffmpeg, path, size, codec, crf, preset), maxQueue)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), FPS, size)
+    if encoder == "cv2":
+        return _SyncEncoder(writer)
+    return ThreadedEncoder(writer, maxQueue)
+
+
+def _stage_stats(frames, renderTime, out, elapsed):
+    """描画・エンコードそれぞれの処理速度 [フレーム/s] と待ち時間を表示する"""
+    def rate(n, t):
+        return f"{n / t:7.1f} fps" if t > 0 else "      - fps"
+    print(f" 描画       : {rate(frames, renderTime)} ({renderTime:.1f} 秒)")
+    print(f" エンコード : {rate(out.frames, out.encodeTime)} ({out.encodeTime:.1f} 秒, "
+          f"フレーム待ち {out.idleTime:.1f} 秒)")
+    print(f" キュー待ち : {out.waitTime:.1f} 秒 (エンコードが追いつかず描画が止まった時間)")
+    print(f" 全体       : {rate(frames, elapsed)} ({elapsed:.1f} 秒)")
+
+
+class _Progress:
+    """全ワーカーの書き出し済みフレーム数から進捗と残り時間を表示する"""
+
+    def __init__(self, total):
+        self.total = total
+        self.start_t = time.time()
+        self.last = 0.0
+
+    def show(self, done, force=False):
+        now = time.time()
+        if not force and now - self.last < 1.0:
+            return
+        self.last = now
+        elapsed = now - self.start_t
+        if self.total <= 0:
+            return  # 描くフレームがない
+        eta = elapsed / done * (self.total - done) if done > 0 else 0
+        print(f"\r進捗: {done / self.total * 100:5.1f}% | 残り: {int(eta)}秒 ", end="")
+
+
+# --- 並列モードのワーカー ---
+
+_worker = {}
+
+
+def _init_worker(trace, counter, renderer, waveform, encoding=None):
+    _worker["renderer"] = make_renderer(trace, renderer, waveform)
+    _worker["counter"] = counter
+    _worker["encoding"] = encoding or {}
+
+
+def _render_segment(task):
+    """区間のフレームを描いて区間の動画ファイルに書き出す"""
+    path, indices = task
+    renderer, counter = _worker["renderer"], _worker["counter"]
+    out = open_encoder(path, **_worker["encoding"])
+    for n, idx in enumerate(indices, 1):
+        out.write(renderer.render(idx))
+        # 進捗は1秒分ごとにまとめて数える
+        if n % FPS == 0:
+            with counter.get_lock():
+                counter.value += FPS
     out.release()
+    with counter.get_lock():
+        counter.value += len(indices) % FPS
+    return path
+
+
+def _render_chunk(indices):
+    """フレームを描いて返す (ffmpeg がない場合．書き出しはメインプロセスで行う)"""
+    renderer = _worker["renderer"]
+    return [renderer.render(idx).copy() for idx in indices]
+
+
+def _concat_segments(ffmpeg, paths, output_name):
+    """区間の動画を再エンコードせずに (ストリームのコピーで) 1つの動画につなげる"""
+    listfile = os.path.join(os.path.dirname(paths[0]), "segments.txt")
+    with open(listfile, "w") as f:
+        for p in paths:
+            f.write(f"file '{os.path.abspath(p)}'\n")
+    subprocess.run([ffmpeg, "-v", "error", "-y", "-f", "concat", "-safe", "0", "-i", listfile,
+                    "-c", "copy", output_name], check=True)
+
+
+def create_replay_video(combine_trial2, workers=1, segment_sec=SEGMENT_SEC, renderer="composite", waveform="scroll",
+                        encoder="thread", codec="libx264", crf=23, preset="veryfast", chunksize=CHUNK_ROWS,
+                        segments=False):
+    """combined_data CSV からゲームの再現動画 (<CSV名>_realtime_sync.mp4) を作る
+
+    workers : 描画に使うプロセス数．1 では1プロセスで CSV を chunksize 行ずつ読みながら順に描く
+              (stream_frames．記録の長さによらずメモリ使用量は一定)．
+              2以上では描画のみプロセスプールで並列に行い，描いたフレームをメインプロセスが順に書き出す
+              (出力は1プロセスで描いた場合とバイト単位で同じ．全行を配列で持つ load_trace を使う)．
+    segments : True で workers が2以上のとき，再生時間を segment_sec 秒ごとの区間に分けて各ワーカーが
+               区間ごとの動画を書き出し，ffmpeg で再エンコードせずにつなげる (エンコードも並列になるので最速．
+               ただし区間ごとにキーフレーム・レート制御が始めからになるので，出力は1プロセスで描いた場合と同一ではない)．
+               ffmpeg がない場合は segments=False と同じ．
+    renderer : "composite" (FrameCompositor．出力解像度で描く) / "legacy" (FrameRenderer．従来の描画)
+    waveform : "scroll" (ScrollingWaveform．新しい列だけ描く) / "polyline" (毎フレーム折れ線で描く．composite のみ)
+    encoder  : "thread" / "ffmpeg" / "cv2" (open_encoder を参照)．"thread" と "ffmpeg" では描画と
+               エンコードを並行に行い，終了時に段ごとの処理速度を表示する
+    codec, crf, preset : encoder="ffmpeg" のときのエンコード設定
+    """
+    if workers <= 1:
+        # 行数と周波数だけを先に求め，描画は読み込みながら行う
+        info = scan_trace(combine_trial2, chunksize)
+        if info is None:
+            return
+        total_rows, data_freq = info
+        frame_count = sum(1 for _ in iter_frame_indices(total_rows, data_freq))
+    else:
+        trace = load_trace(combine_trial2, chunksize)
+        if trace is None:
+            return
+        indices = frame_indices(trace["total_rows"], trace["data_freq"])
+        frame_count = len(indices)
+
+    # 動画出力設定
+    output_name = f"{os.path.splitext(combine_trial2)[0]}_realtime_sync.mp4"
+    progress = _Progress(frame_count)
+    ffmpeg = shutil.which("ffmpeg")
+    encoding = dict(encoder=encoder, codec=codec, crf=crf, preset=preset)
+    out = None
+    render_t = 0.0
+    start_t = time.perf_counter()
+
+    print(f"【2/4】動画作成を開始します (出力先: {output_name}, {frame_count} フレーム, {workers} プロセス, "
+          f"エンコード: {encoder})")
+
+    # --- 3/4 メインループ ---
+    if workers <= 1:
+        frames = stream_frames(combine_trial2, total_rows, data_freq, renderer, waveform, chunksize)
+        out = open_encoder(output_name, **encoding)
+        n = 0
+        while True:
+            # 描画の段の時間には CSV の読み込みも含む
+            t = time.perf_counter()
+            frame = next(frames, None)
+            render_t += time.perf_counter() - t
+            if frame is None:
+                break
+            out.write(frame)
+            n += 1
+            progress.show(n)
+        out.release()
+    elif segments and ffmpeg:
+        # 区間ごとに描画・書き出しし，最後につなげる (区間の境目でエンコードが独立するので逐次描画とは同一でない)
+        segment = max(1, int(segment_sec * FPS))
+        counter = mp.Value('q', 0)
+        with tempfile.TemporaryDirectory(prefix="replay_", dir=os.path.dirname(os.path.abspath(output_name))) as tmp:
+            tasks = [(os.path.join(tmp, f"segment_{k:05d}.mp4"), indices[i:i + segment])
+                     for k, i in enumerate(range(0, len(indices), segment))]
+            with mp.Pool(workers, initializer=_init_worker,
+                         initargs=(trace, counter, renderer, waveform, encoding)) as pool:
+                result = pool.map_async(_render_segment, tasks)
+                while not result.ready():
+                    result.wait(1.0)
+                    progress.show(counter.value)
+                paths = result.get()
+            print(f"\n -> {len(paths)} 区間を結合中 ...")
+            _concat_segments(ffmpeg, paths, output_name)
+    else:
+        if segments:
+            print(" -> ffmpeg が見つからないため，描画のみ並列に行い書き出しはこのプロセスで行います")
+        chunk = FPS
+        out = open_encoder(output_name, **encoding)
+        done = 0
+        with mp.Pool(workers, initializer=_init_worker, initargs=(trace, None, renderer, waveform)) as pool:
+            chunks = (indices[i:i + chunk] for i in range(0, len(indices), chunk))
+            # 依頼中のまとまりは workers * RENDER_AHEAD 個まで (最も古い結果を書き出してから次を依頼する．
+            # Pool.imap は全てを一度に依頼するため，書き出しが遅いと描いたフレームが溜まり続ける)
+            pending = deque()
+            while True:
+                while len(pending) < workers * RENDER_AHEAD:
+                    task = next(chunks, None)
+                    if task is None:
+                        break
+                    pending.append(pool.apply_async(_render_chunk, (task,)))
+                if not pending:
+                    break
+                # 描画の段の時間はワーカーの結果を待った時間
+                t = time.perf_counter()
+                frames = pending.popleft().get()
+                render_t += time.perf_counter() - t
+                for frame in frames:
+                    out.write(frame)
+                done += len(frames)
+                progress.show(done)
+        out.release()
+
+    progress.show(frame_count, force=True)
     print(f"\n【4/4】完了: {output_name}")
+    if out is not None:
+        _stage_stats(frame_count, render_t, out, time.perf_counter() - start_t)
 
 if __name__ == "__main__":
-    files = glob.glob("*combine*.csv")
-    if files:
-        target = max(files, key=os.path.getmtime) # getctimeよりgetmtime（最終更新）が確実
-        create_replay_video(target)
+    parser = argparse.ArgumentParser(description="combined_data CSV からゲームの再現動画を作成")
+    parser.add_argument("path", nargs="?", help="CSV (省略時は最新の *combine*.csv)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="描画に使うプロセス数 (既定の 1 は読み込みながら描くのでメモリ使用量が一定．"
+                             "2以上は全行を読み込んでから並列に描く)")
+    parser.add_argument("--segments", action="store_true",
+                        help="区間ごとに各プロセスがエンコードし ffmpeg でつなげる (最速．出力は逐次描画と同一ではない)")
+    parser.add_argument("--segment-sec", type=float, default=SEGMENT_SEC, help="--segments の1区間の長さ [s] (動画の時間)")
+    parser.add_argument("--renderer", choices=sorted(RENDERERS), default="composite",
+                        help="composite: 出力解像度で背景を使い回して描く / legacy: 従来の描画 (1000×1000 から縮小)")
+    parser.add_argument("--waveform", choices=("scroll", "polyline"), default="scroll",
+                        help="scroll: 波形を左へ送り新しい部分だけ描く / polyline: 毎フレーム折れ線で描く")
+    parser.add_argument("--encoder", choices=ENCODERS, default="thread",
+                        help="thread: cv2 の書き出しを専用スレッドで / ffmpeg: ffmpeg へパイプで渡す / cv2: 描画と同じスレッドで")
+    parser.add_argument("--codec", default="libx264", help="--encoder ffmpeg のコーデック")
+    parser.add_argument("--crf", type=int, default=23, help="--encoder ffmpeg の CRF (画質．小さいほど高画質)")
+    parser.add_argument("--preset", default="veryfast", help="--encoder ffmpeg のプリセット")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="CSV を一度に読む行数")
+    args = parser.parse_args()
+    target = args.path
+    if target is None:
+        files = glob.glob("*combine*.csv")
+        if files:
+            target = max(files, key=os.path.getmtime) # getctimeよりgetmtime（最終更新）が確実
+    if target:
+        create_replay_video(target, args.workers, args.segment_sec, args.renderer, args.waveform,
+                            args.encoder, args.codec, args.crf, args.preset, args.chunk_rows, args.segments)